@@ -1,7 +1,26 @@
 import streamlit as st
-import pandas as pd
-import io
-import engine  # Tu archivo de lógica
+import os
+import time
+import cache_disco
+import pipeline
+import perfilado
+import trabajos
+import vista_previa
+
+# La app no lee las bases: caché de lectores, diccionario de empresas y perfilado
+# se configuran en cada proceso de la cola (trabajos._iniciar_proceso)
+
+@st.cache_resource
+def cola_trabajos():
+    """Una cola por servidor: las conciliaciones siguen corriendo aunque la página se vuelva a ejecutar."""
+    return trabajos.ColaTrabajos()
+
+@st.cache_resource
+def vista(ruta):
+    """Vista previa de un resultado; las consultas corren en el servidor y solo llega la página pedida."""
+    return vista_previa.VistaPrevia(ruta)
+
+_rerun = getattr(st, 'rerun', None) or st.experimental_rerun
 
 # --- CONFIGURACIÓN DE PÁGINA ---
 st.set_page_config(
@@ -141,97 +160,96 @@ col_b1, col_b2, col_b3 = st.columns([1, 2, 1])
 
 with col_b2:
     process_btn = st.button("🚀  EJECUTAR CONCILIACIÓN AUTOMÁTICA")
+    buscar_probables = st.checkbox("Buscar coincidencias probables en los sobrantes (folios con ceros, prefijo faltante o dígitos transpuestos)")
+    buscar_por_monto = st.checkbox("Emparejar sobrantes sin referencia por NIT, monto y fecha")
 
 # --- LÓGICA DE PROCESAMIENTO ---
 if process_btn:
     if not file_dian or not file_cont:
         st.error("⚠️  ¡Atención! Faltan archivos obligatorios. Por favor carga el **Excel de la DIAN** y la **Contabilidad**.")
     else:
-        status_box = st.empty()
-        progress_bar = st.progress(0)
-        
-        try:
-            # 1. LECTURA
-            status_box.markdown("🔄 **Leyendo y normalizando datos de la DIAN...**")
-            progress_bar.progress(15)
-            df_dian_raw = engine.leer_dian(file_dian)
-            df_dian_raw = engine.crear_llave_conciliacion(df_dian_raw)
-            
-            # Separar DIAN
-            df_dian_gastos = engine.filtrar_dian_gastos(df_dian_raw)
-            df_dian_ingresos = engine.filtrar_dian_ingresos(df_dian_raw)
-            
-            status_box.markdown("🔄 **Procesando contabilidad Netsuite...**")
-            progress_bar.progress(35)
-            df_cont_full = engine.leer_contabilidad_completa(file_cont)
-            
-            if df_cont_full is None:
-                st.error("❌ Error leyendo el archivo contable. Verifica el formato.")
-                st.stop()
-                
-            # Segregación
-            df_cont_gastos = engine.filtrar_solo_gastos(df_cont_full)
-            df_cont_ingresos = engine.filtrar_solo_ingresos(df_cont_full)
-            df_cont_iva_desc = engine.filtrar_solo_iva_descontable(df_cont_full)
-            df_cont_iva_gen = engine.filtrar_solo_iva_generado(df_cont_full)
-            
-            df_rec = engine.leer_gosocket(file_rec)
-            df_emi = engine.leer_gosocket(file_emi)
-            
-            # 2. PROCESAMIENTO
-            status_box.markdown("⚙️ **Cruzando bases de datos...**")
-            progress_bar.progress(60)
-            
-            c_gas, sd_gas, sc_gas = engine.ejecutar_conciliacion_universal(df_dian_gastos, df_cont_gastos)
-            c_ing, sd_ing, sc_ing = engine.ejecutar_conciliacion_universal(df_dian_ingresos, df_cont_ingresos)
-            c_iva_d, sd_iva_d, sc_iva_d = engine.ejecutar_conciliacion_universal(df_dian_gastos, df_cont_iva_desc)
-            c_iva_g, sd_iva_g, sc_iva_g = engine.ejecutar_conciliacion_universal(df_dian_ingresos, df_cont_iva_gen)
-            
-            cg_ing, sg_cont, sg_go = None, None, None
-            if df_emi is not None:
-                cg_ing, sg_cont, sg_go = engine.conciliar_ingresos_vs_gosocket(df_cont_ingresos, df_emi)
-
-            # 3. GENERACIÓN EXCEL
-            status_box.markdown("📝 **Escribiendo reporte final...**")
-            progress_bar.progress(85)
-            
-            output = io.BytesIO()
-            with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-                try:
-                    emisor_d = next((c for c in df_dian_raw.columns if 'nombre_emisor' in c), 'Emisor') 
-                    receptor_d = next((c for c in df_dian_raw.columns if 'nombre_receptor' in c), 'Receptor')
-                    total_d = next((c for c in df_dian_raw.columns if 'total_bruto' in c or 'total' in c), 'Total')
-                    iva_d = next((c for c in df_dian_raw.columns if 'iva' in c or 'impuesto' in c), None)
-                except:
-                    emisor_d, receptor_d, total_d, iva_d = 'Emisor', 'Receptor', 'Total', 'IVA'
-
-                engine.procesar_reporte_cabify_generico(c_gas, sd_gas, sc_gas, writer, '1. Conciliacion Gastos', emisor_d, total_d, iva_d, False)
-                engine.procesar_reporte_cabify_generico(c_ing, sd_ing, sc_ing, writer, '2. Conciliacion Ingresos', receptor_d, total_d, iva_d, False)
-                
-                if iva_d:
-                    engine.procesar_reporte_cabify_generico(c_iva_d, sd_iva_d, sc_iva_d, writer, '3. IVA Descontable', emisor_d, iva_d, None, True)
-                    engine.procesar_reporte_cabify_generico(c_iva_g, sd_iva_g, sc_iva_g, writer, '3.1 IVA Generado', receptor_d, iva_d, None, True)
-
-                df_cont_full.to_excel(writer, sheet_name='Base Contable Depurada', index=False)
-                engine.formatear_hoja_base(writer, 'Base Contable Depurada', df_cont_full)
-                
-                if df_emi is not None:
-                    df_emi.to_excel(writer, sheet_name='Base Gosocket Emitidos', index=False)
-                    engine.formatear_hoja_base(writer, 'Base Gosocket Emitidos', df_emi)
-                
-                df_dian_raw.to_excel(writer, sheet_name='Base DIAN', index=False)
-                engine.formatear_hoja_base(writer, 'Base DIAN', df_dian_raw)
-
-            progress_bar.progress(100)
-            status_box.success("✅ ¡Reporte generado! Descárgalo abajo.")
-            
-            st.markdown("###")
-            st.download_button(
-                label="📥  DESCARGAR REPORTE EXCEL FINAL",
-                data=output.getvalue(),
-                file_name="Reporte_Conciliacion_Final.xlsx",
-                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-            )
-
-        except Exception as e:
-            st.error(f"❌ Error: {e}")
+        archivos = {
+            rol: cache_disco.leer_bytes(f) if f is not None else None
+            for rol, f in (('dian', file_dian), ('contabilidad', file_cont), ('emitidos', file_emi), ('recibidos', file_rec))
+        }
+        opciones = {'probables': buscar_probables, 'por_monto': buscar_por_monto, 'trabajadores': pipeline.TRABAJADORES_DEFECTO}
+        id_trabajo = cola_trabajos().enviar(archivos, opciones)
+        st.session_state['trabajo'] = id_trabajo
+        st.session_state['trabajo_reutilizado'] = cola_trabajos().estado(id_trabajo)['estado'] == 'terminado'
+
+# --- SEGUIMIENTO DEL TRABAJO (sobrevive a los reruns de la página) ---
+id_trabajo = st.session_state.get('trabajo')
+trabajo = cola_trabajos().estado(id_trabajo) if id_trabajo else None
+
+if trabajo and trabajo['estado'] in trabajos.EN_CURSO:
+    iconos = {15: "🔄", 35: "🔄", 60: "⚙️", 70: "🔍", 85: "📝"}
+    st.markdown(f"{iconos.get(trabajo['pct'], '⏳')} **{trabajo['mensaje']}**")
+    st.progress(trabajo['pct'])
+    st.caption("La conciliación corre en segundo plano: puedes seguir usando la página sin perder el avance.")
+    time.sleep(1)
+    _rerun()
+
+elif trabajo and trabajo['estado'] == 'error':
+    st.error(f"❌ Error: {trabajo['error']}")
+
+elif trabajo and trabajo['estado'] == 'terminado' and not os.path.exists(trabajo['reporte']):
+    st.warning("El reporte de esta conciliación ya no está en el servidor; vuelve a ejecutarla.")
+
+elif trabajo and trabajo['estado'] == 'terminado':
+    st.progress(100)
+    st.success("✅ ¡Reporte generado! Descárgalo abajo.")
+    if st.session_state.get('trabajo_reutilizado'):
+        st.caption("Mismos archivos y opciones que una conciliación anterior: se reutilizó su reporte.")
+    detalle = trabajo['detalle'] or {}
+    if detalle.get('tiempos'):
+        st.caption(f"Tiempo por etapa ({detalle.get('trabajadores')} procesos): {pipeline.resumen_tiempos(detalle['tiempos'])}")
+    if detalle.get('cache'):
+        st.caption(f"Caché de archivos en disco: {detalle['cache']['aciertos']} aciertos / {detalle['cache']['fallos']} lecturas nuevas")
+    if detalle.get('memoria_bases'):
+        st.caption(f"Memoria de las bases antes/después de tipar: {pipeline.resumen_memoria(detalle['memoria_bases'])}")
+    if trabajo['registro'] and os.path.exists(trabajo['registro']):
+        registro = perfilado.cargar_registro(trabajo['registro'])
+        with st.expander("⏱️ Perfil de la corrida (tiempo, filas y memoria por función)"):
+            st.dataframe(perfilado.tabla_registros(registro['funciones']), use_container_width=True, hide_index=True)
+            if registro.get('pico_rss_mb'): st.caption(f"Pico de memoria del proceso: {registro['pico_rss_mb']:,.0f} MB")
+            st.caption(f"Registro JSON: {trabajo['registro']}")
+
+    st.markdown("###")
+    comprimido = st.checkbox("Descargar comprimido (.zip)")
+    # Se entrega desde el archivo del trabajo, no desde el resultado del cruce; aun así
+    # download_button lee el archivo completo en cada recarga (el .zip pesa menos)
+    ruta_descarga = trabajos.comprimir(trabajo['reporte']) if comprimido else trabajo['reporte']
+    with open(ruta_descarga, 'rb') as f:
+        st.download_button(
+            label="📥  DESCARGAR REPORTE EXCEL FINAL",
+            data=f,
+            file_name=os.path.basename(ruta_descarga),
+            mime="application/zip" if comprimido else "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+        )
+    st.caption(f"Los archivos de esta conciliación se borran del servidor {trabajos.TTL_HORAS_DEFECTO:g} horas después de generarse.")
+
+    # --- EXPLORAR RESULTADOS (paginado, sin abrir el Excel) ---
+    if detalle.get('vista') and os.path.exists(detalle['vista']):
+        st.markdown('<div class="section-header">🔎 Explorar resultados</div>', unsafe_allow_html=True)
+        consulta = vista(detalle['vista'])
+        nombres_hoja = {'gastos': 'Gastos', 'ingresos': 'Ingresos', 'iva_descontable': 'IVA Descontable', 'iva_generado': 'IVA Generado'}
+        f1, f2, f3 = st.columns(3)
+        hoja = f1.selectbox("Hoja", consulta.hojas(), format_func=lambda h: nombres_hoja.get(h, h))
+        empresa = f2.text_input("Empresa contiene")
+        nit = f3.text_input("NIT empieza por")
+        f4, f5 = st.columns([2, 1])
+        tipos = f4.multiselect("Tipo", vista_previa.TIPOS)
+        diferencia_min = f5.number_input("Diferencia absoluta mínima", min_value=0.0, value=0.0, step=1000.0)
+        filtro = dict(hoja=hoja, empresa=empresa.strip(), nit=nit.strip(), tipos=tipos, diferencia_min=diferencia_min)
+
+        if st.session_state.get('vista_filtro') != filtro:  # otro filtro: volver a la primera página
+            st.session_state['vista_filtro'], st.session_state['vista_pagina'] = filtro, 1
+        pagina = st.session_state.get('vista_pagina', 1)
+        filas, total = consulta.consultar(**filtro, pagina=pagina - 1)
+        paginas = max(1, -(-total // vista_previa.FILAS_POR_PAGINA))
+        st.dataframe(filas, use_container_width=True, hide_index=True)
+        p1, p2 = st.columns([1, 3])
+        p1.number_input("Página", min_value=1, max_value=paginas, key='vista_pagina')
+        p2.caption(f"{total:,} filas · página {pagina} de {paginas}")
+        if st.checkbox("Ver subtotales por empresa del filtro"):
+            st.dataframe(consulta.subtotales(**filtro), use_container_width=True, hide_index=True)
@@ -0,0 +1 @@
+"""Benchmarks del conciliador: generadores de datos sintéticos y mediciones por etapa."""
@@ -0,0 +1,52 @@
+"""
+Compara el motor de conciliación actual (índice hash, una búsqueda por fila)
+contra la versión anterior de tres merges más la expansión del detalle.
+
+Uso:
+    python -m benchmarks.bench_conciliacion --filas 100000 1000000 5000000
+"""
+import argparse
+import time
+
+import pandas as pd
+
+import engine
+from benchmarks.generadores import generar_cruce_en_memoria
+
+def conciliacion_tres_merges(df_dian, df_cont):
+    """Ruta anterior de ejecutar_conciliacion_universal (recalcula la llave y hace cuatro merges)."""
+    df_cont = df_cont.copy()
+    df_cont['LLAVE_CONT'] = df_cont['u_ref'].astype(str).str.strip().str.replace(r'[^\w]+', '', regex=True).str.upper()
+    agg_dict = {'u_saldo_f': 'sum', 'u_infoco01': 'first', 'u_cardname': 'first', 'u_acctname': 'first'}
+    df_cont_agg = df_cont.groupby('LLAVE_CONT').agg(agg_dict).reset_index()
+    llave = engine.LLAVE_DIAN_CONT_COL_NAME
+    df_coinc = pd.merge(df_dian, df_cont_agg, left_on=llave, right_on='LLAVE_CONT', how='inner', suffixes=('_DIAN', '_CONT'))
+    df_left = pd.merge(df_dian, df_cont_agg[['LLAVE_CONT']], left_on=llave, right_on='LLAVE_CONT', how='left', indicator=True)
+    df_sob_dian = df_left[df_left['_merge'] == 'left_only'].drop(columns=['LLAVE_CONT', '_merge'])
+    df_right = pd.merge(df_cont_agg, df_dian[[llave]], left_on='LLAVE_CONT', right_on=llave, how='left', indicator=True)
+    df_sob_cont = pd.merge(df_cont, df_right[df_right['_merge'] == 'left_only'][['LLAVE_CONT']], on='LLAVE_CONT', how='inner')
+    return df_coinc, df_sob_dian, df_sob_cont
+
+def cronometrar(funcion, *args):
+    inicio = time.perf_counter()
+    res = funcion(*args)
+    return time.perf_counter() - inicio, res
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--filas', type=int, nargs='+', default=[100_000, 1_000_000, 5_000_000])
+    args = parser.parse_args()
+
+    print(f'{"filas":>10} {"3 merges":>10} {"hash":>10} {"aceleración":>12}   coinc / sob. DIAN / sob. cont')
+    for n in args.filas:
+        df_dian, df_cont = generar_cruce_en_memoria(n)
+        t_viejo, viejo = cronometrar(conciliacion_tres_merges, df_dian, df_cont)
+        preparada = engine.ContabilidadPreparada(df_cont)
+        t_nuevo, nuevo = cronometrar(engine.ejecutar_conciliacion_universal, df_dian, preparada.familia())
+        if [len(x) for x in viejo] != [len(x) for x in nuevo]:
+            print(f'ADVERTENCIA: particiones distintas en {n:,} filas')
+        print(f'{n:>10,} {t_viejo:>9.2f}s {t_nuevo:>9.2f}s {t_viejo / t_nuevo:>11.1f}x   '
+              f'{len(nuevo[0]):,} / {len(nuevo[1]):,} / {len(nuevo[2]):,}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+"""
+Tiempo de importación del núcleo (engine) medido con `python -X importtime`
+en un proceso limpio. Falla (código 1) si supera el presupuesto o si el
+núcleo arrastra módulos de interfaz como streamlit.
+
+Uso:
+    python -m benchmarks.bench_importacion --presupuesto-ms 1500
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODULOS_PROHIBIDOS = ('streamlit', 'altair')
+
+def medir_importacion(modulo='engine'):
+    """Devuelve (ms acumulados del módulo, {módulo_raíz: ms propios}) según -X importtime."""
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {modulo}'],
+        cwd=RAIZ, capture_output=True, text=True, check=True,
+    )
+    acumulado_us, por_raiz = 0, {}
+    for linea in proc.stderr.splitlines():
+        if not linea.startswith('import time:') or '|' not in linea: continue
+        partes = [p.strip() for p in linea[len('import time:'):].split('|')]
+        if not partes[0].isdigit(): continue  # encabezado
+        propio_us, acum_us, nombre = int(partes[0]), int(partes[1]), partes[2]
+        raiz = nombre.split('.')[0]
+        por_raiz[raiz] = por_raiz.get(raiz, 0) + propio_us / 1000
+        if nombre == modulo: acumulado_us = acum_us
+    return acumulado_us / 1000, por_raiz
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--presupuesto-ms', type=float, default=1500)
+    parser.add_argument('--repeticiones', type=int, default=5)
+    args = parser.parse_args()
+
+    mediciones = [medir_importacion() for _ in range(args.repeticiones)]
+    total_ms = min(m[0] for m in mediciones)
+    por_raiz = mediciones[0][1]
+
+    print(f'import engine: {total_ms:.0f} ms (mejor de {args.repeticiones}), presupuesto {args.presupuesto_ms:.0f} ms')
+    for raiz, ms in sorted(por_raiz.items(), key=lambda x: -x[1])[:10]:
+        print(f'  {raiz:<24} {ms:>8.1f} ms')
+
+    prohibidos = [m for m in MODULOS_PROHIBIDOS if m in por_raiz]
+    if prohibidos:
+        print(f'ERROR: el núcleo importa {", ".join(prohibidos)}')
+        return 1
+    if total_ms > args.presupuesto_ms:
+        print('ERROR: importación por encima del presupuesto')
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
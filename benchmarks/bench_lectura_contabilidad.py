@@ -0,0 +1,62 @@
+"""
+Compara la lectura del auxiliar Netsuite: ruta anterior (vista previa de 20
+filas + segunda lectura completa con openpyxl) contra la lectura única con
+detección de encabezado (calamine, con respaldo openpyxl en streaming).
+
+Uso:
+    python -m benchmarks.bench_lectura_contabilidad --filas 1000000
+"""
+import argparse
+import os
+import tempfile
+import time
+import tracemalloc
+
+import pandas as pd
+
+import engine
+from benchmarks.generadores import generar_auxiliar_netsuite
+
+def leer_doble_lectura(file_obj):
+    """Ruta anterior de leer_contabilidad_completa: dos aperturas del libro con openpyxl."""
+    file_obj.seek(0)
+    df_preview = pd.read_excel(file_obj, nrows=20, header=None, engine='openpyxl')
+    header_row = 0
+    for i, row in df_preview.iterrows():
+        row_str = row.astype(str).values
+        if 'Cuenta' in row_str and 'Fecha' in row_str:
+            header_row = i; break
+    file_obj.seek(0)
+    return pd.read_excel(file_obj, header=header_row, engine='openpyxl')
+
+def medir(nombre, funcion, ruta):
+    with open(ruta, 'rb') as f:
+        tracemalloc.start()
+        inicio = time.perf_counter()
+        df = funcion(f)
+        segundos = time.perf_counter() - inicio
+        _, pico = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    print(f'{nombre:<28} {segundos:>9.2f} s   pico {pico / 2**20:>9.1f} MiB   {len(df):>9} filas')
+    return df
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--filas', type=int, default=1_000_000)
+    parser.add_argument('--archivo', help='Auxiliar existente; si no se indica se genera uno sintético')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        ruta = args.archivo
+        if not ruta:
+            ruta = os.path.join(tmp, 'auxiliar_sintetico.xlsx')
+            print(f'Generando auxiliar sintético de {args.filas:,} filas...')
+            generar_auxiliar_netsuite(ruta, filas=args.filas)
+
+        df_nuevo = medir('lectura única (calamine)', engine.leer_hoja_con_encabezado, ruta)
+        df_viejo = medir('doble lectura (openpyxl)', leer_doble_lectura, ruta)
+        if list(df_nuevo.columns) != list(df_viejo.columns) or len(df_nuevo) != len(df_viejo):
+            print('ADVERTENCIA: las dos rutas no devuelven la misma forma de tabla')
+
+if __name__ == '__main__':
+    main()
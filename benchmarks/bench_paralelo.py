@@ -0,0 +1,61 @@
+"""
+Tiempo por etapa de los cuatro cruces y la preparación de hojas, secuencial
+contra el pool de procesos de pipeline. El auxiliar sintético se reparte entre
+las cuentas de CUENTAS_NETSUITE para que las cuatro familias tengan filas.
+La lectura de Excel no entra (ver bench_lectura_contabilidad).
+
+Uso:
+    python -m benchmarks.bench_paralelo --filas 1000000 --trabajadores 1 4 8
+"""
+import argparse
+import time
+
+import numpy as np
+
+import pipeline
+from benchmarks.generadores import CUENTAS_NETSUITE, generar_cruce_en_memoria
+
+def resultado_sintetico(filas, semilla=0):
+    df_dian, df_cont = generar_cruce_en_memoria(filas, semilla=semilla)
+    cuentas = np.random.default_rng(semilla).integers(0, len(CUENTAS_NETSUITE), len(df_cont))
+    df_cont['CODIGO_CUENTA'] = np.array([c for c, _ in CUENTAS_NETSUITE], dtype=object)[cuentas]
+    df_cont['u_acctname'] = np.array([f'{c} {n}' for c, n in CUENTAS_NETSUITE], dtype=object)[cuentas]
+    return df_dian, df_cont
+
+def medir(df_dian, df_cont, trabajadores, probables):
+    tiempos = {}
+    with pipeline._cronometro(tiempos, 'cruces'):
+        if trabajadores > 1:
+            cruces, _, prob = pipeline._cruzar_en_paralelo(df_dian, df_cont, trabajadores, probables)
+        else:
+            cruces, _ = pipeline.cruzar_bases(df_dian, df_cont)
+            prob = pipeline.emparejar_sobrantes(cruces, df_dian, probables)
+    resultado = {'df_dian_raw': df_dian, 'cruces': cruces, 'probables': prob}
+    with pipeline._cronometro(tiempos, 'preparar_hojas'):
+        tablas = pipeline.preparar_hojas(resultado, trabajadores)
+    return tiempos, {hoja: 0 if t is None else len(t) for hoja, t in tablas.items()}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--filas', type=int, default=1_000_000)
+    parser.add_argument('--trabajadores', type=int, nargs='+', default=[1, 4, 8])
+    parser.add_argument('--probables', action='store_true', help='Incluye el emparejador de folios casi iguales en cada cruce')
+    args = parser.parse_args()
+
+    df_dian, df_cont = resultado_sintetico(args.filas)
+    # Calentamiento: arranca los procesos del pool antes de medir
+    for n in args.trabajadores:
+        if n > 1: pipeline._pool_procesos(n).submit(time.sleep, 0).result()
+
+    print(f'{"procesos":>9} {"cruces":>9} {"hojas":>9} {"total":>9} {"aceleración":>12}')
+    base, filas_base = None, None
+    for n in args.trabajadores:
+        tiempos, filas = medir(df_dian, df_cont, n, args.probables)
+        total = sum(tiempos.values())
+        base = base or total
+        if filas_base is None: filas_base = filas
+        elif filas != filas_base: print(f'ADVERTENCIA: hojas distintas con {n} procesos')
+        print(f'{n:>9} {tiempos["cruces"]:>8.2f}s {tiempos["preparar_hojas"]:>8.2f}s {total:>8.2f}s {base / total:>11.1f}x')
+
+if __name__ == '__main__':
+    main()
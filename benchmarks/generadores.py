@@ -0,0 +1,195 @@
+"""
+Generadores de archivos sintéticos con la forma de los reportes reales.
+Se escriben con xlsxwriter en modo constant_memory para poder crear
+archivos de millones de filas sin agotar la memoria.
+"""
+import os
+
+import numpy as np
+import xlsxwriter
+
+CUENTAS_NETSUITE = [
+    ('51350501', 'Servicios de transporte'),
+    ('51352001', 'Servicios de tecnologia'),
+    ('51151501', 'IVA descontable en compras'),
+    ('51157001', 'Gastos no deducibles'),
+    ('41550501', 'Ingresos por intermediacion'),
+    ('41559501', 'Diferencia en cambio realizada'),
+    ('24080501', 'IVA generado en ventas'),
+    ('24081001', 'IVA descontable servicios'),
+]
+
+def formato_colombiano(valor):
+    """1234567.8 -> '1.234.567,80'"""
+    return f'{valor:,.2f}'.replace(',', 'X').replace('.', ',').replace('X', '.')
+
+def generar_auxiliar_netsuite(ruta, filas=100_000, semilla=0, filas_titulo=4):
+    """
+    Auxiliar contable como lo exporta Netsuite: filas de título, encabezado,
+    una fila cabecera por cuenta, movimientos con Déb/Créd en formato
+    colombiano (algunos numéricos) y una fila 'Total' al cierre de cada cuenta.
+    """
+    rng = np.random.default_rng(semilla)
+    wb = xlsxwriter.Workbook(ruta, {'constant_memory': True})
+    ws = wb.add_worksheet('Auxiliar')
+    r = 0
+    for texto in ['CABIFY COLOMBIA SAS', 'Libro auxiliar por cuenta', 'Periodo: Ene 2024 - Dic 2024'][:filas_titulo]:
+        ws.write(r, 0, texto); r += 1
+    r += 1
+    encabezado = ['Cuenta', 'Fecha', 'Tipo de transacción', 'Número de documento', 'Número Identificación', 'Nombre', 'Nota', 'Débito', 'Crédito']
+    ws.write_row(r, 0, encabezado); r += 1
+
+    por_cuenta = np.array_split(np.arange(filas), len(CUENTAS_NETSUITE))
+    proveedores = [f'PROVEEDOR {i} S.A.S.' for i in range(max(filas // 50, 10))]
+    for (codigo, nombre), idx in zip(CUENTAS_NETSUITE, por_cuenta):
+        ws.write(r, 0, f'{codigo} {nombre}'); r += 1
+        n = len(idx)
+        montos = rng.uniform(1_000, 50_000_000, n).round(2)
+        es_debito = rng.random(n) < 0.7
+        como_texto = rng.random(n) < 0.8
+        prov = rng.integers(0, len(proveedores), n)
+        dias = rng.integers(0, 365, n)
+        for j in range(n):
+            monto = formato_colombiano(montos[j]) if como_texto[j] else float(montos[j])
+            ws.write_row(r, 0, [
+                '', f'2024-{1 + dias[j] // 31:02d}-{1 + dias[j] % 28:02d}', 'Factura de proveedor',
+                f'FE{int(idx[j]) + 1000}', f'{900000000 + int(prov[j])}', proveedores[prov[j]], f'Movimiento {idx[j]}',
+                monto if es_debito[j] else '', '' if es_debito[j] else monto,
+            ])
+            r += 1
+        ws.write(r, 0, f'Total {codigo} {nombre}'); r += 1
+    wb.close()
+    return ruta
+
+def generar_cruce_en_memoria(filas_dian=100_000, filas_cont=None, coincidencia=0.8, semilla=0):
+    """
+    DIAN ya normalizada (con LLAVE_DIAN) y auxiliar ya leído (u_ref, u_saldo_f, ...)
+    en memoria, para medir los motores sin pasar por Excel. `coincidencia` es la
+    fracción de documentos DIAN que aparecen en contabilidad; cada documento
+    contable se reparte en una o varias líneas.
+    """
+    import pandas as pd
+    rng = np.random.default_rng(semilla)
+    filas_cont = filas_cont or filas_dian
+    folios = np.arange(filas_dian) + 1000
+    nits = rng.integers(900000000, 900000000 + max(filas_dian // 50, 10), filas_dian)
+    totales = rng.uniform(1_000, 50_000_000, filas_dian).round(2)
+    df_dian = pd.DataFrame({
+        'grupo': np.where(rng.random(filas_dian) < 0.7, 'Recibido', 'Emitido'),
+        'tipo_de_documento': 'Factura electrónica',
+        'prefijo': 'FE', 'folio': folios.astype(str),
+        'nit_emisor': nits.astype(str), 'nombre_emisor': [f'PROVEEDOR {n % 1000} S.A.S.' for n in nits],
+        'total': totales.astype(str), 'iva': (totales * 0.19).round(2).astype(str),
+    })
+    df_dian['LLAVE_DIAN'] = 'FE' + df_dian['folio']
+
+    en_cont = rng.random(filas_dian) < coincidencia
+    doc = rng.choice(np.flatnonzero(en_cont), filas_cont) if en_cont.any() else np.zeros(filas_cont, dtype=int)
+    huerfanos = rng.random(filas_cont) < 0.05
+    refs = np.where(huerfanos, 'NS-' + rng.integers(0, 10**7, filas_cont).astype(str), 'FE-' + folios[doc].astype(str))
+    df_cont = pd.DataFrame({
+        'u_ref': refs,
+        'u_infoco01': nits[doc].astype(str),
+        'u_cardname': [f'PROVEEDOR {n % 1000} S.A.S.' for n in nits[doc]],
+        'u_acctname': '51350501 Servicios de transporte',
+        'CODIGO_CUENTA': '51350501',
+        'u_saldo_f': rng.uniform(1_000, 50_000_000, filas_cont).round(2),
+    })
+    return df_dian, df_cont
+
+COLUMNAS_DIAN = [
+    'Tipo de documento', 'CUFE/CUDE', 'Folio', 'Prefijo', 'Divisa', 'Forma de Pago', 'Medio de Pago',
+    'Fecha Emisión', 'Fecha Recepción', 'NIT Emisor', 'Nombre Emisor', 'NIT Receptor', 'Nombre Receptor',
+    'IVA', 'ICA', 'INC', 'Rete IVA', 'Rete Renta', 'Rete ICA', 'Total', 'Estado', 'Grupo',
+]
+COLUMNAS_GOSOCKET = ['Serie', 'Folio', 'Fecha Emisión', 'RUT Receptor', 'Razón Social Receptor', 'Monto Neto', 'IVA', 'Monto Total', 'Estado']
+NIT_PROPIO, NOMBRE_PROPIO = '901234567', 'CABIFY COLOMBIA S.A.S.'
+
+def _cuenta_por_movimiento(filas_cont):
+    """Índice en CUENTAS_NETSUITE de cada movimiento i del auxiliar (mismo reparto que generar_auxiliar_netsuite)."""
+    limites = np.cumsum([len(p) for p in np.array_split(np.arange(filas_cont), len(CUENTAS_NETSUITE))])
+    return np.searchsorted(limites, np.arange(filas_cont), side='right')
+
+def _es_emitido(codigo, nombre):
+    return codigo.startswith('4') or 'generado' in nombre.lower()
+
+def generar_dian(ruta, filas=100_000, filas_cont=None, coincidencia=0.8, semilla=0):
+    """
+    Exportación de la DIAN (columnas y tipos como la descarga real). Una fracción
+    `coincidencia` de los documentos usa folios del auxiliar de `filas_cont`
+    movimientos (referencias FE<i + 1000>); el Grupo sale de la cuenta de ese
+    movimiento (4xxx / IVA generado -> Emitido). El resto son folios sin contraparte.
+    """
+    rng = np.random.default_rng(semilla + 1)
+    filas_cont = filas_cont or filas
+    emitida = np.array([_es_emitido(c, n) for c, n in CUENTAS_NETSUITE])[_cuenta_por_movimiento(filas_cont)]
+    con_contraparte = rng.random(filas) < coincidencia
+    mov = rng.integers(0, filas_cont, filas)
+    folios = np.where(con_contraparte, mov + 1000, filas_cont + 1000 + np.arange(filas))
+    es_emitido = np.where(con_contraparte, emitida[mov], rng.random(filas) < 0.3)
+    tipos = np.where(rng.random(filas) < 0.05, 'Documento soporte con no obligados', 'Factura electrónica')
+    nits = 900000000 + rng.integers(0, max(filas_cont // 50, 10), filas)
+    totales = rng.uniform(1_000, 50_000_000, filas).round(2)
+    dias = rng.integers(0, 365, filas)
+
+    wb = xlsxwriter.Workbook(ruta, {'constant_memory': True})
+    ws = wb.add_worksheet('Documentos')
+    ws.write_row(0, 0, COLUMNAS_DIAN)
+    for j in range(filas):
+        fecha = f'{1 + dias[j] % 28:02d}-{1 + dias[j] // 31:02d}-2024'
+        tercero, nombre = f'{nits[j]}', f'PROVEEDOR {nits[j] - 900000000} S.A.S.'
+        emisor = (NIT_PROPIO, NOMBRE_PROPIO) if es_emitido[j] else (tercero, nombre)
+        receptor = (tercero, nombre) if es_emitido[j] else (NIT_PROPIO, NOMBRE_PROPIO)
+        iva = round(totales[j] * 0.19 / 1.19, 2)
+        ws.write_row(j + 1, 0, [
+            tipos[j], f'{rng.integers(0, 2**62):x}{j:08x}', int(folios[j]), 'FE', 'COP', 'Contado', 'Transferencia',
+            fecha, fecha, emisor[0], emisor[1], receptor[0], receptor[1],
+            iva, 0, 0, 0, 0, 0, float(totales[j]), 'Aprobado', 'Emitido' if es_emitido[j] else 'Recibido',
+        ])
+    wb.close()
+    return ruta
+
+def generar_gosocket_emitidos(ruta, filas_cont=100_000, coincidencia=0.9, semilla=0):
+    """Gosocket emitidos: Serie/Folio de los movimientos de ingresos del auxiliar (una fracción `coincidencia`)."""
+    rng = np.random.default_rng(semilla + 2)
+    ingresos = np.array([c.startswith('4') for c, _ in CUENTAS_NETSUITE])[_cuenta_por_movimiento(filas_cont)]
+    movs = np.flatnonzero(ingresos)
+    movs = movs[rng.random(len(movs)) < coincidencia]
+    wb = xlsxwriter.Workbook(ruta, {'constant_memory': True})
+    ws = wb.add_worksheet('Emitidos')
+    ws.write_row(0, 0, COLUMNAS_GOSOCKET)
+    for j, mov in enumerate(movs):
+        neto = round(float(rng.uniform(1_000, 40_000_000)), 2)
+        cliente = int(rng.integers(0, max(filas_cont // 50, 10)))
+        ws.write_row(j + 1, 0, [
+            'FE', int(mov) + 1000, f'2024-{1 + mov % 12:02d}-{1 + mov % 28:02d}', f'{900000000 + cliente}',
+            f'CLIENTE {cliente} S.A.S.', neto, round(neto * 0.19, 2), round(neto * 1.19, 2), 'Aceptado',
+        ])
+    wb.close()
+    return ruta
+
+def generar_conjunto(directorio, filas_cont=100_000, filas_dian=None, coincidencia=0.8, semilla=0):
+    """
+    DIAN, auxiliar Netsuite y Gosocket emitidos coherentes entre sí en `directorio`.
+    Si los archivos ya existen no se regeneran (el nombre incluye tamaño y semilla).
+    Devuelve {'dian': ruta, 'contabilidad': ruta, 'emitidos': ruta}.
+    """
+    filas_dian = filas_dian or filas_cont // 2
+    os.makedirs(directorio, exist_ok=True)
+    sufijo = f'{filas_cont}_{filas_dian}_{semilla}'
+    rutas = {
+        'dian': os.path.join(directorio, f'DIAN_{sufijo}.xlsx'),
+        'contabilidad': os.path.join(directorio, f'Auxiliar_{sufijo}.xlsx'),
+        'emitidos': os.path.join(directorio, f'Emitidos_{sufijo}.xlsx'),
+    }
+    generadores = {
+        'dian': lambda r: generar_dian(r, filas_dian, filas_cont, coincidencia, semilla),
+        'contabilidad': lambda r: generar_auxiliar_netsuite(r, filas_cont, semilla),
+        'emitidos': lambda r: generar_gosocket_emitidos(r, filas_cont, semilla=semilla),
+    }
+    for rol, ruta in rutas.items():
+        if not os.path.exists(ruta):
+            tmp = ruta + '.tmp.xlsx'
+            generadores[rol](tmp)
+            os.replace(tmp, ruta)
+    return rutas
@@ -0,0 +1,101 @@
+"""
+Paridad y tiempo de los backends de texto de engine (pandas vs arrow).
+
+Sobre los datos sintéticos de generadores (más referencias con tildes, eñes,
+guiones, espacios, números y vacíos) construye las llaves, limpia NIT y corre
+los cuatro cruces y la preparación de hojas con cada backend; cualquier
+diferencia en llaves, cruces u hojas termina con código 1. La misma
+comparación corre con las pruebas (tests/test_paridad_backend.py); este
+script agrega los tiempos y tamaños más grandes.
+
+Uso:
+    python -m benchmarks.paridad_backend --filas 200000 1000000
+"""
+import argparse
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+import engine
+import pipeline
+from benchmarks.bench_paralelo import resultado_sintetico
+
+# Casos que separan \w de Python de \w de RE2 y el astype(str) de nulos y números
+REFERENCIAS_DIFICILES = ['FÉ-001', 'ñandú 12', ' ab-12 ', 'x_y/7', 'ÅNGSTRÖM·9', '١٢٣', None, np.nan, 12345, 1.5, '', 'fe  0001']
+
+def fixtures(filas, semilla=0):
+    df_dian, df_cont = resultado_sintetico(filas, semilla)
+    df_dian = df_dian.drop(columns=[engine.LLAVE_DIAN_CONT_COL_NAME])
+    n = min(len(REFERENCIAS_DIFICILES), len(df_dian), len(df_cont))
+    dificiles = pd.Series(REFERENCIAS_DIFICILES[:n], dtype=object)
+    df_cont['u_ref'] = df_cont['u_ref'].astype(object)
+    df_cont.loc[df_cont.index[:n], 'u_ref'] = dificiles.to_numpy()
+    df_dian['folio'] = df_dian['folio'].astype(object)
+    df_dian.loc[df_dian.index[:n], 'folio'] = dificiles.to_numpy()
+    df_cont.loc[df_cont.index[:n], 'u_infoco01'] = ['900.123.456-7', None, 'NIT 800 1', np.nan] * (n // 4) + [''] * (n % 4)
+    return df_dian, df_cont
+
+def correr(backend, df_dian, df_cont):
+    engine.configurar_backend(backend)
+    tiempos, salida = {}, {}
+    inicio = time.perf_counter()
+    dian = engine.crear_llave_conciliacion(df_dian.copy())
+    salida['llave_dian'] = dian[engine.LLAVE_DIAN_CONT_COL_NAME]
+    salida['llave_cont'] = engine.normalizar_llave(df_cont['u_ref'])
+    salida['nit'] = engine.clean_nit_numeric(df_cont['u_infoco01'])
+    tiempos['llaves'] = time.perf_counter() - inicio
+
+    inicio = time.perf_counter()
+    cruces, _ = pipeline.cruzar_bases(dian, df_cont)
+    tiempos['cruces'] = time.perf_counter() - inicio
+    inicio = time.perf_counter()
+    tablas = pipeline.preparar_hojas({'df_dian_raw': dian, 'cruces': cruces, 'probables': {}}, 1)
+    tiempos['hojas'] = time.perf_counter() - inicio
+
+    for nombre, partes in cruces.items():
+        for parte, df in zip(('coin', 'sob_dian', 'sob_cont'), partes): salida[f'{nombre}.{parte}'] = df
+    for hoja, tabla in tablas.items(): salida[hoja] = tabla
+    return tiempos, salida
+
+def diferencias(base, otro):
+    """[(nombre, mensaje)] de las salidas que no son idénticas (valores, tipos e índice)."""
+    distintas = []
+    for nombre, esperado in base.items():
+        obtenido = otro.get(nombre)
+        try:
+            if isinstance(esperado, pd.Series): pd.testing.assert_series_equal(esperado, obtenido)
+            elif esperado is None or obtenido is None: assert esperado is obtenido, 'uno de los dos es None'
+            else: pd.testing.assert_frame_equal(esperado, obtenido)
+        except AssertionError as e:
+            distintas.append((nombre, str(e).splitlines()[0] if str(e) else 'distinto'))
+    return distintas
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--filas', type=int, nargs='+', default=[200_000])
+    parser.add_argument('--semilla', type=int, default=0)
+    args = parser.parse_args()
+
+    original = engine.BACKEND_TEXTO
+    errores = 0
+    print(f'{"filas":>10} {"backend":>8} {"llaves":>9} {"cruces":>9} {"hojas":>9}')
+    try:
+        for filas in args.filas:
+            df_dian, df_cont = fixtures(filas, args.semilla)
+            resultados = {b: correr(b, df_dian, df_cont) for b in engine.BACKENDS_TEXTO}
+            for backend, (tiempos, _) in resultados.items():
+                print(f'{filas:>10,} {backend:>8} {tiempos["llaves"]:>8.2f}s {tiempos["cruces"]:>8.2f}s {tiempos["hojas"]:>8.2f}s')
+            base = resultados[engine.BACKENDS_TEXTO[0]][1]
+            for backend in engine.BACKENDS_TEXTO[1:]:
+                for nombre, mensaje in diferencias(base, resultados[backend][1]):
+                    errores += 1
+                    print(f'DIFERENCIA {backend} vs {engine.BACKENDS_TEXTO[0]} en {nombre}: {mensaje}')
+    finally:
+        engine.configurar_backend(original)
+    print('Backends idénticos.' if not errores else f'{errores} salidas distintas.')
+    return 1 if errores else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,163 @@
+"""
+Suite de rendimiento de punta a punta: genera (o reutiliza) DIAN, auxiliar
+Netsuite y Gosocket emitidos sintéticos, corre pipeline.conciliar +
+escribir_reporte con el perfilado activo y guarda el mejor tiempo de cada
+etapa y de cada función del motor en un historial JSON por commit.
+
+Compara contra la última corrida del historial con el mismo tamaño en la misma
+máquina (o contra --base COMMIT) y falla (código 1) si alguna etapa se vuelve
+más lenta que el umbral porcentual. Las cachés de lectura no se usan.
+
+Uso:
+    python -m benchmarks.suite --filas 200000 --repeticiones 3 --umbral 15
+    python -m benchmarks.suite --filas 1000000 --datos /tmp/bench --base a1b2c3d
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+from datetime import datetime
+
+import pandas as pd
+
+import engine
+import perfilado
+import pipeline
+from benchmarks.generadores import generar_conjunto
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HISTORIAL_DEFECTO = os.path.join(os.path.expanduser('~'), '.cache', 'conciliador', 'benchmarks.json')
+# Diferencias menores a esto (s) se consideran ruido aunque superen el umbral porcentual
+MINIMO_ABSOLUTO_S = 0.05
+
+def commit_actual():
+    """Hash corto de HEAD, con '+' si el árbol tiene cambios sin commit; None fuera de git."""
+    try:
+        head = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=RAIZ, capture_output=True, text=True, check=True).stdout.strip()
+        sucio = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=RAIZ, capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return head + ('+' if sucio else '')
+
+def correr_una_vez(rutas, trabajadores, probables, por_monto):
+    """Una conciliación completa en memoria; devuelve {etapa: s} y {función: s} (solo llamadas de nivel externo)."""
+    engine.configurar_normalizador_empresas(None)  # diccionario de empresas vacío en cada repetición
+    with perfilado.Corrida(perfil_cpu=None) as corrida:
+        resultado = pipeline.conciliar(
+            pipeline.abrir_entrada(rutas['dian']), pipeline.abrir_entrada(rutas['contabilidad']),
+            pipeline.abrir_entrada(rutas.get('emitidos')), None, None, probables, por_monto, trabajadores,
+        )
+        pipeline.escribir_reporte(resultado, io.BytesIO(), None, trabajadores)
+    funciones = {}
+    for r in corrida.registros:
+        if r['nivel'] == 0: funciones[r['funcion']] = funciones.get(r['funcion'], 0.0) + r['segundos']
+    etapas = dict(corrida.etapas, total=corrida.duracion)
+    filas = {nombre: [len(df) for df in cruce] for nombre, cruce in resultado['cruces'].items()}
+    return etapas, funciones, filas
+
+def medir(rutas, repeticiones, trabajadores=1, probables=False, por_monto=False):
+    """Mejor tiempo (mínimo entre repeticiones) por etapa y por función."""
+    etapas, funciones, filas = {}, {}, None
+    for _ in range(repeticiones):
+        e, f, filas_corrida = correr_una_vez(rutas, trabajadores, probables, por_monto)
+        if filas is not None and filas_corrida != filas:
+            raise RuntimeError('Las repeticiones no dan el mismo resultado; el benchmark no es reproducible.')
+        filas = filas_corrida
+        for destino, origen in ((etapas, e), (funciones, f)):
+            for k, v in origen.items(): destino[k] = min(v, destino.get(k, v))
+    return etapas, funciones, filas
+
+def cargar_historial(ruta):
+    if not os.path.exists(ruta): return []
+    with open(ruta, encoding='utf-8') as f: return json.load(f)
+
+def guardar_historial(ruta, historial):
+    os.makedirs(os.path.dirname(ruta) or '.', exist_ok=True)
+    tmp = f'{ruta}.{os.getpid()}.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f: json.dump(historial, f, ensure_ascii=False, indent=1)
+    os.replace(tmp, ruta)
+
+def elegir_base(historial, entrada, commit_base=None):
+    """Última entrada comparable: mismo tamaño, opciones y máquina (y el commit pedido, si se indica)."""
+    llave = ('filas', 'filas_dian', 'trabajadores', 'probables', 'por_monto', 'maquina')
+    for previa in reversed(historial):
+        if any(previa.get(k) != entrada.get(k) for k in llave): continue
+        if commit_base and not (previa.get('commit') or '').startswith(commit_base): continue
+        return previa
+    return None
+
+def regresiones(base, entrada, umbral):
+    """[(etapa, s base, s actual, % cambio)] de las etapas más lentas que `umbral` por ciento."""
+    lentas = []
+    for etapa, actual in entrada['etapas'].items():
+        previo = base['etapas'].get(etapa)
+        if not previo: continue
+        cambio = (actual - previo) / previo * 100
+        if cambio > umbral and actual - previo > MINIMO_ABSOLUTO_S:
+            lentas.append((etapa, previo, actual, cambio))
+    return lentas
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--filas', type=int, default=200_000, help='Movimientos del auxiliar contable')
+    parser.add_argument('--filas-dian', type=int, help='Documentos DIAN (por defecto la mitad de --filas)')
+    parser.add_argument('--semilla', type=int, default=0)
+    parser.add_argument('--repeticiones', type=int, default=3)
+    parser.add_argument('--trabajadores', type=int, default=1)
+    parser.add_argument('--probables', action='store_true')
+    parser.add_argument('--por-monto', action='store_true')
+    parser.add_argument('--datos', help='Directorio donde se generan/reutilizan los archivos sintéticos (por defecto uno temporal)')
+    parser.add_argument('--historial', default=HISTORIAL_DEFECTO)
+    parser.add_argument('--base', help='Commit contra el cual comparar (por defecto la última corrida comparable)')
+    parser.add_argument('--umbral', type=float, default=15.0, help='Porcentaje de aumento por etapa que se considera regresión')
+    parser.add_argument('--sin-guardar', action='store_true', help='No agrega esta corrida al historial')
+    args = parser.parse_args()
+
+    perfilado.instrumentar()
+    with tempfile.TemporaryDirectory() as tmp:
+        print(f'Preparando datos sintéticos ({args.filas:,} movimientos)...', flush=True)
+        rutas = generar_conjunto(args.datos or tmp, args.filas, args.filas_dian, semilla=args.semilla)
+        etapas, funciones, filas = medir(rutas, args.repeticiones, args.trabajadores, args.probables, args.por_monto)
+
+    entrada = {
+        'commit': commit_actual(), 'fecha': datetime.now().isoformat(timespec='seconds'),
+        'filas': args.filas, 'filas_dian': args.filas_dian or args.filas // 2, 'semilla': args.semilla,
+        'trabajadores': args.trabajadores, 'probables': args.probables, 'por_monto': args.por_monto,
+        'maquina': platform.node(), 'python': platform.python_version(), 'pandas': pd.__version__,
+        'repeticiones': args.repeticiones,
+        'etapas': {k: round(v, 4) for k, v in etapas.items()},
+        'funciones': {k: round(v, 4) for k, v in funciones.items()},
+        'filas_resultado': filas,
+    }
+    historial = cargar_historial(args.historial)
+    base = elegir_base(historial, entrada, args.base)
+
+    print(f'\n{"etapa":<32} {"actual":>9} {"base":>9} {"cambio":>8}')
+    for grupo in ('etapas', 'funciones'):
+        for nombre, actual in entrada[grupo].items():
+            previo = base[grupo].get(nombre) if base else None
+            cambio = f'{(actual - previo) / previo * 100:+7.1f}%' if previo else ''
+            print(f'{nombre:<32} {actual:>8.2f}s {previo if previo is not None else float("nan"):>8.2f}s {cambio:>8}')
+        print()
+    if base:
+        print(f'Base: commit {base.get("commit")} del {base.get("fecha")}')
+        if base.get('filas_resultado') != filas:
+            print('ADVERTENCIA: el resultado de los cruces cambió respecto a la base')
+    else:
+        print('Sin corrida comparable en el historial; esta queda como base.')
+
+    if not args.sin_guardar:
+        historial.append(entrada)
+        guardar_historial(args.historial, historial)
+
+    lentas = regresiones(base, entrada, args.umbral) if base else []
+    for etapa, previo, actual, cambio in lentas:
+        print(f'REGRESIÓN: {etapa} pasó de {previo:.2f} s a {actual:.2f} s ({cambio:+.1f}%, umbral {args.umbral:.0f}%)')
+    return 1 if lentas else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,123 @@
+"""
+Caché en disco para las bases ya leídas y normalizadas.
+
+La llave es el SHA-256 del contenido del archivo más el nombre y la versión
+del lector, así que la misma exportación de la DIAN subida varias veces (o
+tras reiniciar Streamlit) se carga directo desde disco. Los DataFrames se
+guardan en Parquet; si alguna columna mixta no se puede pasar a Arrow se
+guarda en pickle. Cuando el directorio supera el tamaño máximo se eliminan
+las entradas usadas hace más tiempo (LRU por fecha de modificación).
+"""
+import functools
+import hashlib
+import os
+import pickle
+import threading
+
+import pandas as pd
+
+CACHE_DIR_DEFECTO = os.environ.get('CONCILIADOR_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'conciliador'))
+CACHE_MAX_MB_DEFECTO = float(os.environ.get('CONCILIADOR_CACHE_MAX_MB', 2048))
+
+def leer_bytes(file_obj):
+    """Bytes de un archivo subido (UploadedFile / BytesIO), una ruta o un archivo abierto; deja el puntero en 0."""
+    if isinstance(file_obj, (str, os.PathLike)):
+        with open(file_obj, 'rb') as f: return f.read()
+    if hasattr(file_obj, 'getvalue'):
+        datos = file_obj.getvalue()
+    else:
+        file_obj.seek(0)
+        datos = file_obj.read()
+    file_obj.seek(0)
+    return datos
+
+class CacheDisco:
+    def __init__(self, directorio=CACHE_DIR_DEFECTO, max_mb=CACHE_MAX_MB_DEFECTO):
+        self.directorio = directorio
+        self.max_bytes = int(max_mb * 2**20)
+        self.aciertos = 0
+        self.fallos = 0
+        self._lock = threading.Lock()
+        os.makedirs(directorio, exist_ok=True)
+
+    def clave(self, datos, lector, version):
+        h = hashlib.sha256(datos)
+        h.update(f'|{lector}|{version}'.encode())
+        return h.hexdigest()
+
+    def _ruta(self, clave, ext):
+        return os.path.join(self.directorio, f'{clave}.{ext}')
+
+    def cargar(self, clave):
+        for ext, leer in (('parquet', pd.read_parquet), ('pkl', pd.read_pickle)):
+            ruta = self._ruta(clave, ext)
+            if not os.path.exists(ruta): continue
+            try:
+                df = leer(ruta)
+                os.utime(ruta)  # marca de uso para el LRU
+            except Exception:
+                continue
+            with self._lock: self.aciertos += 1
+            return df
+        with self._lock: self.fallos += 1
+        return None
+
+    def guardar(self, clave, df):
+        tmp = self._ruta(clave, f'{os.getpid()}.{threading.get_ident()}.tmp')
+        try:
+            df.to_parquet(tmp, index=True)
+            destino = self._ruta(clave, 'parquet')
+        except Exception:
+            with open(tmp, 'wb') as f: pickle.dump(df, f, protocol=pickle.HIGHEST_PROTOCOL)
+            destino = self._ruta(clave, 'pkl')
+        os.replace(tmp, destino)
+        self.depurar()
+
+    def depurar(self):
+        """Elimina las entradas menos usadas hasta quedar bajo el tamaño máximo."""
+        entradas = []
+        for nombre in os.listdir(self.directorio):
+            if not nombre.endswith(('.parquet', '.pkl')): continue
+            try: st_ = os.stat(os.path.join(self.directorio, nombre))
+            except OSError: continue
+            entradas.append((st_.st_mtime, st_.st_size, nombre))
+        total = sum(e[1] for e in entradas)
+        for _, tam, nombre in sorted(entradas):
+            if total <= self.max_bytes: break
+            try: os.remove(os.path.join(self.directorio, nombre))
+            except OSError: continue
+            total -= tam
+
+    def estadisticas(self):
+        return {'aciertos': self.aciertos, 'fallos': self.fallos}
+
+_cache_global = None
+
+def obtener_cache():
+    global _cache_global
+    if _cache_global is None: _cache_global = CacheDisco()
+    return _cache_global
+
+def cache_por_contenido(version):
+    """
+    Decorador para lectores `f(file_obj) -> DataFrame | None`. Cambiar `version`
+    cuando cambie el parseo invalida las entradas guardadas con la versión anterior.
+    """
+    def decorador(funcion):
+        @functools.wraps(funcion)
+        def envoltura(file_obj, *args, **kwargs):
+            if file_obj is None: return funcion(file_obj, *args, **kwargs)
+            try:
+                cache = obtener_cache()
+                clave = cache.clave(leer_bytes(file_obj), funcion.__name__, version)
+                df = cache.cargar(clave)
+            except OSError:
+                return funcion(file_obj, *args, **kwargs)
+            if df is not None: return df
+            df = funcion(file_obj, *args, **kwargs)
+            if isinstance(df, pd.DataFrame):
+                try: cache.guardar(clave, df)
+                except OSError: pass
+            return df
+        return envoltura
+    return decorador
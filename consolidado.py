@@ -0,0 +1,237 @@
+"""
+Conciliación consolidada de varias entidades y periodos.
+
+Lee todas las carpetas (archivos reconocidos por pipeline.ubicar_archivos),
+asigna cada fila a una partición (NIT de la entidad, periodo AAAA-MM) y
+ejecuta los cruces de cada partición en el pool de procesos de pipeline. El
+resultado es un resumen de diferencias por entidad, mes y cruce. El cruce
+con Gosocket solo cuenta documentos: no tiene valores y queda fuera de la
+diferencia por mes.
+
+- NIT de la entidad: en la DIAN, el emisor de lo emitido y el receptor de lo
+  demás. El auxiliar contable y Gosocket no traen ese NIT: toman el más
+  frecuente de la DIAN de su misma carpeta (con aviso si la DIAN de la
+  carpeta trae varias entidades: cada carpeta debe ser de una sola).
+- Periodo: fecha de emisión DIAN, `Fecha` contable y fecha de Gosocket. Un
+  documento contabilizado en un mes distinto al de su emisión queda como
+  sobrante en los dos meses.
+
+Con `estado`, cada partición guarda la firma de sus filas y su resumen; las
+particiones cuyas filas no cambiaron no se vuelven a cruzar.
+
+Uso:
+    python consolidado.py --carpetas cierres/2024 --salida reportes/ --trabajadores 8 --estado estado_consolidado/
+"""
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+import warnings
+
+import numpy as np
+import pandas as pd
+
+import cache_disco
+import engine
+import pipeline
+
+NOMBRE_RESUMEN = 'Resumen_Consolidado.xlsx'
+# Subir cuando cambie el cálculo del resumen: invalida las firmas guardadas
+VERSION_CONSOLIDADO = '1'
+SIN_NIT = 'SIN_NIT'
+COLUMNAS_RESUMEN = ['NIT_ENTIDAD', 'PERIODO', 'CRUCE', 'COINCIDENCIAS', 'SOBRANTES_DIAN', 'SOBRANTES_CONT', 'VALOR_DIAN', 'VALOR_CONTABLE', 'DIFERENCIA']
+
+def nit_entidad_dian(df):
+    """NIT propio de cada documento DIAN: emisor si el grupo es 'emitido', receptor en lo demás."""
+    col_emisor = next((c for c in df.columns if 'emisor' in c and ('nit' in c or 'doc' in c)), None)
+    col_receptor = next((c for c in df.columns if 'receptor' in c and ('nit' in c or 'doc' in c)), None)
+    col_grupo = next((c for c in df.columns if 'grupo' in c), None)
+    vacio = pd.Series('', index=df.index, dtype=object)
+    emisor = engine.clean_nit_numeric(df[col_emisor]) if col_emisor else vacio
+    receptor = engine.clean_nit_numeric(df[col_receptor]) if col_receptor else vacio
+    emitido = engine.texto_minusculas(df[col_grupo]).to_numpy() == 'emitido' if col_grupo else np.zeros(len(df), dtype=bool)
+    nits = pd.Series(np.where(emitido, emisor.to_numpy(dtype=object), receptor.to_numpy(dtype=object)), index=df.index, dtype=object)
+    return nits.replace('', SIN_NIT)
+
+def _nit_mas_frecuente(nits, carpeta=''):
+    conteo = nits[nits != SIN_NIT].value_counts()
+    if conteo.empty: return SIN_NIT
+    if len(conteo) > 1:
+        warnings.warn(
+            f"La DIAN de {carpeta} trae {len(conteo)} NIT de entidad; el auxiliar y Gosocket se asignan a "
+            f"{conteo.index[0]} ({conteo.iloc[0]} de {int(conteo.sum())} documentos).", engine.AvisoConciliador, stacklevel=2)
+    return conteo.index[0]
+
+def leer_carpeta(carpeta):
+    """(DIAN, contabilidad, Gosocket emitidos) de una carpeta, con NIT_ENTIDAD y PERIODO por fila (None si falta el archivo)."""
+    archivos = pipeline.ubicar_archivos(carpeta)
+    df_dian = df_cont = df_emi = None
+    nit_carpeta = SIN_NIT
+    if 'dian' in archivos:
+        df_dian, _ = engine.separar_dian(engine.leer_dian(pipeline.abrir_entrada(archivos['dian'])))
+        col_fecha = engine.columna_fecha_dian(df_dian)
+        df_dian['NIT_ENTIDAD'] = nit_entidad_dian(df_dian)
+        df_dian['PERIODO'] = engine.periodo_de_fechas(df_dian[col_fecha] if col_fecha else None)
+        nit_carpeta = _nit_mas_frecuente(df_dian['NIT_ENTIDAD'], carpeta)
+    if 'contabilidad' in archivos:
+        df_cont = engine.leer_contabilidad_completa(pipeline.abrir_entrada(archivos['contabilidad']))
+        if df_cont is None: raise ValueError(f"Error leyendo el archivo contable de {carpeta}. Verifica el formato.")
+        df_cont['NIT_ENTIDAD'] = nit_carpeta
+        df_cont['PERIODO'] = engine.periodo_de_fechas(df_cont.get('Fecha'))
+    if 'emitidos' in archivos:
+        df_emi = engine.leer_gosocket(pipeline.abrir_entrada(archivos['emitidos']))
+        col_fecha = next((c for c in df_emi.columns if 'fecha' in c), None)
+        df_emi['NIT_ENTIDAD'] = nit_carpeta
+        df_emi['PERIODO'] = engine.periodo_de_fechas(df_emi[col_fecha] if col_fecha else None)
+    return df_dian, df_cont, df_emi
+
+def _unir(partes):
+    partes = [p for p in partes if p is not None]
+    return engine.categorias_a_texto(pd.concat(partes, ignore_index=True)) if partes else None
+
+def firma_particion(*partes):
+    """Huella de las filas de la partición, sin importar su orden (y de las reglas que cambian el resultado)."""
+    h = hashlib.sha256(f'{VERSION_CONSOLIDADO}|{engine.VERSION_LECTORES}|'.encode())
+    h.update(json.dumps(engine.REGLAS_FAMILIAS_CUENTA, sort_keys=True).encode())
+    for df in partes:
+        if df is None or df.empty:
+            h.update(b'-')
+            continue
+        suma = pd.util.hash_pandas_object(df, index=False).to_numpy(dtype=np.uint64).sum(dtype=np.uint64)
+        h.update(f'{len(df)}|{"|".join(map(str, df.columns))}|{int(suma)}'.encode())
+    return h.hexdigest()
+
+def _valor_dian(df, total_col, iva_col, is_iva):
+    if df is None or df.empty: return 0.0
+    return float(engine.subtotal_dian(df, total_col, iva_col, is_iva).sum())
+
+def _valor_contable(df):
+    if df is None or df.empty or 'u_saldo_f' not in df.columns: return 0.0
+    return float(df['u_saldo_f'].sum())
+
+def resumir_particion(df_dian, df_cont, df_emi=None):
+    """Cruces de una partición -> filas del resumen (sin NIT ni periodo); se ejecuta en un proceso de trabajo."""
+    cruces = pipeline._cruzar_particion(df_dian, df_cont)
+    filas = []
+    for nombre, _, _, total_col, iva_col, is_iva in pipeline.hojas_reporte(df_dian):
+        if nombre not in cruces: continue
+        coin, sob_d, sob_c = cruces[nombre]
+        valor_dian = _valor_dian(coin, total_col, iva_col, is_iva) + _valor_dian(sob_d, total_col, iva_col, is_iva)
+        valor_cont = _valor_contable(coin) + _valor_contable(sob_c)
+        filas.append({
+            'CRUCE': nombre, 'COINCIDENCIAS': len(coin), 'SOBRANTES_DIAN': len(sob_d), 'SOBRANTES_CONT': len(sob_c),
+            'VALOR_DIAN': valor_dian, 'VALOR_CONTABLE': valor_cont, 'DIFERENCIA': valor_dian - valor_cont,
+        })
+    if df_emi is not None and not df_emi.empty and not df_cont.empty:
+        coin, sob_c, sob_go = engine.conciliar_ingresos_vs_gosocket(engine.ContabilidadPreparada(df_cont).ingresos(), df_emi)
+        filas.append({'CRUCE': 'gosocket', 'COINCIDENCIAS': len(coin), 'SOBRANTES_DIAN': len(sob_go), 'SOBRANTES_CONT': len(sob_c)})
+    return filas
+
+class EstadoConsolidado:
+    """particiones.json con {'NIT|PERIODO': {'firma': ..., 'filas': [...]}} del último consolidado."""
+    def __init__(self, directorio):
+        self.ruta = os.path.join(directorio, 'particiones.json')
+        self.particiones = {}
+        if os.path.exists(self.ruta):
+            try:
+                with open(self.ruta, encoding='utf-8') as f: self.particiones = json.load(f)
+            except (OSError, ValueError):
+                print(f"Estado consolidado ilegible en {self.ruta}; se recalculan todas las particiones.")
+
+    def vigente(self, clave, firma):
+        previa = self.particiones.get(clave)
+        return previa['filas'] if previa and previa.get('firma') == firma else None
+
+    def guardar(self, particiones):
+        os.makedirs(os.path.dirname(self.ruta), exist_ok=True)
+        tmp = f'{self.ruta}.{os.getpid()}.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f: json.dump(particiones, f, ensure_ascii=False, default=float)
+        os.replace(tmp, self.ruta)
+
+def conciliar_consolidado(carpetas, trabajadores=None, estado=None, progreso=None):
+    """
+    Devuelve (resumen por NIT_ENTIDAD, PERIODO y CRUCE; una fila por partición
+    con sus filas de entrada y si se recalculó). Con `trabajadores` > 1 las
+    particiones se cruzan en el pool de procesos de pipeline.
+    """
+    progreso = progreso or pipeline._sin_progreso
+    trabajadores = trabajadores or pipeline.TRABAJADORES_DEFECTO
+    lecturas = []
+    for i, carpeta in enumerate(carpetas):
+        progreso(int(5 + 40 * i / max(len(carpetas), 1)), f"Leyendo {carpeta}...")
+        lecturas.append(leer_carpeta(carpeta))
+    df_dian, df_cont, df_emi = (_unir(partes) for partes in zip(*lecturas)) if lecturas else (None, None, None)
+    if df_dian is None or df_cont is None:
+        raise ValueError("Se necesita al menos un archivo DIAN y uno contable entre las carpetas.")
+
+    llaves = ['NIT_ENTIDAD', 'PERIODO']
+    grupos = {lado: dict(list(df.groupby(llaves, sort=True))) for lado, df in (('dian', df_dian), ('cont', df_cont), ('emi', df_emi)) if df is not None}
+    claves = sorted(set().union(*(g.keys() for g in grupos.values())))
+    vacios = {lado: df.iloc[:0] for lado, df in (('dian', df_dian), ('cont', df_cont), ('emi', df_emi)) if df is not None}
+    previo = EstadoConsolidado(estado) if estado else None
+
+    progreso(50, f"Cruzando {len(claves)} particiones entidad/periodo...")
+    pool = pipeline._pool_procesos(trabajadores) if trabajadores > 1 else None
+    particiones, firmas, resultados = [], {}, {}
+    for clave in claves:
+        partes = [grupos[lado].get(clave, vacios[lado]) if lado in grupos else None for lado in ('dian', 'cont', 'emi')]
+        id_clave = '|'.join(clave)
+        firmas[id_clave] = firma_particion(*partes)
+        filas = previo.vigente(id_clave, firmas[id_clave]) if previo else None
+        particiones.append({'NIT_ENTIDAD': clave[0], 'PERIODO': clave[1], 'FILAS_DIAN': len(partes[0]), 'FILAS_CONT': len(partes[1]), 'RECALCULADA': filas is None})
+        if filas is None:
+            filas = pool.submit(resumir_particion, *partes) if pool is not None else resumir_particion(*partes)
+        resultados[id_clave] = filas
+    resultados = {k: v.result() if hasattr(v, 'result') else v for k, v in resultados.items()}
+    if previo is not None: previo.guardar({k: {'firma': firmas[k], 'filas': filas} for k, filas in resultados.items()})
+
+    filas = [
+        {'NIT_ENTIDAD': p['NIT_ENTIDAD'], 'PERIODO': p['PERIODO'], **f}
+        for p in particiones for f in resultados[f"{p['NIT_ENTIDAD']}|{p['PERIODO']}"]
+    ]
+    return pd.DataFrame(filas, columns=COLUMNAS_RESUMEN), pd.DataFrame(particiones)
+
+def escribir_resumen(resumen, particiones, ruta):
+    """Libro con el detalle por entidad/mes/cruce, la diferencia por mes en columnas y el estado de cada partición."""
+    # Los cruces sin valores (Gosocket) no van a la diferencia por mes: saldrían como 0
+    por_mes = resumen.dropna(subset=['DIFERENCIA']).pivot_table(index=['NIT_ENTIDAD', 'CRUCE'], columns='PERIODO', values='DIFERENCIA', aggfunc='sum', fill_value=0).reset_index()
+    por_mes.columns = [str(c) for c in por_mes.columns]
+    with pd.ExcelWriter(ruta, engine='xlsxwriter', engine_kwargs={'options': engine.OPCIONES_LIBRO_REPORTE}) as writer:
+        engine.escribir_hoja_base(writer, 'Diferencias', resumen)
+        engine.escribir_hoja_base(writer, 'Diferencia por mes', por_mes)
+        engine.escribir_hoja_base(writer, 'Particiones', particiones)
+    return ruta
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--carpetas', nargs='+', required=True, metavar='CARPETA', help='Carpetas con subcarpetas por entidad/periodo, o las subcarpetas mismas')
+    parser.add_argument('--salida', required=True, help='Directorio donde se escribe el resumen')
+    parser.add_argument('--trabajadores', type=int, default=pipeline.TRABAJADORES_DEFECTO, help='Procesos para cruzar particiones (1 = secuencial)')
+    parser.add_argument('--estado', help='Directorio con las firmas del último consolidado: las particiones sin cambios no se recalculan')
+    parser.add_argument('--silencioso', action='store_true', help='No imprime el avance por etapa')
+    parser.add_argument('--sin-cache', action='store_true', help='No usa la caché en disco de archivos ya leídos')
+    args = parser.parse_args(argv)
+
+    if not args.sin_cache:
+        engine.configurar_cache(cache_disco.cache_por_contenido(engine.VERSION_LECTORES))
+
+    def progreso(pct, mensaje):
+        if not args.silencioso: print(f'  [{pct:>3}%] {mensaje}', flush=True)
+
+    carpetas = []
+    for raiz in args.carpetas:
+        subcarpetas = sorted(os.path.join(raiz, d) for d in os.listdir(raiz) if os.path.isdir(os.path.join(raiz, d)))
+        carpetas.extend(subcarpetas or [raiz])
+    inicio = time.perf_counter()
+    resumen, particiones = conciliar_consolidado(carpetas, args.trabajadores, args.estado, progreso)
+    os.makedirs(args.salida, exist_ok=True)
+    ruta = escribir_resumen(resumen, particiones, os.path.join(args.salida, NOMBRE_RESUMEN))
+    recalculadas = int(particiones['RECALCULADA'].sum()) if not particiones.empty else 0
+    print(f'{len(particiones)} particiones ({recalculadas} recalculadas) en {time.perf_counter() - inicio:.1f} s')
+    print(f'Resumen: {ruta}')
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
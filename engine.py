@@ -1,16 +1,33 @@
-import streamlit as st
 import pandas as pd
 import numpy as np
+import importlib.util
+import itertools
+import json
+import os
 import re
 import warnings
+from datetime import date, datetime
 
 # Configuración
 pd.set_option('future.no_silent_downcasting', True)
 warnings.simplefilter("ignore")
 
+class AvisoConciliador(UserWarning):
+    """Avisos propios (respaldos, datos ambiguos): siguen visibles aunque se ignoren los de las librerías."""
+
+warnings.simplefilter("default", AvisoConciliador)
+
 # CONSTANTES
 LLAVE_DIAN_CONT_COL_NAME = 'LLAVE_DIAN'
 LLAVE_SERIE_FOLIO_COL_NAME = 'LLAVE_SERIE_FOLIO'
+# Subir cuando cambie el parseo de los lectores: invalida las cachés persistentes
+VERSION_LECTORES = '5'
+
+# Tipo de texto de las llaves: 'pandas' (object, re de Python) o 'arrow'
+# (string[pyarrow], kernels de Arrow con RE2). Mismo resultado salvo mayúsculas que
+# cambian de largo ('ß' -> 'SS' solo en Python); ver tests/test_paridad_backend
+BACKENDS_TEXTO = ('pandas', 'arrow')
+BACKEND_TEXTO = os.environ.get('CONCILIADOR_BACKEND', 'pandas')
 
 # COLORES
 CABIFY_PURPLE = '#7145D6'
@@ -25,9 +42,7 @@ WHITE         = '#FFFFFF'
 def normalize_col_name(col_name):
     return re.sub(r'[^\w]+', '_', str(col_name)).lower().strip('_')
 
-def standardize_company_name(name_series):
-    if name_series is None or name_series.empty:
-        return pd.Series(['SIN NOMBRE'] * len(name_series), dtype=str)
+def _normalizar_nombres(name_series):
     return (
         name_series.astype(str)
         .str.upper()
@@ -38,10 +53,128 @@ def standardize_company_name(name_series):
         .str.strip()
     )
 
+RUTA_EMPRESAS_DEFECTO = os.environ.get('CONCILIADOR_EMPRESAS', os.path.join(os.path.expanduser('~'), '.config', 'conciliador', 'empresas.json'))
+
+class NormalizadorEmpresas:
+    """
+    Memoria nombre original -> EMPRESA_GRUPO. Las regex solo corren sobre nombres
+    no vistos antes; los alias manuales (por nombre original o ya normalizado)
+    tienen prioridad. Con `ruta` se carga y guarda en JSON entre corridas.
+    """
+    def __init__(self, ruta=None):
+        self.ruta = ruta
+        self.nombres = {}
+        self.alias = {}
+        self._modificado = False
+        if ruta and os.path.exists(ruta):
+            with open(ruta, encoding='utf-8') as f: datos = json.load(f)
+            self.nombres.update(datos.get('nombres', {}))
+            self.alias.update(datos.get('alias', {}))
+
+    def agregar_alias(self, nombre, grupo):
+        self.alias[nombre] = grupo
+        self._modificado = True
+
+    def agrupar(self, unicos):
+        faltantes = [u for u in unicos if u not in self.nombres]
+        if faltantes:
+            self.nombres.update(zip(faltantes, _normalizar_nombres(pd.Series(faltantes, dtype=object)).tolist()))
+            self._modificado = True
+        grupos = []
+        for u in unicos:
+            limpio = self.nombres[u]
+            grupos.append(self.alias.get(u) or self.alias.get(limpio) or limpio)
+        return grupos
+
+    def incorporar(self, otro):
+        """Suma los nombres que `otro` (p. ej. la copia usada en un proceso de trabajo) limpió y este aún no tenía."""
+        nuevos = {k: v for k, v in otro.nombres.items() if k not in self.nombres}
+        if nuevos:
+            self.nombres.update(nuevos)
+            self._modificado = True
+
+    def guardar(self):
+        if not self.ruta or not self._modificado: return
+        os.makedirs(os.path.dirname(self.ruta) or '.', exist_ok=True)
+        tmp = f'{self.ruta}.{os.getpid()}.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump({'alias': self.alias, 'nombres': self.nombres}, f, ensure_ascii=False, indent=0, sort_keys=True)
+        os.replace(tmp, self.ruta)
+        self._modificado = False
+
+_normalizador_empresas = NormalizadorEmpresas()
+
+def configurar_normalizador_empresas(ruta=RUTA_EMPRESAS_DEFECTO):
+    """Usa el diccionario persistente en `ruta` (None: solo en memoria). Llamarlo de nuevo con la misma ruta no recarga."""
+    global _normalizador_empresas
+    if _normalizador_empresas.ruta != ruta or ruta is None:
+        _normalizador_empresas = NormalizadorEmpresas(ruta)
+    return _normalizador_empresas
+
+def normalizador_empresas():
+    return _normalizador_empresas
+
+def standardize_company_name(name_series, normalizador=None):
+    if name_series is None or name_series.empty:
+        return pd.Series(['SIN NOMBRE'] * len(name_series), dtype=str)
+    # Solo los nombres distintos pasan por la limpieza; el resultado se difunde por códigos
+    codigos, unicos = pd.factorize(name_series.astype(str).where(name_series.notna()))
+    # Los nulos quedan con código -1, que toma el último elemento: 'SIN NOMBRE'
+    grupos = np.array([*(normalizador or _normalizador_empresas).agrupar(list(unicos)), 'SIN NOMBRE'], dtype=object)
+    return pd.Series(grupos[codigos], index=name_series.index, dtype=object)
+
+# \w de Python es Unicode; en RE2 es solo ASCII, así que para Arrow se escribe con clases Unicode
+_NO_PALABRA = {'pandas': r'[^\w]+', 'arrow': r'[^\p{L}\p{N}_]+'}
+
+def configurar_backend(nombre):
+    """Cambia el backend de texto; queda en el entorno para los procesos de trabajo que se creen después."""
+    global BACKEND_TEXTO
+    if nombre not in BACKENDS_TEXTO:
+        raise ValueError(f"Backend desconocido: {nombre} (opciones: {', '.join(BACKENDS_TEXTO)})")
+    if nombre == 'arrow' and importlib.util.find_spec('pyarrow') is None:
+        warnings.warn("pyarrow no está instalado; se usa el backend pandas.", AvisoConciliador, stacklevel=2)
+        nombre = 'pandas'
+    BACKEND_TEXTO = nombre
+    os.environ['CONCILIADOR_BACKEND'] = nombre
+
+# pandas >= 3: astype(str) da el tipo 'str' (Arrow, conserva los nulos, \w solo ASCII)
+_ASTYPE_STR_OBJECT = pd.Series([np.nan], dtype=object).astype(str).dtype == object
+
+def _como_texto(serie):
+    """astype(str) de siempre (object, NaN -> 'nan'), en el tipo de texto del backend."""
+    if _ASTYPE_STR_OBJECT: texto = serie.astype(str)
+    else: texto = pd.Series([str(v) for v in serie.to_numpy(dtype=object)], index=serie.index, dtype=object)
+    return texto.astype('string[pyarrow]') if BACKEND_TEXTO == 'arrow' else texto
+
+def _de_vuelta(texto):
+    """Las llaves salen siempre como object: merges, factorize y reportes no dependen del backend."""
+    return texto.astype(object) if BACKEND_TEXTO == 'arrow' else texto
+
+def limpiar_llave(texto):
+    """Quita todo lo que no sea letra, dígito o '_' y pasa a mayúsculas."""
+    return _de_vuelta(texto.str.replace(_NO_PALABRA[BACKEND_TEXTO], '', regex=True).str.upper())
+
 def clean_nit_numeric(nit_series):
     if nit_series is None or nit_series.empty:
         return pd.Series([''] * len(nit_series), dtype=str)
-    return nit_series.astype(str).str.replace(r'[^0-9]+', '', regex=True)
+    if pd.api.types.is_integer_dtype(nit_series):
+        # Ya tipado al leer (Int64): solo falta pasarlo a texto
+        return nit_series.astype(object).where(nit_series.notna(), '').astype(str)
+    return _de_vuelta(_como_texto(nit_series).str.replace(r'[^0-9]+', '', regex=True))
+
+def texto_minusculas(serie):
+    """astype(str).str.strip().str.lower(); en categorías se calcula una vez por categoría."""
+    if isinstance(serie.dtype, pd.CategoricalDtype):
+        categorias = serie.cat.categories.astype(str).str.strip().str.lower().to_numpy(dtype=object)
+        codigos = serie.cat.codes.to_numpy()
+        return pd.Series(np.where(codigos >= 0, categorias[codigos], 'nan'), index=serie.index, dtype=object)
+    return serie.astype(str).str.strip().str.lower()
+
+def categorias_a_texto(df):
+    """Columnas category -> object, para que el armado del reporte pueda escribir cualquier texto en ellas."""
+    categorias = df.select_dtypes('category').columns
+    if len(categorias): df[categorias] = df[categorias].astype(object)
+    return df
 
 def limpiar_moneda_colombia(valor):
     if pd.isna(valor) or str(valor).strip() == '': return 0.0
@@ -57,107 +190,342 @@ def limpiar_moneda_colombia(valor):
         return float(s)
     except: return 0.0
 
+def _texto_a_float(valor):
+    try: return float(valor)
+    except: return 0.0
+
+_PATRON_FLOAT_SIMPLE = r'[+-]?(\d+\.?\d*|\.\d+)([eE][+-]?\d+)?'
+
+def _textos_a_float(textos):
+    # Los textos con forma numérica simple se convierten en bloque (redondeo correcto, igual que float());
+    # el resto (basura, 'nan', 'inf', '1_000') pasa por float() uno a uno para conservar la semántica.
+    simples = textos.str.fullmatch(_PATRON_FLOAT_SIMPLE).fillna(False).astype(bool)
+    resultado = pd.Series(0.0, index=textos.index)
+    if simples.any(): resultado[simples] = textos[simples].astype('float64')
+    if (~simples).any(): resultado[~simples] = textos[~simples].map(_texto_a_float).astype('float64')
+    return resultado
+
+def limpiar_moneda_colombia_vectorizado(valores):
+    """
+    Versión por columna de limpiar_moneda_colombia (mismos resultados).
+    Las celdas ya numéricas pasan directo; solo los textos se normalizan,
+    con operaciones de columna en lugar de un apply celda por celda.
+    """
+    serie = valores if isinstance(valores, pd.Series) else pd.Series(valores)
+    if serie.empty: return pd.Series([], index=serie.index, dtype='float64')
+    if pd.api.types.is_bool_dtype(serie): return pd.Series(0.0, index=serie.index)
+    if pd.api.types.is_numeric_dtype(serie): return serie.astype('float64').fillna(0.0)
+
+    resultado = pd.Series(0.0, index=serie.index)
+    vacios = serie.isna()
+    if isinstance(serie.dtype, pd.StringDtype): es_texto = ~vacios
+    elif pd.api.types.is_object_dtype(serie):
+        try: es_texto = serie.str.len().notna()
+        except AttributeError: es_texto = pd.Series(False, index=serie.index)  # columna object sin ningún texto
+    else: es_texto = pd.Series(False, index=serie.index)
+    numericos = ~vacios & ~es_texto
+    if numericos.any():
+        celdas = serie[numericos]
+        if pd.api.types.infer_dtype(celdas, skipna=True) in ('floating', 'integer', 'mixed-integer-float', 'decimal'):
+            resultado[numericos] = pd.to_numeric(celdas).astype('float64')
+        else:
+            es_texto = es_texto | numericos  # booleanos, fechas, etc. siguen la ruta de texto como en el original
+    if not es_texto.any(): return resultado
+
+    s = serie[es_texto].astype(str).str.replace(r'[$ ]', '', regex=True)
+    # "1.234,56" -> 1234.56 | "1,234.56" -> 1234.56 | "1234,5" -> 12345 | "1234,56" -> 1234.56
+    tiene_punto = s.str.contains('.', regex=False)
+    coma_tras_ultimo_punto = s.str.contains(r',[^.]*$', regex=True)
+    dos_decimales = s.str.contains(r',[^,]{2}$', regex=True)
+    coma_decimal = (tiene_punto & coma_tras_ultimo_punto) | (~tiene_punto & dos_decimales)
+    s = pd.concat([
+        s[coma_decimal].str.replace('.', '', regex=False).str.replace(',', '.', regex=False),
+        s[~coma_decimal].str.replace(',', '', regex=False),
+    ]).reindex(s.index)
+
+    resultado[es_texto] = _textos_a_float(s)
+    return resultado
+
 # =================================================================
-# 2. LECTURA OPTIMIZADA (CACHE + CALAMINE)
+# 2. LECTURA OPTIMIZADA (CALAMINE)
 # =================================================================
 
-@st.cache_data(ttl=3600, show_spinner=False)
-def leer_contabilidad_completa(file_obj):
+FILAS_POR_BLOQUE_LECTURA = 100_000
+
+def _celda_calamine(valor):
+    # Igual que read_excel(engine='calamine'): enteros sin '.0', fechas como datetime y vacíos como NaN
+    if isinstance(valor, float) and valor.is_integer(): return int(valor)
+    if isinstance(valor, str) and valor == '': return np.nan
+    if type(valor) is date: return datetime(valor.year, valor.month, valor.day)
+    return valor
+
+def _filas_hoja(file_obj):
     """
-    Lee contabilidad usando caché. Si el archivo no cambia, no se recalcula.
-    Usamos 'openpyxl' aquí por la complejidad de buscar el encabezado,
-    pero al estar en caché, solo tarda la primera vez.
+    Filas de la primera hoja, una a una: calamine (Rust) y, si no abre el
+    libro, openpyxl en modo read-only. Las filas vacías se omiten.
     """
-    if file_obj is None: return None
+    file_obj.seek(0)
     try:
-        # Pre-lectura para encontrar encabezado
-        file_obj.seek(0) 
-        try: df_preview = pd.read_excel(file_obj, nrows=20, header=None, engine='openpyxl')
-        except: df_preview = pd.read_excel(file_obj, nrows=20, header=None)
-        
-        header_row = 0
-        for i, row in df_preview.iterrows():
-            row_str = row.astype(str).values
-            if 'Cuenta' in row_str and 'Fecha' in row_str:
-                header_row = i; break
-        
-        # Lectura real
-        file_obj.seek(0)
-        df = pd.read_excel(file_obj, header=header_row, engine='openpyxl')
-        
-        # Limpieza
-        df['Cuenta'] = df['Cuenta'].astype(str).replace(['nan', 'None', ''], np.nan)
-        condicion_cabecera = df['Cuenta'].str.match(r'^\d', na=False)
-        df['CUENTA_COMPLETA'] = df['Cuenta'].where(condicion_cabecera, other=np.nan).ffill()
-        df = df[~df['Cuenta'].astype(str).str.startswith('Total', na=False)] 
-        df = df[df['Fecha'].notna()] 
-        df['Cuenta'] = df['CUENTA_COMPLETA']
-        
-        df['CODIGO_CUENTA'] = df['Cuenta'].str.strip().str.extract(r'^(\d+)')
-        
-        if 'Fecha' in df.columns:
-            df['Fecha'] = pd.to_datetime(df['Fecha'], errors='coerce').dt.strftime('%Y-%m-%d')
+        from python_calamine import load_workbook
+        filas = load_workbook(file_obj).get_sheet_by_index(0).iter_rows()
+    except Exception:
+        filas = None
+    if filas is not None:
+        for fila in filas:
+            if any(v != '' for v in fila): yield [_celda_calamine(v) for v in fila]
+        return
+    import openpyxl
+    file_obj.seek(0)
+    wb = openpyxl.load_workbook(file_obj, read_only=True, data_only=True)
+    try:
+        ws = wb.worksheets[0]
+        ws.reset_dimensions()
+        for fila in ws.iter_rows(values_only=True):
+            if any(v is not None and v != '' for v in fila): yield [np.nan if v is None or v == '' else v for v in fila]
+    finally:
+        wb.close()
 
-        # Cálculo de Saldo
-        col_deb = next((c for c in df.columns if 'Déb' in c), None)
-        col_cred = next((c for c in df.columns if 'Créd' in c), None)
-        
-        val_deb = df[col_deb].apply(limpiar_moneda_colombia) if col_deb else 0.0
-        val_cred = df[col_cred].apply(limpiar_moneda_colombia) if col_cred else 0.0
-        
-        df['SALDO_NETO_CALCULADO'] = val_deb - val_cred
-        
-        col_ref_orig = next((c for c in df.columns if 'mero de doc' in c or 'Nro' in c), 'Número de documento')
-        col_nit_orig = next((c for c in df.columns if 'Identifi' in c or 'Nit' in c), 'Número Identificación')
-        col_nom_orig = next((c for c in df.columns if 'Nombre' in c), 'Nombre')
-        col_nota_orig = next((c for c in df.columns if 'Nota' in c), 'Nota')
-
-        df_renamed = df.rename(columns={
-            col_ref_orig: 'u_ref', 
-            col_nit_orig: 'u_infoco01',
-            col_nom_orig: 'u_cardname', 
-            col_nota_orig: 'u_memo', 
-            'Cuenta': 'u_acctname'
-        })
-        df_renamed['u_saldo_f'] = df['SALDO_NETO_CALCULADO']
-        
-        if 'u_infoco01' in df_renamed.columns:
-            df_renamed['u_infoco01'] = df_renamed['u_infoco01'].astype(str).str.replace(r'\.0$', '', regex=True)
+def filas_a_df(filas, columnas):
+    """Filas de _filas_hoja -> DataFrame con `columnas`; las filas cortas se completan con NaN."""
+    ancho = len(columnas)
+    return pd.DataFrame([list(f[:ancho]) + [np.nan] * (ancho - len(f)) for f in filas], columns=columnas)
+
+def leer_hoja_por_bloques(file_obj, filas_por_bloque=FILAS_POR_BLOQUE_LECTURA, columnas_clave=None, filas_busqueda=20):
+    """
+    Recorre la primera hoja en streaming y entrega DataFrames de hasta
+    `filas_por_bloque` filas. Con `columnas_clave` el encabezado es la primera
+    fila (de las `filas_busqueda` iniciales) que las contiene todas; si no, la fila 0.
+    Solo esas filas iniciales se miran antes de armar el primer bloque.
+    """
+    filas = _filas_hoja(file_obj)
+    iniciales = list(itertools.islice(filas, filas_busqueda if columnas_clave else 1))
+    if not iniciales: return
+    fila_enc = 0
+    if columnas_clave:
+        for i, fila in enumerate(iniciales):
+            textos = [str(v) for v in fila]
+            if all(c in textos for c in columnas_clave):
+                fila_enc = i; break
+    columnas = nombres_encabezado(list(iniciales[fila_enc]))
+    bloque = list(iniciales[fila_enc + 1:])
+    for fila in filas:
+        bloque.append(fila)
+        if len(bloque) >= filas_por_bloque:
+            yield filas_a_df(bloque, columnas)
+            bloque = []
+    if bloque: yield filas_a_df(bloque, columnas)
+
+def nombres_encabezado(valores):
+    # Mismos nombres que pandas con header=n: 'Unnamed: i' para vacíos y sufijo '.n' para repetidos
+    nombres, vistos = [], {}
+    for i, v in enumerate(valores):
+        nombre = f'Unnamed: {i}' if pd.isna(v) or str(v).strip() == '' else str(v)
+        if nombre in vistos:
+            vistos[nombre] += 1
+            nombre = f'{nombre}.{vistos[nombre]}'
+        else:
+            vistos[nombre] = 0
+        nombres.append(nombre)
+    return nombres
 
-        return df_renamed
+def leer_hoja_con_encabezado(file_obj, columnas_clave=('Cuenta', 'Fecha'), filas_busqueda=20):
+    """
+    Lee la hoja una sola vez y ubica el encabezado en las primeras filas
+    (la que contiene todas las columnas clave). Si no aparece, usa la fila 0.
+    La tabla se arma por bloques de leer_hoja_por_bloques.
+    """
+    bloques = list(leer_hoja_por_bloques(file_obj, columnas_clave=columnas_clave, filas_busqueda=filas_busqueda))
+    if not bloques: return pd.DataFrame()
+    return pd.concat(bloques, ignore_index=True) if len(bloques) > 1 else bloques[0]
+
+def leer_contabilidad_completa(file_obj):
+    """
+    Lee el auxiliar contable de Netsuite.
+    El encabezado se detecta sobre la misma lectura (calamine, con respaldo
+    openpyxl en streaming), sin abrir el libro dos veces.
+    """
+    if file_obj is None: return None
+    try:
+        df = leer_hoja_con_encabezado(file_obj)
+        return normalizar_contabilidad(df)[0]
     except Exception as e: 
         print(f"Error: {e}")
         return None
 
-@st.cache_data(ttl=3600, show_spinner=False)
+def normalizar_contabilidad(df, cuenta_previa=None):
+    """
+    Limpieza del auxiliar ya con encabezado: cuenta de cada movimiento, saldo neto
+    y nombres u_*. `cuenta_previa` es la última cabecera de cuenta del bloque
+    anterior cuando se lee por bloques. Devuelve (df, última cabecera vista).
+    """
+    # Limpieza
+    df['Cuenta'] = df['Cuenta'].astype(str).replace(['nan', 'None', ''], np.nan)
+    condicion_cabecera = df['Cuenta'].str.match(r'^\d', na=False)
+    df['CUENTA_COMPLETA'] = df['Cuenta'].where(condicion_cabecera, other=np.nan).ffill()
+    if cuenta_previa is not None: df['CUENTA_COMPLETA'] = df['CUENTA_COMPLETA'].fillna(cuenta_previa)
+    cabeceras = df['CUENTA_COMPLETA'].dropna()
+    ultima_cuenta = cabeceras.iloc[-1] if not cabeceras.empty else cuenta_previa
+    df = df[~df['Cuenta'].astype(str).str.startswith('Total', na=False)] 
+    df = df[df['Fecha'].notna()] 
+    df['Cuenta'] = df['CUENTA_COMPLETA']
+    
+    df['CODIGO_CUENTA'] = df['Cuenta'].str.strip().str.extract(r'^(\d+)')
+    
+    if 'Fecha' in df.columns:
+        df['Fecha'] = pd.to_datetime(df['Fecha'], errors='coerce').dt.strftime('%Y-%m-%d')
+
+    # Cálculo de Saldo
+    col_deb = next((c for c in df.columns if 'Déb' in c), None)
+    col_cred = next((c for c in df.columns if 'Créd' in c), None)
+    
+    val_deb = limpiar_moneda_colombia_vectorizado(df[col_deb]) if col_deb else 0.0
+    val_cred = limpiar_moneda_colombia_vectorizado(df[col_cred]) if col_cred else 0.0
+    
+    df['SALDO_NETO_CALCULADO'] = val_deb - val_cred
+    
+    col_ref_orig = next((c for c in df.columns if 'mero de doc' in c or 'Nro' in c), 'Número de documento')
+    col_nit_orig = next((c for c in df.columns if 'Identifi' in c or 'Nit' in c), 'Número Identificación')
+    col_nom_orig = next((c for c in df.columns if 'Nombre' in c), 'Nombre')
+    col_nota_orig = next((c for c in df.columns if 'Nota' in c), 'Nota')
+
+    df_renamed = df.rename(columns={
+        col_ref_orig: 'u_ref', 
+        col_nit_orig: 'u_infoco01',
+        col_nom_orig: 'u_cardname', 
+        col_nota_orig: 'u_memo', 
+        'Cuenta': 'u_acctname'
+    })
+    df_renamed['u_saldo_f'] = df['SALDO_NETO_CALCULADO']
+    
+    if 'u_infoco01' in df_renamed.columns:
+        df_renamed['u_infoco01'] = df_renamed['u_infoco01'].astype(str).str.replace(r'\.0$', '', regex=True)
+
+    return df_renamed, ultima_cuenta
+
+# Esquemas de tipos al leer: (tipo, alternativas); una columna (nombre normalizado)
+# toma el primer tipo con alguna alternativa cuyos fragmentos contiene todos.
+# 'texto' queda como está (llaves), 'nit' pasa a Int64, 'categoria' a category,
+# 'fecha' a datetime64 y 'monto' a float64.
+ESQUEMA_DIAN = (
+    ('texto', ((LLAVE_DIAN_CONT_COL_NAME,), ('prefijo',), ('folio',), ('serie',))),
+    ('nit', (('nit', 'emisor'), ('nit', 'receptor'), ('doc', 'emisor'), ('doc', 'receptor'))),
+    ('categoria', (('grupo',), ('tipo',), ('nombre',))),
+    ('fecha', (('fecha',),)),
+    ('monto', (('total',), ('iva',), ('impuesto',))),
+)
+# La hoja 'Base DIAN' lleva la exportación completa con el texto original (NIT,
+# fechas y montos como vienen); solo se pasan a categoría las columnas repetitivas
+ESQUEMA_DIAN_BASE = tuple((tipo, alternativas) for tipo, alternativas in ESQUEMA_DIAN if tipo in ('texto', 'categoria'))
+# Gosocket solo aporta la llave a los cruces; sus columnas se conservan todas y con
+# su texto original (van a las hojas Base)
+ESQUEMA_GOSOCKET = (
+    ('texto', ((LLAVE_SERIE_FOLIO_COL_NAME,), ('serie',), ('prefijo',), ('folio',), ('numero',), ('referencia',))),
+    ('categoria', (('raz', 'social'), ('nombre',), ('estado',), ('tipo',))),
+)
+
+def tipo_de_columna(nombre, esquema):
+    for tipo, alternativas in esquema:
+        if any(all(f in nombre for f in alt) for alt in alternativas): return tipo
+    return None
+
+def convertir_fechas(serie, dayfirst=True):
+    """
+    Texto de fechas -> datetime64. Primero ISO (AAAA-MM-DD, con o sin hora);
+    lo que no sea ISO se lee con `dayfirst` (dd/mm/aaaa), una vez por valor distinto.
+    """
+    if pd.api.types.is_datetime64_any_dtype(serie): return serie
+    fechas = pd.to_datetime(serie, errors='coerce', format='ISO8601')
+    faltan = fechas.isna() & serie.notna()
+    if faltan.any():
+        pendientes = serie[faltan]
+        unicos = pendientes.unique()
+        mapa = pd.Series(pd.to_datetime(pd.Series(unicos), errors='coerce', dayfirst=dayfirst, format='mixed').to_numpy(), index=unicos)
+        fechas = fechas.where(~faltan, pendientes.map(mapa))
+    return fechas
+
+def _nit_entero(serie):
+    digitos = clean_nit_numeric(serie).replace('', np.nan)
+    try:
+        return pd.to_numeric(digitos, errors='coerce').astype('Int64')
+    except (TypeError, ValueError, OverflowError):
+        return digitos  # NIT de más de 18 dígitos: se deja como texto limpio
+
+def tipar_columnas(df, esquema, dayfirst=True, solo_esquema=True):
+    """
+    Convierte una sola vez, al leer, las columnas según `esquema`. Con
+    `solo_esquema` se descartan las que el esquema no reconoce. Deja en
+    df.attrs['memoria_mb'] la memoria (deep) antes y después.
+    """
+    antes = df.memory_usage(deep=True).sum() / 2**20
+    df = df.loc[:, ~df.columns.duplicated()]
+    tipos = {c: tipo_de_columna(c, esquema) for c in df.columns}
+    df = df[[c for c, t in tipos.items() if t or not solo_esquema]].copy()
+    for c in df.columns:
+        tipo = tipos[c]
+        if tipo == 'monto':
+            df[c] = pd.to_numeric(df[c], errors='coerce')
+        elif tipo == 'nit':
+            df[c] = _nit_entero(df[c])
+        elif tipo == 'fecha':
+            df[c] = convertir_fechas(df[c], dayfirst=dayfirst)
+        elif tipo == 'categoria':
+            df[c] = df[c].astype('category')
+    df.attrs['memoria_mb'] = (round(antes, 1), round(df.memory_usage(deep=True).sum() / 2**20, 1))
+    return df
+
+def normalizar_dian(df):
+    """Nombres normalizados y la exportación completa con ESQUEMA_DIAN_BASE (texto original, categorías)."""
+    df.columns = [normalize_col_name(c) for c in df.columns]
+    return tipar_columnas(df, ESQUEMA_DIAN_BASE, solo_esquema=False)
+
+def separar_dian(df):
+    """
+    Base de leer_dian -> (solo las columnas que usa el motor, tipadas con
+    ESQUEMA_DIAN y NIT a Int64; la exportación completa, con su texto, para
+    la hoja 'Base DIAN'). Las dos llevan la llave de conciliación.
+    """
+    base = crear_llave_conciliacion(df)
+    return tipar_columnas(base, ESQUEMA_DIAN), base
+
 def leer_dian(file_obj):
     """Usa el motor CALAMINE (Rust) para máxima velocidad en archivos grandes."""
     if file_obj is None: return None
     try:
         # AQUÍ ESTÁ EL TRUCO: engine="calamine"
         df = pd.read_excel(file_obj, engine="calamine", dtype=str)
-        col_map = {col: normalize_col_name(col) for col in df.columns}
-        df.rename(columns=col_map, inplace=True)
-        return df
     except Exception:
         # Fallback a openpyxl si calamine falla
         file_obj.seek(0)
         df = pd.read_excel(file_obj, dtype=str)
-        col_map = {col: normalize_col_name(col) for col in df.columns}
-        df.rename(columns=col_map, inplace=True)
-        return df
+    return normalizar_dian(df)
 
-@st.cache_data(ttl=3600, show_spinner=False)
 def leer_gosocket(file_obj):
     if file_obj is None: return None
     try:
         df = pd.read_excel(file_obj, engine="calamine", dtype=str)
-        col_map = {col: normalize_col_name(col) for col in df.columns}
-        df.rename(columns=col_map, inplace=True)
-        return df
     except: 
         file_obj.seek(0)
-        return pd.read_excel(file_obj, dtype=str)
+        df = pd.read_excel(file_obj, dtype=str)
+    df.columns = [normalize_col_name(c) for c in df.columns]
+    return tipar_columnas(df, ESQUEMA_GOSOCKET, solo_esquema=False)
+
+# Los lectores no dependen de ninguna interfaz; quien los use decide cómo cachearlos.
+_LECTORES_ORIGINALES = {f.__name__: f for f in (leer_contabilidad_completa, leer_dian, leer_gosocket)}
+
+def configurar_cache(*decoradores):
+    """
+    Envuelve los lectores con los decoradores dados, el primero como el más
+    externo (igual que apilarlos con @). Sin argumentos se restauran los
+    lectores sin caché. Si perfilado ya los instrumentó, la envoltura de
+    perfilado se conserva por fuera de la caché. Ej. en Streamlit:
+        configurar_cache(st.cache_data(ttl=3600, show_spinner=False), cache_por_contenido(VERSION_LECTORES))
+    """
+    for nombre, funcion in _LECTORES_ORIGINALES.items():
+        for decorador in reversed(decoradores):
+            funcion = decorador(funcion)
+        # perfilado.perfilar deja en __perfilada__ cómo volver a envolver
+        reperfilar = getattr(globals()[nombre], '__perfilada__', None)
+        globals()[nombre] = reperfilar(funcion) if callable(reperfilar) else funcion
 
 # =================================================================
 # 3. FILTROS Y MOTORES (Lógica pura)
@@ -168,10 +536,10 @@ def crear_llave_conciliacion(df):
     prefijo = next((c for c in cols if 'prefijo' in c), None)
     folio = next((c for c in cols if 'folio' in c), None)
     if not prefijo or not folio: return df
-    df[LLAVE_DIAN_CONT_COL_NAME] = (
-        df[prefijo].astype(str).str.strip() + 
-        df[folio].astype(str).str.strip()
-    ).str.replace(r'[^\w]+', '', regex=True).str.upper()
+    df[LLAVE_DIAN_CONT_COL_NAME] = limpiar_llave(
+        _como_texto(df[prefijo]).str.strip() + 
+        _como_texto(df[folio]).str.strip()
+    )
     return df
 
 def crear_llave_serie_folio(df):
@@ -180,59 +548,180 @@ def crear_llave_serie_folio(df):
     folio_col = next((c for c in cols_normalized if 'folio' in c or 'numero' in c), None)
     if not series_col or not folio_col: return df, False
     try:
-        df[LLAVE_SERIE_FOLIO_COL_NAME] = (
-            df[series_col].astype(str).str.strip() + 
-            df[folio_col].astype(str).str.strip()
-        ).str.replace(r'[^\w]+', '', regex=True).str.upper()
+        df[LLAVE_SERIE_FOLIO_COL_NAME] = limpiar_llave(
+            _como_texto(df[series_col]).str.strip() + 
+            _como_texto(df[folio_col]).str.strip()
+        )
         return df, True
     except: return df, False
 
-def filtrar_solo_gastos(df_completo):
-    if df_completo is None or df_completo.empty: return pd.DataFrame()
-    df = df_completo.copy()
-    df = df[df['CODIGO_CUENTA'].str.startswith('5', na=False)]
-    df = df[df['CODIGO_CUENTA'] != '51157001']
-    df = df[~df['u_acctname'].str.contains('IVA', case=False, na=False)]
-    df = df[~df['u_acctname'].str.contains('DIFERENCIA EN CAMBIO', case=False, na=False)]
-    df = df[~df['u_acctname'].str.contains('DEPRECIACI', case=False, na=False)]
-    return df
+def normalizar_llave(serie):
+    return limpiar_llave(_como_texto(serie).str.strip())
 
-def filtrar_solo_ingresos(df_completo):
-    if df_completo is None or df_completo.empty: return pd.DataFrame()
-    df = df_completo.copy()
-    df = df[df['CODIGO_CUENTA'].str.startswith('4', na=False)]
-    df = df[~df['u_acctname'].str.contains('DIFERENCIA EN CAMBIO', case=False, na=False)]
-    df['u_saldo_f'] = df['u_saldo_f'] * -1 
-    return df
+# Familias de cuentas del auxiliar. Cada regla: la cuenta entra si su código empieza
+# por algún `incluir_prefijos` o su nombre contiene algún `incluir_nombre`; si hay
+# `requerir_nombre`, el nombre debe contener alguno; sale si el código está en
+# `excluir_codigos` o el nombre contiene algún `excluir_nombre` (sin distinguir mayúsculas).
+REGLAS_FAMILIAS_CUENTA = {
+    'GASTOS': {'incluir_prefijos': ('5',), 'excluir_codigos': ('51157001',), 'excluir_nombre': ('IVA', 'DIFERENCIA EN CAMBIO', 'DEPRECIACI')},
+    'INGRESOS': {'incluir_prefijos': ('4',), 'excluir_nombre': ('DIFERENCIA EN CAMBIO',)},
+    'IVA_DESCONTABLE': {'incluir_prefijos': ('24',), 'incluir_nombre': ('IVA',), 'excluir_nombre': ('GENERADO', 'VENTA')},
+    'IVA_GENERADO': {'incluir_prefijos': ('24',), 'incluir_nombre': ('IVA',), 'requerir_nombre': ('GENERADO',)},
+}
+SIN_FAMILIA = 'OTRA'
 
-def filtrar_solo_iva_descontable(df_completo):
-    if df_completo is None or df_completo.empty: return pd.DataFrame()
-    df = df_completo.copy()
-    mask_base = df['CODIGO_CUENTA'].str.startswith('24', na=False) | df['u_acctname'].str.contains('IVA', case=False, na=False)
-    df = df[mask_base]
-    mask_exclude = df['u_acctname'].str.upper().str.contains('GENERADO|VENTA|DEVOLUCION VENTA', regex=True, na=False)
-    df = df[~mask_exclude]
-    return df
+def _contiene_alguno(nombres, textos):
+    if not textos: return np.zeros(len(nombres), dtype=bool)
+    patron = '|'.join(re.escape(t.upper()) for t in textos)
+    return nombres.str.upper().str.contains(patron, regex=True, na=False).to_numpy(dtype=bool)
+
+def _cumple_regla(codigos, nombres, regla):
+    """Evalúa una regla sobre las cuentas distintas (Series cortas de código y nombre)."""
+    prefijos = tuple(regla.get('incluir_prefijos', ()))
+    dentro = codigos.str.startswith(prefijos, na=False).to_numpy(dtype=bool, copy=True) if prefijos else np.zeros(len(codigos), dtype=bool)
+    dentro |= _contiene_alguno(nombres, regla.get('incluir_nombre'))
+    if regla.get('requerir_nombre'): dentro &= _contiene_alguno(nombres, regla['requerir_nombre'])
+    if regla.get('excluir_codigos'): dentro &= ~codigos.isin(regla['excluir_codigos']).to_numpy(dtype=bool)
+    dentro &= ~_contiene_alguno(nombres, regla.get('excluir_nombre'))
+    return dentro
+
+def clasificar_cuentas(df, reglas=None):
+    """
+    Etiqueta de familia de cada fila del auxiliar como Categorical. Las reglas
+    corren una vez por par (CODIGO_CUENTA, u_acctname) distinto y el resultado se
+    difunde por códigos. Una cuenta en varias familias queda como 'A+B'; sin
+    familia, SIN_FAMILIA.
+    """
+    reglas = reglas or REGLAS_FAMILIAS_CUENTA
+    cod_c, unicos_c = pd.factorize(df['CODIGO_CUENTA'], use_na_sentinel=False)
+    cod_n, unicos_n = pd.factorize(df['u_acctname'], use_na_sentinel=False)
+    pares = cod_c.astype(np.int64) * max(len(unicos_n), 1) + cod_n
+    cod_par, unicos_par = pd.factorize(pares)
+    codigos = pd.Series(np.asarray(unicos_c, dtype=object)[unicos_par // max(len(unicos_n), 1)], dtype=object)
+    nombres = pd.Series(np.asarray(unicos_n, dtype=object)[unicos_par % max(len(unicos_n), 1)], dtype=object)
+
+    cumple = {familia: _cumple_regla(codigos, nombres, regla) for familia, regla in reglas.items()}
+    etiquetas_par = ['+'.join(f for f in reglas if cumple[f][i]) or SIN_FAMILIA for i in range(len(unicos_par))]
+    cod_etiqueta, categorias = pd.factorize(pd.Series(etiquetas_par, dtype=object))
+    return pd.Categorical.from_codes(cod_etiqueta[cod_par], categories=categorias)
+
+def mascara_familia(etiquetas, familia):
+    """Máscara booleana de una familia sobre las etiquetas de clasificar_cuentas."""
+    en_familia = [i for i, c in enumerate(etiquetas.categories) if familia in c.split('+')]
+    return np.isin(etiquetas.codes, en_familia)
 
-def filtrar_solo_iva_generado(df_completo):
+# `etiquetas`: las de clasificar_cuentas ya calculadas (p. ej. ContabilidadPreparada.etiquetas);
+# sin ellas se clasifica el auxiliar en cada llamada.
+def mascara_gastos(df, etiquetas=None): return mascara_familia(_etiquetas_de(df, etiquetas), 'GASTOS')
+def mascara_ingresos(df, etiquetas=None): return mascara_familia(_etiquetas_de(df, etiquetas), 'INGRESOS')
+def mascara_iva_descontable(df, etiquetas=None): return mascara_familia(_etiquetas_de(df, etiquetas), 'IVA_DESCONTABLE')
+def mascara_iva_generado(df, etiquetas=None): return mascara_familia(_etiquetas_de(df, etiquetas), 'IVA_GENERADO')
+
+def _etiquetas_de(df, etiquetas):
+    return clasificar_cuentas(df) if etiquetas is None else etiquetas
+
+def _filas_de_familia(df_completo, familia, etiquetas, signo=1):
+    """Filas de la familia por posición (iloc, sin .copy() adicional); con signo -1 solo se reemplaza u_saldo_f."""
     if df_completo is None or df_completo.empty: return pd.DataFrame()
-    df = df_completo.copy()
-    mask_base = df['CODIGO_CUENTA'].str.startswith('24', na=False) | df['u_acctname'].str.contains('IVA', case=False, na=False)
-    df = df[mask_base]
-    mask_gen = df['u_acctname'].str.upper().str.contains('GENERADO', regex=False, na=False)
-    df = df[mask_gen]
-    df['u_saldo_f'] = df['u_saldo_f'] * -1
-    return df
+    df = df_completo.iloc[np.flatnonzero(mascara_familia(_etiquetas_de(df_completo, etiquetas), familia))]
+    return df.assign(u_saldo_f=df['u_saldo_f'] * -1) if signo < 0 else df
+
+def filtrar_solo_gastos(df_completo, etiquetas=None): return _filas_de_familia(df_completo, 'GASTOS', etiquetas)
+def filtrar_solo_ingresos(df_completo, etiquetas=None): return _filas_de_familia(df_completo, 'INGRESOS', etiquetas, -1)
+def filtrar_solo_iva_descontable(df_completo, etiquetas=None): return _filas_de_familia(df_completo, 'IVA_DESCONTABLE', etiquetas)
+def filtrar_solo_iva_generado(df_completo, etiquetas=None): return _filas_de_familia(df_completo, 'IVA_GENERADO', etiquetas, -1)
+
+class ContabilidadPreparada:
+    """
+    Auxiliar contable con la llave de conciliación (u_ref normalizado) calculada
+    una sola vez y guardada como códigos enteros. Cada familia de cuentas es solo
+    un arreglo de posiciones más el signo del saldo: no se copia ni se modifica
+    el DataFrame original. Las familias salen de una sola clasificación de cuentas
+    (clasificar_cuentas), hecha la primera vez que se pide una.
+    """
+    def __init__(self, df_cont_full, reglas=None):
+        self.df = df_cont_full
+        self.reglas = reglas
+        self._etiquetas = None
+        self.con_referencia = df_cont_full is not None and not df_cont_full.empty and 'u_ref' in df_cont_full.columns
+        if self.con_referencia:
+            codigos, llaves = pd.factorize(normalizar_llave(df_cont_full['u_ref']))
+            self.codigos, self.llaves = codigos, pd.Index(llaves)
+        else:
+            self.codigos, self.llaves = np.array([], dtype=np.intp), pd.Index([], dtype=object)
+
+    @property
+    def etiquetas(self):
+        """Familia de cada fila (Categorical de clasificar_cuentas)."""
+        if self._etiquetas is None: self._etiquetas = clasificar_cuentas(self.df, self.reglas)
+        return self._etiquetas
+
+    def familia(self, mascara=None, signo=1):
+        n = len(self.codigos)
+        posiciones = np.arange(n) if mascara is None else np.flatnonzero(np.asarray(mascara, dtype=bool))
+        return FamiliaContable(self, posiciones, signo)
+
+    def _por_familia(self, nombre, signo=1):
+        if not self.con_referencia: return self.familia()
+        return self.familia(mascara_familia(self.etiquetas, nombre), signo)
+
+    def gastos(self): return self._por_familia('GASTOS')
+    def ingresos(self): return self._por_familia('INGRESOS', -1)
+    def iva_descontable(self): return self._por_familia('IVA_DESCONTABLE')
+    def iva_generado(self): return self._por_familia('IVA_GENERADO', -1)
+
+class FamiliaContable:
+    """Vista de una familia de cuentas sobre ContabilidadPreparada (posiciones + signo del saldo)."""
+    def __init__(self, preparada, posiciones, signo=1):
+        self.preparada = preparada
+        self.posiciones = posiciones
+        self.signo = signo
+
+    @property
+    def con_referencia(self): return self.preparada.con_referencia
+
+    def codigos(self): return self.preparada.codigos[self.posiciones]
+
+    def _columna(self, col):
+        return self.preparada.df[col].to_numpy()[self.posiciones]
+
+    def agregada(self, nombre_llave='LLAVE_CONT', columnas_first=('u_infoco01', 'u_cardname', 'u_acctname')):
+        """Saldo sumado y primer valor de las columnas descriptivas por llave, agrupando sobre los códigos."""
+        datos = {'codigo': self.codigos(), 'u_saldo_f': self._columna('u_saldo_f') * self.signo}
+        agg_dict = {'u_saldo_f': 'sum'}
+        for col in columnas_first:
+            if col in self.preparada.df.columns:
+                datos[col] = self._columna(col)
+                agg_dict[col] = 'first'
+        df_agg = pd.DataFrame(datos).groupby('codigo').agg(agg_dict)
+        df_agg.insert(0, nombre_llave, self.preparada.llaves[df_agg.index.to_numpy()].to_numpy())
+        # Mismo orden que un groupby directo sobre la llave de texto
+        return df_agg.sort_values(nombre_llave).reset_index(drop=True)
+
+    def detalle(self, llaves=None, nombre_llave='LLAVE_CONT'):
+        """Filas de detalle de la familia (solo las de `llaves` si se indica), con el saldo firmado y la llave."""
+        posiciones = self.posiciones
+        if llaves is not None:
+            codigos_sel = self.preparada.llaves.get_indexer(pd.Index(llaves))
+            posiciones = posiciones[np.isin(self.codigos(), codigos_sel[codigos_sel >= 0])]
+        t = self.preparada.df.iloc[posiciones].reset_index(drop=True)
+        if self.signo != 1: t['u_saldo_f'] = t['u_saldo_f'] * self.signo
+        t[nombre_llave] = self.preparada.llaves[self.preparada.codigos[posiciones]].to_numpy()
+        return t
+
+def como_familia_contable(df_cont):
+    if isinstance(df_cont, FamiliaContable): return df_cont
+    return ContabilidadPreparada(df_cont).familia()
 
 def filtrar_dian_gastos(df):
     if df is None or df.empty: return df
     col_grupo = next((c for c in df.columns if 'grupo' in normalize_col_name(c)), None)
     col_tipo = next((c for c in df.columns if 'tipo' in normalize_col_name(c) and 'documento' in normalize_col_name(c)), None)
     if not col_grupo: return df
-    mask_recibidos = df[col_grupo].astype(str).str.strip().str.lower() == 'recibido'
+    mask_recibidos = texto_minusculas(df[col_grupo]) == 'recibido'
     mask_doc_soporte = pd.Series([False] * len(df))
     if col_tipo:
-        s_tipo = df[col_tipo].astype(str).str.strip().str.lower()
+        s_tipo = texto_minusculas(df[col_tipo])
         mask_doc_soporte = s_tipo.str.contains('documento soporte', na=False) | s_tipo.str.contains('no obligado', na=False)
     return df[mask_recibidos | mask_doc_soporte].copy()
 
@@ -241,68 +730,380 @@ def filtrar_dian_ingresos(df):
     col_grupo = next((c for c in df.columns if 'grupo' in normalize_col_name(c)), None)
     col_tipo = next((c for c in df.columns if 'tipo' in normalize_col_name(c) and 'documento' in normalize_col_name(c)), None)
     if not col_grupo: return df
-    mask_emitidos = df[col_grupo].astype(str).str.strip().str.lower() == 'emitido'
+    mask_emitidos = texto_minusculas(df[col_grupo]) == 'emitido'
     mask_doc_soporte = pd.Series([False] * len(df))
     if col_tipo:
-        s_tipo = df[col_tipo].astype(str).str.strip().str.lower()
+        s_tipo = texto_minusculas(df[col_tipo])
         mask_doc_soporte = s_tipo.str.contains('documento soporte', na=False) | s_tipo.str.contains('no obligado', na=False)
     return df[mask_emitidos & (~mask_doc_soporte)].copy()
 
+def _unir_por_posicion(df_izq, df_der, pos_izq, pos_der, suffixes):
+    """Equivale al resultado de un merge inner ya resuelto: filas pareadas por posición, sufijos en columnas repetidas."""
+    izq = df_izq.iloc[pos_izq].reset_index(drop=True)
+    der = df_der.iloc[pos_der].reset_index(drop=True)
+    comunes = izq.columns.intersection(der.columns)
+    if len(comunes):
+        izq = izq.rename(columns={c: f'{c}{suffixes[0]}' for c in comunes})
+        der = der.rename(columns={c: f'{c}{suffixes[1]}' for c in comunes})
+    return pd.concat([izq, der], axis=1)
+
 def ejecutar_conciliacion_universal(df_dian, df_cont):
-    if 'u_ref' not in df_cont.columns: return pd.DataFrame(), pd.DataFrame(), pd.DataFrame()
-    df_cont['LLAVE_CONT'] = df_cont['u_ref'].astype(str).str.strip().str.replace(r'[^\w]+', '', regex=True).str.upper()
-    
-    agg_dict = {'u_saldo_f': 'sum'}
-    if 'u_infoco01' in df_cont.columns: agg_dict['u_infoco01'] = 'first'
-    if 'u_cardname' in df_cont.columns: agg_dict['u_cardname'] = 'first'
-    if 'u_acctname' in df_cont.columns: agg_dict['u_acctname'] = 'first' 
+    """
+    `df_cont` puede ser un DataFrame o una FamiliaContable; en ningún caso se modifica.
+    Las llaves agregadas de contabilidad son únicas, así que basta un índice hash:
+    una sola búsqueda por fila DIAN da coincidencias, sobrantes DIAN y sobrantes contables.
+    """
+    familia = como_familia_contable(df_cont)
+    if not familia.con_referencia: return pd.DataFrame(), pd.DataFrame(), pd.DataFrame()
+    df_cont_agg = familia.agregada()
     
-    df_cont_agg = df_cont.groupby('LLAVE_CONT').agg(agg_dict).reset_index()
+    if LLAVE_DIAN_CONT_COL_NAME not in df_dian.columns: return pd.DataFrame(), df_dian, familia.detalle()
     
-    if LLAVE_DIAN_CONT_COL_NAME not in df_dian.columns: return pd.DataFrame(), df_dian, df_cont
+    pos = pd.Index(df_cont_agg['LLAVE_CONT']).get_indexer(df_dian[LLAVE_DIAN_CONT_COL_NAME])
+    filas_con = np.flatnonzero(pos >= 0)
+    filas_sin = np.flatnonzero(pos < 0)
     
-    df_coinc = pd.merge(df_dian, df_cont_agg, left_on=LLAVE_DIAN_CONT_COL_NAME, right_on='LLAVE_CONT', how='inner', suffixes=('_DIAN', '_CONT'))
+    df_coinc = _unir_por_posicion(df_dian, df_cont_agg, filas_con, pos[filas_con], ('_DIAN', '_CONT'))
     
-    df_left = pd.merge(df_dian, df_cont_agg[['LLAVE_CONT']], left_on=LLAVE_DIAN_CONT_COL_NAME, right_on='LLAVE_CONT', how='left', indicator=True)
-    df_sob_dian = df_left[df_left['_merge'] == 'left_only'].drop(columns=['LLAVE_CONT', '_merge'])
+    # Mismo índice que tenía el merge left (posición de la fila DIAN)
+    df_sob_dian = df_dian.iloc[filas_sin]
+    df_sob_dian.index = filas_sin
     
-    df_right = pd.merge(df_cont_agg, df_dian[[LLAVE_DIAN_CONT_COL_NAME]], left_on='LLAVE_CONT', right_on=LLAVE_DIAN_CONT_COL_NAME, how='left', indicator=True)
-    df_sob_cont = pd.merge(df_cont, df_right[df_right['_merge'] == 'left_only'][['LLAVE_CONT']], on='LLAVE_CONT', how='inner')
+    usadas = np.zeros(len(df_cont_agg), dtype=bool)
+    usadas[pos[filas_con]] = True
+    df_sob_cont = familia.detalle(df_cont_agg['LLAVE_CONT'].to_numpy()[~usadas])
     
     return df_coinc, df_sob_dian, df_sob_cont
 
-def conciliar_ingresos_vs_gosocket(df_ingresos, df_gosocket):
-    if df_ingresos is None or df_ingresos.empty:
-        return pd.DataFrame(), df_ingresos if df_ingresos is not None else pd.DataFrame(), pd.DataFrame()
-        
-    df_ingresos['LLAVE_CONC'] = df_ingresos['u_ref'].astype(str).str.strip().str.replace(r'[^\w]+', '', regex=True).str.upper()
-    
+def con_llave_gosocket(df_gosocket):
+    """Gosocket con LLAVE_SERIE_FOLIO (serie + folio o, si no, la referencia); None si no hay con qué armarla."""
     if LLAVE_SERIE_FOLIO_COL_NAME not in df_gosocket.columns:
         df_gosocket, _ = crear_llave_serie_folio(df_gosocket)
     
     if LLAVE_SERIE_FOLIO_COL_NAME not in df_gosocket.columns:
         col_ref = next((c for c in df_gosocket.columns if 'referencia' in c), None)
-        if col_ref:
-            df_gosocket[LLAVE_SERIE_FOLIO_COL_NAME] = df_gosocket[col_ref].astype(str).str.strip().str.replace(r'[^\w]+', '', regex=True).str.upper()
-        else:
-            return pd.DataFrame(), df_ingresos, df_gosocket
+        if not col_ref: return None
+        df_gosocket[LLAVE_SERIE_FOLIO_COL_NAME] = normalizar_llave(df_gosocket[col_ref])
+    return df_gosocket
 
-    agg_dict = {'u_saldo_f': 'sum'}
-    if 'u_infoco01' in df_ingresos.columns: agg_dict['u_infoco01'] = 'first'
-    if 'u_cardname' in df_ingresos.columns: agg_dict['u_cardname'] = 'first'
-    df_ing_agg = df_ingresos.groupby('LLAVE_CONC').agg(agg_dict).reset_index()
+def conciliar_ingresos_vs_gosocket(df_ingresos, df_gosocket):
+    """`df_ingresos` puede ser un DataFrame o una FamiliaContable; no se modifica."""
+    familia = como_familia_contable(df_ingresos)
+    if not familia.con_referencia:
+        return pd.DataFrame(), df_ingresos if isinstance(df_ingresos, pd.DataFrame) else pd.DataFrame(), pd.DataFrame()
+    
+    con_llave = con_llave_gosocket(df_gosocket)
+    if con_llave is None: return pd.DataFrame(), familia.detalle(nombre_llave='LLAVE_CONC'), df_gosocket
+    df_gosocket = con_llave
+
+    df_ing_agg = familia.agregada('LLAVE_CONC', columnas_first=('u_infoco01', 'u_cardname'))
 
     df_coinc = pd.merge(df_ing_agg, df_gosocket, left_on='LLAVE_CONC', right_on=LLAVE_SERIE_FOLIO_COL_NAME, how='inner', suffixes=('_CONT', '_GO'))
     
     df_left = pd.merge(df_ing_agg, df_gosocket[[LLAVE_SERIE_FOLIO_COL_NAME]], left_on='LLAVE_CONC', right_on=LLAVE_SERIE_FOLIO_COL_NAME, how='left', indicator=True)
-    df_sob_cont_agg = df_left[df_left['_merge'] == 'left_only']
-    df_sob_cont = pd.merge(df_ingresos, df_sob_cont_agg[['LLAVE_CONC']], on='LLAVE_CONC', how='inner')
+    df_sob_cont = familia.detalle(df_left.loc[df_left['_merge'] == 'left_only', 'LLAVE_CONC'].unique(), nombre_llave='LLAVE_CONC')
 
     df_right = pd.merge(df_gosocket, df_ing_agg[['LLAVE_CONC']], left_on=LLAVE_SERIE_FOLIO_COL_NAME, right_on='LLAVE_CONC', how='left', indicator=True)
     df_sob_go = df_right[df_right['_merge'] == 'left_only'].drop(columns=['LLAVE_CONC', '_merge'])
 
     return df_coinc, df_sob_cont, df_sob_go
 
+def columna_nit_dian(df):
+    return next((c for c in df.columns if ('emisor' in c or 'receptor' in c) and ('nit' in c or 'doc' in c)), None)
+
+def subtotal_dian(df, total_col, iva_col=None, is_iva_report=False):
+    """Valor DIAN comparable con contabilidad: total (o IVA) menos el IVA cuando no es reporte de IVA."""
+    val_d = pd.to_numeric(df[total_col], errors='coerce').fillna(0) if total_col in df.columns else pd.Series(0.0, index=df.index)
+    if not is_iva_report:
+        if iva_col and iva_col in df.columns: 
+            val_d -= pd.to_numeric(df[iva_col], errors='coerce').fillna(0)
+    return val_d
+
+PARES_POR_LOTE_OSA = 50_000
+
+def _codigos_caracteres(textos):
+    """Arreglo de textos -> (código de cada carácter por posición, pares en columnas; relleno 0)."""
+    ancho = max(textos.dtype.itemsize // 4, 1)
+    return np.ascontiguousarray(textos.astype(f'U{ancho}')).view(np.uint32).reshape(len(textos), ancho).T
+
+def _distancias_osa(a, b):
+    """
+    Levenshtein con transposición de caracteres adyacentes (Damerau restringida)
+    de cada par (a[k], b[k]). La tabla se llena fila por fila para todos los
+    pares a la vez (numpy), por lotes de PARES_POR_LOTE_OSA pares.
+    """
+    a, b = np.asarray(a, dtype=str), np.asarray(b, dtype=str)
+    distancias = np.empty(len(a), dtype=np.int64)
+    for inicio in range(0, len(a), PARES_POR_LOTE_OSA):
+        lote = slice(inicio, inicio + PARES_POR_LOTE_OSA)
+        distancias[lote] = _distancias_osa_lote(a[lote], b[lote])
+    return distancias
+
+def _distancias_osa_lote(a, b):
+    n = len(a)
+    la, lb = np.char.str_len(a), np.char.str_len(b)
+    ca, cb = _codigos_caracteres(a), _codigos_caracteres(b)
+    # Las celdas de la tabla fuera de (la, lb) de cada par usan el relleno, pero no afectan su resultado
+    ancho_b, pares = cb.shape[0], np.arange(n)
+    distancias = lb.astype(np.int64)
+    anterior2, anterior = None, np.repeat(np.arange(ancho_b + 1)[:, None], n, axis=1)
+    for i in range(1, (la.max() if n else 0) + 1):
+        actual = np.empty_like(anterior)
+        actual[0] = i
+        for j in range(1, ancho_b + 1):
+            costo = ca[i - 1] != cb[j - 1]
+            valor = np.minimum(np.minimum(anterior[j], actual[j - 1]) + 1, anterior[j - 1] + costo)
+            if i > 1 and j > 1:
+                transpuesto = (ca[i - 1] == cb[j - 2]) & (ca[i - 2] == cb[j - 1])
+                valor = np.where(transpuesto, np.minimum(valor, anterior2[j - 2] + 1), valor)
+            actual[j] = valor
+        terminan = la == i
+        distancias[terminan] = actual[lb[terminan], pares[terminan]]
+        anterior2, anterior = anterior, actual
+    return distancias
+
+def _cubeta_monto(montos, tolerancia):
+    # Escala logarítmica: dos montos dentro de la tolerancia relativa caen en cubetas contiguas
+    return np.floor(np.log1p(np.abs(montos)) / np.log1p(tolerancia)).astype(np.int64)
+
+def emparejar_sobrantes_probables(sob_d, sob_c, total_col, iva_col=None, is_iva_report=False, tolerancia=0.01, umbral=0.8):
+    """
+    Segundo paso opcional sobre los sobrantes del cruce exacto: empareja documentos
+    con llaves casi iguales (ceros a la izquierda, prefijo faltante, dígitos
+    transpuestos). Los candidatos se bloquean por NIT y cubeta de monto con un
+    join, así que nunca se comparan todos contra todos; cada par se califica por
+    sufijo numérico igual o por distancia de edición y se asigna 1 a 1 por
+    confianza. Devuelve (probables, sobrantes DIAN restantes, sobrantes contables restantes).
+    """
+    vacio = pd.DataFrame()
+    if sob_d is None or sob_c is None or sob_d.empty or sob_c.empty: return vacio, sob_d, sob_c
+    if LLAVE_DIAN_CONT_COL_NAME not in sob_d.columns or 'LLAVE_CONT' not in sob_c.columns: return vacio, sob_d, sob_c
+
+    col_nit = columna_nit_dian(sob_d)
+    lado_d = pd.DataFrame({
+        '_d': np.arange(len(sob_d)),
+        'llave_d': sob_d[LLAVE_DIAN_CONT_COL_NAME].astype(str).to_numpy(),
+        'nit': clean_nit_numeric(sob_d[col_nit]).to_numpy() if col_nit else '',
+        'monto_d': subtotal_dian(sob_d, total_col, iva_col, is_iva_report).to_numpy(dtype=float),
+    })
+
+    agg_dict = {'u_saldo_f': 'sum'}
+    for col in ('u_infoco01', 'u_cardname', 'u_acctname'):
+        if col in sob_c.columns: agg_dict[col] = 'first'
+    df_c_agg = sob_c.groupby('LLAVE_CONT', sort=False).agg(agg_dict).reset_index()
+    lado_c = pd.DataFrame({
+        '_c': np.arange(len(df_c_agg)),
+        'llave_c': df_c_agg['LLAVE_CONT'].astype(str).to_numpy(),
+        'nit': clean_nit_numeric(df_c_agg['u_infoco01']).to_numpy() if 'u_infoco01' in df_c_agg.columns else '',
+        'monto_c': df_c_agg['u_saldo_f'].to_numpy(dtype=float),
+    })
+    if not col_nit or 'u_infoco01' not in df_c_agg.columns:
+        lado_d['nit'] = ''; lado_c['nit'] = ''
+
+    # Bloqueo: mismo NIT y cubeta de monto vecina (-1, 0, +1)
+    lado_c['cubeta'] = _cubeta_monto(lado_c['monto_c'].to_numpy(), tolerancia)
+    cubeta_d = _cubeta_monto(lado_d['monto_d'].to_numpy(), tolerancia)
+    lado_d = pd.concat([lado_d.assign(cubeta=cubeta_d + k) for k in (-1, 0, 1)], ignore_index=True)
+    pares = lado_d.merge(lado_c, on=['nit', 'cubeta'], how='inner')
+    if pares.empty: return vacio, sob_d, sob_c
+
+    dif_rel = (pares['monto_d'] - pares['monto_c']).abs() / np.maximum(np.maximum(pares['monto_d'].abs(), pares['monto_c'].abs()), 1.0)
+    pares = pares[dif_rel <= tolerancia].assign(_dif_rel=dif_rel)
+    if pares.empty: return vacio, sob_d, sob_c
+
+    # Regla 1: mismo número final (ignora prefijo y ceros a la izquierda)
+    num_d = pares['llave_d'].str.extract(r'(\d+)$', expand=False).str.lstrip('0')
+    num_c = pares['llave_c'].str.extract(r'(\d+)$', expand=False).str.lstrip('0')
+    por_sufijo = (num_d == num_c) & num_d.notna() & (num_d.str.len() > 0)
+
+    # Regla 2: distancia de edición, solo si la diferencia de largos permite superar el umbral
+    largo_max = np.maximum(pares['llave_d'].str.len(), pares['llave_c'].str.len()).clip(lower=1)
+    max_dist = np.floor((1 - umbral) * largo_max)
+    candidatas = ~por_sufijo & ((pares['llave_d'].str.len() - pares['llave_c'].str.len()).abs() <= max_dist)
+    similitud = pd.Series(0.0, index=pares.index)
+    similitud[por_sufijo] = 0.95
+    if candidatas.any():
+        distancias = _distancias_osa(pares.loc[candidatas, 'llave_d'].to_numpy(dtype=str), pares.loc[candidatas, 'llave_c'].to_numpy(dtype=str))
+        similitud[candidatas] = 1 - distancias / largo_max[candidatas].to_numpy(dtype=float)
+    pares = pares.assign(
+        _sim=similitud,
+        REGLA_PROBABLE=np.where(por_sufijo, 'SUFIJO_NUMERICO', 'DISTANCIA_EDICION'),
+    )
+    pares = pares[pares['_sim'] >= umbral]
+    if pares.empty: return vacio, sob_d, sob_c
+    pares['CONFIANZA'] = (0.8 * pares['_sim'] + 0.2 * (1 - pares['_dif_rel'] / tolerancia)).round(3)
+
+    # Asignación 1 a 1 por mayor confianza
+    pares = pares.sort_values(['CONFIANZA', '_d', '_c'], ascending=[False, True, True], kind='stable')
+    usados_d, usados_c, elegidos = set(), set(), []
+    for fila, d, c in zip(range(len(pares)), pares['_d'].to_numpy(), pares['_c'].to_numpy()):
+        if d in usados_d or c in usados_c: continue
+        usados_d.add(d); usados_c.add(c); elegidos.append(fila)
+    pares = pares.iloc[elegidos].sort_values('_d')
+
+    df_prob = _unir_por_posicion(sob_d, df_c_agg, pares['_d'].to_numpy(), pares['_c'].to_numpy(), ('_DIAN', '_CONT'))
+    df_prob['CONFIANZA'] = pares['CONFIANZA'].to_numpy()
+    df_prob['REGLA_PROBABLE'] = pares['REGLA_PROBABLE'].to_numpy()
+
+    resto_d = np.ones(len(sob_d), dtype=bool); resto_d[pares['_d'].to_numpy()] = False
+    llaves_c = df_c_agg['LLAVE_CONT'].to_numpy()[pares['_c'].to_numpy()]
+    return df_prob, sob_d[resto_d], sob_c[~sob_c['LLAVE_CONT'].isin(llaves_c)]
+
+def columna_fecha_dian(df):
+    return next((c for c in df.columns if 'fecha' in c and 'emisi' in c), None) or next((c for c in df.columns if 'fecha' in c), None)
+
+def periodo_de_fechas(serie, dayfirst=True):
+    """'AAAA-MM' de cada fecha; SIN_PERIODO donde no hay fecha válida (o no hay columna)."""
+    if serie is None: return SIN_PERIODO
+    fechas = convertir_fechas(serie, dayfirst=dayfirst)
+    return fechas.dt.strftime('%Y-%m').fillna(SIN_PERIODO)
+
+def _dias_desde_epoca(serie, dayfirst=True):
+    fechas = convertir_fechas(serie, dayfirst=dayfirst)
+    return ((fechas - pd.Timestamp('1970-01-01')).dt.days).to_numpy(dtype=float)
+
+def _subconjunto_con_suma(montos, objetivo, tolerancia, max_lineas, presupuesto):
+    """
+    Posiciones de 2..max_lineas montos (mismo signo que el objetivo) cuya suma
+    queda dentro de la tolerancia, o None. Búsqueda en profundidad de mayor a
+    menor con poda; se corta al revisar `presupuesto` nodos.
+    """
+    orden = sorted(range(len(montos)), key=lambda i: -abs(montos[i]))
+    valores = [abs(montos[i]) for i in orden]
+    nodos = 0
+
+    def buscar(inicio, restante, elegidos):
+        nonlocal nodos
+        if len(elegidos) >= 2 and abs(restante) <= tolerancia: return list(elegidos)
+        if len(elegidos) == max_lineas: return None
+        faltan = max_lineas - len(elegidos)
+        for i in range(inicio, len(valores)):
+            nodos += 1
+            if nodos > presupuesto: return None
+            if valores[i] > restante + tolerancia: continue
+            # Ordenados de mayor a menor: si ni los siguientes más grandes alcanzan, no alcanza nada después
+            if sum(valores[i:i + faltan]) < restante - tolerancia: break
+            elegidos.append(i)
+            encontrado = buscar(i + 1, restante - valores[i], elegidos)
+            if encontrado: return encontrado
+            elegidos.pop()
+        return None
+
+    encontrado = buscar(0, abs(objetivo), [])
+    return [orden[i] for i in encontrado] if encontrado else None
+
+def emparejar_por_monto_nit(sob_d, sob_c, total_col, iva_col=None, is_iva_report=False,
+                            tolerancia=1.0, ventana_dias=45, max_lineas=4, presupuesto=5_000):
+    """
+    Motor complementario para sobrantes sin referencia utilizable: empareja cada
+    documento DIAN con una línea contable del mismo NIT cuyo saldo coincide dentro
+    de `tolerancia` (pesos) y cuya fecha cae en ±`ventana_dias`. Los documentos
+    que quedan se intentan como suma de 2..`max_lineas` líneas del mismo NIT, con
+    una búsqueda acotada por `presupuesto` nodos por documento.
+    Las líneas contables se ordenan por (NIT, monto) y cada documento solo mira
+    el rango de su NIT ubicado con búsqueda binaria.
+    Devuelve (coincidencias por monto, sobrantes DIAN restantes, sobrantes contables restantes).
+    """
+    vacio = pd.DataFrame()
+    if sob_d is None or sob_c is None or sob_d.empty or sob_c.empty: return vacio, sob_d, sob_c
+    col_nit = columna_nit_dian(sob_d)
+    if not col_nit or 'u_infoco01' not in sob_c.columns or 'u_saldo_f' not in sob_c.columns: return vacio, sob_d, sob_c
+
+    nit_d = clean_nit_numeric(sob_d[col_nit]).to_numpy(dtype=object)
+    nit_c = clean_nit_numeric(sob_c['u_infoco01']).to_numpy(dtype=object)
+    monto_d = subtotal_dian(sob_d, total_col, iva_col, is_iva_report).to_numpy(dtype=float)
+    monto_c = pd.to_numeric(sob_c['u_saldo_f'], errors='coerce').fillna(0).to_numpy(dtype=float)
+
+    col_fecha = columna_fecha_dian(sob_d)
+    usar_fechas = col_fecha is not None and 'Fecha' in sob_c.columns
+    dia_d = _dias_desde_epoca(sob_d[col_fecha]) if usar_fechas else None
+    dia_c = _dias_desde_epoca(sob_c['Fecha']) if usar_fechas else None
+
+    def dias_entre(d, c):
+        if not usar_fechas or np.isnan(dia_d[d]) or np.isnan(dia_c[c]): return 0.0
+        return abs(dia_d[d] - dia_c[c])
+
+    # Índices ordenados por (NIT, monto) en ambos lados
+    codigos, _ = pd.factorize(np.concatenate([nit_d, nit_c]))
+    cod_d, cod_c = codigos[:len(nit_d)], codigos[len(nit_d):]
+    validos_d = np.flatnonzero((nit_d != '') & (monto_d != 0))
+    validos_c = np.flatnonzero((nit_c != '') & (monto_c != 0))
+    orden_d = validos_d[np.lexsort((monto_d[validos_d], cod_d[validos_d]))]
+    orden_c = validos_c[np.lexsort((monto_c[validos_c], cod_c[validos_c]))]
+    cod_d_ord, cod_c_ord = cod_d[orden_d], cod_c[orden_c]
+
+    usado_c = np.zeros(len(sob_c), dtype=bool)
+    emparejados = []  # (posición DIAN, [posiciones contables], regla, diferencia, días)
+
+    for cod in np.unique(cod_d_ord):
+        ini_c, fin_c = np.searchsorted(cod_c_ord, cod, 'left'), np.searchsorted(cod_c_ord, cod, 'right')
+        if ini_c == fin_c: continue
+        ini_d, fin_d = np.searchsorted(cod_d_ord, cod, 'left'), np.searchsorted(cod_d_ord, cod, 'right')
+        grupo_c = orden_c[ini_c:fin_c]
+        montos_grupo = monto_c[grupo_c]
+        pendientes = []
+
+        # 1. Una línea con el mismo monto (la más cercana, sin repetir líneas)
+        for d in orden_d[ini_d:fin_d]:
+            objetivo = monto_d[d]
+            lo = np.searchsorted(montos_grupo, objetivo - tolerancia, 'left')
+            hi = min(np.searchsorted(montos_grupo, objetivo + tolerancia, 'right'), lo + presupuesto)
+            mejor = None
+            for k in range(lo, hi):
+                c = grupo_c[k]
+                if usado_c[c]: continue
+                dias = dias_entre(d, c)
+                if dias > ventana_dias: continue
+                dif = abs(montos_grupo[k] - objetivo)
+                if mejor is None or dif < mejor[0]: mejor = (dif, c, dias)
+            if mejor:
+                usado_c[mejor[1]] = True
+                emparejados.append((d, [mejor[1]], 'MONTO_NIT', mejor[0], mejor[2]))
+            else:
+                pendientes.append(d)
+
+        # 2. Varias líneas que suman el documento
+        if max_lineas < 2: continue
+        for d in pendientes:
+            objetivo = monto_d[d]
+            # Solo líneas del mismo signo y sin exceder el documento: un rango contiguo del grupo ordenado
+            if objetivo > 0:
+                lo, hi = np.searchsorted(montos_grupo, 0, 'right'), np.searchsorted(montos_grupo, objetivo + tolerancia, 'right')
+            else:
+                lo, hi = np.searchsorted(montos_grupo, objetivo - tolerancia, 'left'), np.searchsorted(montos_grupo, 0, 'left')
+            candidatos = list(itertools.islice(
+                (c for c in grupo_c[lo:hi] if not usado_c[c] and dias_entre(d, c) <= ventana_dias), presupuesto))
+            if len(candidatos) < 2: continue
+            elegidos = _subconjunto_con_suma([monto_c[c] for c in candidatos], objetivo, tolerancia, max_lineas, presupuesto)
+            if not elegidos: continue
+            lineas = [candidatos[i] for i in elegidos]
+            usado_c[lineas] = True
+            emparejados.append((d, lineas, 'SUMA_LINEAS', abs(monto_c[lineas].sum() - objetivo), max(dias_entre(d, c) for c in lineas)))
+
+    if not emparejados: return vacio, sob_d, sob_c
+
+    emparejados.sort(key=lambda x: x[0])
+    col_c = lambda col: sob_c[col].to_numpy() if col in sob_c.columns else np.full(len(sob_c), '', dtype=object)
+    llave_c, nit_orig_c, nombre_c, cuenta_c = col_c('LLAVE_CONT'), col_c('u_infoco01'), col_c('u_cardname'), col_c('u_acctname')
+    resumen = pd.DataFrame({
+        'LLAVE_CONT': [' + '.join(dict.fromkeys(str(llave_c[c]) for c in lineas)) for _, lineas, *_ in emparejados],
+        'u_saldo_f': [monto_c[lineas].sum() for _, lineas, *_ in emparejados],
+        'u_infoco01': [nit_orig_c[lineas[0]] for _, lineas, *_ in emparejados],
+        'u_cardname': [nombre_c[lineas[0]] for _, lineas, *_ in emparejados],
+        'u_acctname': [cuenta_c[lineas[0]] for _, lineas, *_ in emparejados],
+        'LINEAS_CONT': [len(lineas) for _, lineas, *_ in emparejados],
+    })
+    pos_d = np.array([e[0] for e in emparejados])
+    df_monto = _unir_por_posicion(sob_d, resumen, pos_d, np.arange(len(resumen)), ('_DIAN', '_CONT'))
+    base = np.array([0.8 if e[2] == 'MONTO_NIT' else 0.7 for e in emparejados])
+    dif = np.array([e[3] for e in emparejados]) / max(tolerancia, 1e-9)
+    dias = np.array([e[4] for e in emparejados]) / max(ventana_dias, 1)
+    df_monto['CONFIANZA'] = (base - 0.1 * dif - 0.1 * dias).round(3)
+    df_monto['REGLA_PROBABLE'] = [e[2] for e in emparejados]
+
+    resto_d = np.ones(len(sob_d), dtype=bool); resto_d[pos_d] = False
+    return df_monto, sob_d[resto_d], sob_c[~usado_c]
+
 # =================================================================
 # 4. REPORT GENERATION
 # =================================================================
@@ -324,43 +1125,153 @@ def formatear_hoja_base(writer, sheet_name, df):
         worksheet.write(0, col_num, value, fmt_header)
     worksheet.set_column(0, len(df.columns) - 1, 15)
 
-def procesar_reporte_cabify_generico(coin, sob_d, sob_c, writer, sheet_name, emisor_col, total_col, iva_col, is_iva_report=False):
+# Opciones del libro para ExcelWriter: las hojas se escriben fila por fila, así
+# que constant_memory mantiene plana la memoria aunque el reporte sea enorme.
+OPCIONES_LIBRO_REPORTE = {'constant_memory': True, 'nan_inf_to_errors': True, 'default_date_format': 'yyyy-mm-dd'}
+FILAS_POR_LOTE = 50_000
+
+def _lotes_para_excel(df):
+    """Filas como listas de Python (NaN/NaT -> None) por lotes, sin convertir toda la tabla de una vez."""
+    for inicio in range(0, len(df), FILAS_POR_LOTE):
+        lote = df.iloc[inicio:inicio + FILAS_POR_LOTE].astype(object)
+        yield inicio, lote.where(lote.notna(), None).to_numpy().tolist()
+
+def _escribir_encabezado(ws, columnas, fmt_header=None):
+    for col_num, value in enumerate(columnas):
+        ws.write(0, col_num, value, fmt_header)
+
+MAX_FILAS_EXCEL = 1_048_576
+
+def escribir_hoja_base_por_bloques(writer, sheet_name, bloques):
+    """
+    Como escribir_hoja_base pero recibiendo la tabla en bloques (DataFrames con las
+    mismas columnas). Si se supera el límite de filas de Excel continúa en
+    '<hoja> (2)', '<hoja> (3)', ...
+    """
+    workbook = writer.book
+    fmt_header = formato_cabezote_cabify(workbook)
+    worksheet, columnas, fila, hojas = None, None, 0, 0
+    for bloque in bloques:
+        if columnas is None: columnas = list(bloque.columns)
+        for _, filas in _lotes_para_excel(bloque[columnas]):
+            for valores in filas:
+                if worksheet is None or fila >= MAX_FILAS_EXCEL:
+                    hojas += 1
+                    worksheet = workbook.add_worksheet(sheet_name if hojas == 1 else f'{sheet_name} ({hojas})')
+                    worksheet.set_tab_color('green')
+                    worksheet.set_column(0, len(columnas) - 1, 15)
+                    _escribir_encabezado(worksheet, columnas, fmt_header)
+                    fila = 1
+                worksheet.write_row(fila, 0, valores)
+                fila += 1
+    if worksheet is None:
+        worksheet = workbook.add_worksheet(sheet_name)
+        if columnas: _escribir_encabezado(worksheet, columnas)
+
+def escribir_hoja_base(writer, sheet_name, df):
+    """Equivale a df.to_excel(...) + formatear_hoja_base, pero escribe en orden de filas (apto para constant_memory)."""
+    workbook = writer.book
+    worksheet = workbook.add_worksheet(sheet_name)
+    if df.empty:
+        _escribir_encabezado(worksheet, df.columns.values)
+        return
+    worksheet.set_tab_color('green')
+    worksheet.set_column(0, len(df.columns) - 1, 15)
+    _escribir_encabezado(worksheet, df.columns.values, formato_cabezote_cabify(workbook))
+    for inicio, filas in _lotes_para_excel(df):
+        for r, fila in enumerate(filas, start=inicio + 1):
+            worksheet.write_row(r, 0, fila)
+
+def _intercalar_subtotales(df_full, cols_sum):
+    """
+    Detalle ordenado por EMPRESA_GRUPO con una fila 'SUBTOTAL <TIPO>' tras cada
+    tipo (en orden de aparición dentro de la empresa) y 'TOTAL <EMPRESA>' al
+    cierre de cada empresa. Las sumas salen de un groupby y las filas se
+    intercalan con una llave de orden; las columnas numéricas no pasan a object.
+    """
+    n = len(df_full)
+    pos = np.arange(n)
+    cod_emp = pd.factorize(df_full['EMPRESA_GRUPO'])[0]
+    llaves = pd.DataFrame({'_EMP': cod_emp, 'TIPO': df_full['TIPO'].to_numpy(), '_POS': pos})
+    # Un tipo se ubica dentro de su empresa según su primera fila
+    orden_tipo = llaves.groupby(['_EMP', 'TIPO'], sort=False)['_POS'].transform('min').to_numpy()
+
+    primera_emp = llaves.groupby('_EMP', sort=False)['_POS'].min()
+    nit_grupo = df_full['NIT'].to_numpy()[primera_emp.to_numpy()]
+    nombre_emp = df_full['EMPRESA_GRUPO'].to_numpy()[primera_emp.to_numpy()]
+
+    sumas = pd.concat([llaves, df_full[cols_sum].reset_index(drop=True)], axis=1)
+
+    sub_tipo = sumas.groupby(['_EMP', 'TIPO'], sort=False).agg(
+        {**{c: 'sum' for c in cols_sum}, '_POS': 'min'}).reset_index()
+    emp_tipo = sub_tipo['_EMP'].to_numpy()
+    sub_tipo = sub_tipo.assign(
+        NIT=nit_grupo[emp_tipo], EMPRESA=nombre_emp[emp_tipo],
+        TIPO='SUBTOTAL ' + sub_tipo['TIPO'].astype(str), GRUPO_TIPO='SUBTOTAL_TIPO',
+        _ORDEN_TIPO=sub_tipo['_POS'], _NIVEL=1,
+    )
+
+    sub_emp = sumas.groupby('_EMP', sort=False)[cols_sum].sum().reset_index()
+    emp_emp = sub_emp['_EMP'].to_numpy()
+    sub_emp = sub_emp.assign(
+        NIT=nit_grupo[emp_emp], EMPRESA=[f'TOTAL {e}' for e in nombre_emp[emp_emp]],
+        GRUPO_TIPO='SUBTOTAL_EMPRESA', _ORDEN_TIPO=n, _NIVEL=2, _POS=0,
+    )
+
+    detalle = df_full.assign(_EMP=cod_emp, _ORDEN_TIPO=orden_tipo, _NIVEL=0, _POS=pos)
+    df_out = pd.concat([detalle, sub_tipo, sub_emp], ignore_index=True)
+    orden = np.lexsort((df_out['_POS'].to_numpy(), df_out['_NIVEL'].to_numpy(),
+                        df_out['_ORDEN_TIPO'].to_numpy(), df_out['_EMP'].to_numpy()))
+    return df_out.iloc[orden].drop(columns=['_EMP', '_ORDEN_TIPO', '_NIVEL', '_POS']).reset_index(drop=True)
+
+# CONFIANZA / REGLA_PROBABLE (emparejadores) y CAMBIO (modo incremental) solo aparecen cuando vienen en los cruces
+COLUMNAS_REPORTE_CABIFY = ['NIT', 'EMPRESA', 'LLAVE_DIAN', 'LLAVE_CONT', 'CUENTA_CONTABLE', 'SUBTOTAL DIAN', 'TOTAL CONTABILIDAD', 'DIFERENCIA', 'TIPO', 'CAMBIO', 'CONFIANZA', 'REGLA_PROBABLE', 'GRUPO_TIPO']
+SIN_PERIODO = 'SIN_PERIODO'
+
+def procesar_reporte_cabify_generico(coin, sob_d, sob_c, writer, sheet_name, emisor_col, total_col, iva_col, is_iva_report=False, prob=None):
+    df_write = preparar_reporte_cabify(coin, sob_d, sob_c, emisor_col, total_col, iva_col, is_iva_report, prob)
+    escribir_reporte_cabify(writer, sheet_name, df_write)
+
+def preparar_reporte_cabify(coin, sob_d, sob_c, emisor_col, total_col, iva_col, is_iva_report=False, prob=None, normalizador=None, columnas=None):
+    """
+    Tabla final de una hoja de conciliación (detalle, subtotales y gran total),
+    sin tocar el libro: se puede calcular en otro proceso. None si no hay filas.
+    `columnas` (por defecto COLUMNAS_REPORTE_CABIFY) puede incluir 'PERIODO'
+    (AAAA-MM de la fecha DIAN o, sin ella, de la contable).
+    """
+    cols_visibles = columnas or COLUMNAS_REPORTE_CABIFY
+    con_periodo = 'PERIODO' in cols_visibles
     lista_dfs = []
     
-    # 1. COINCIDENCIAS
-    if not coin.empty:
-        t = coin.copy()
+    # 1. COINCIDENCIAS (exactas y, si se buscaron, probables con su CONFIANZA)
+    for df_c, tipo in ((coin, 'COINCIDENCIA'), (prob, 'COINCIDENCIA_PROBABLE')):
+        if df_c is None or df_c.empty: continue
+        t = df_c.copy()
         t['NIT'] = clean_nit_numeric(t['u_infoco01'])
         t['EMPRESA'] = t[emisor_col] if emisor_col in t.columns else t['u_cardname']
-        t['EMPRESA_GRUPO'] = standardize_company_name(t['EMPRESA'])
-        
-        val_d = pd.to_numeric(t[total_col], errors='coerce').fillna(0)
+        t['EMPRESA_GRUPO'] = standardize_company_name(t['EMPRESA'], normalizador)
         
-        if not is_iva_report:
-            if iva_col and iva_col in t.columns: 
-                val_d -= pd.to_numeric(t[iva_col], errors='coerce').fillna(0)
-        
-        t['SUBTOTAL DIAN'] = val_d
+        t['SUBTOTAL DIAN'] = subtotal_dian(t, total_col, iva_col, is_iva_report)
         t['TOTAL CONTABILIDAD'] = t['u_saldo_f']
         t['DIFERENCIA'] = t['SUBTOTAL DIAN'] - t['TOTAL CONTABILIDAD']
-        t['TIPO'] = 'COINCIDENCIA'
+        t['TIPO'] = tipo
         t['LLAVE_DIAN'] = t[LLAVE_DIAN_CONT_COL_NAME]
         t['LLAVE_CONT'] = t['LLAVE_CONT']
         t['CUENTA_CONTABLE'] = t['u_acctname'] if 'u_acctname' in t.columns else ''
+        if con_periodo:
+            col_fecha = columna_fecha_dian(t)
+            t['PERIODO'] = periodo_de_fechas(t[col_fecha] if col_fecha else t.get('Fecha'))
         lista_dfs.append(t)
 
     # 2. SOBRANTES DIAN
     if not sob_d.empty:
         t = sob_d.copy()
-        col_nit = next((c for c in t.columns if ('emisor' in c or 'receptor' in c) and ('nit' in c or 'doc' in c)), None)
+        col_nit = columna_nit_dian(t)
         t['NIT'] = clean_nit_numeric(t[col_nit]) if col_nit else ''
         t['EMPRESA'] = t[emisor_col] if emisor_col in t.columns else 'DESCONOCIDO'
-        t['EMPRESA_GRUPO'] = standardize_company_name(t['EMPRESA'])
+        t['EMPRESA_GRUPO'] = standardize_company_name(t['EMPRESA'], normalizador)
         
-        val_d = pd.to_numeric(t[total_col], errors='coerce').fillna(0)
-        if not is_iva_report:
-            if iva_col and iva_col in t.columns: 
-                val_d -= pd.to_numeric(t[iva_col], errors='coerce').fillna(0)
+        val_d = subtotal_dian(t, total_col, iva_col, is_iva_report)
             
         t['SUBTOTAL DIAN'] = val_d
         t['TOTAL CONTABILIDAD'] = 0
@@ -369,6 +1280,9 @@ def procesar_reporte_cabify_generico(coin, sob_d, sob_c, writer, sheet_name, emi
         t['LLAVE_DIAN'] = t[LLAVE_DIAN_CONT_COL_NAME]
         t['LLAVE_CONT'] = ''
         t['CUENTA_CONTABLE'] = ''
+        if con_periodo:
+            col_fecha = columna_fecha_dian(t)
+            t['PERIODO'] = periodo_de_fechas(t[col_fecha] if col_fecha else None)
         lista_dfs.append(t)
 
     # 3. SOBRANTES CONTABILIDAD
@@ -376,7 +1290,7 @@ def procesar_reporte_cabify_generico(coin, sob_d, sob_c, writer, sheet_name, emi
         t = sob_c.copy()
         t['NIT'] = clean_nit_numeric(t['u_infoco01'])
         t['EMPRESA'] = t['u_cardname']
-        t['EMPRESA_GRUPO'] = standardize_company_name(t['u_cardname'])
+        t['EMPRESA_GRUPO'] = standardize_company_name(t['u_cardname'], normalizador)
         
         t['SUBTOTAL DIAN'] = 0
         t['TOTAL CONTABILIDAD'] = t['u_saldo_f']
@@ -385,60 +1299,50 @@ def procesar_reporte_cabify_generico(coin, sob_d, sob_c, writer, sheet_name, emi
         t['LLAVE_DIAN'] = ''
         t['LLAVE_CONT'] = t['LLAVE_CONT'] if 'LLAVE_CONT' in t.columns else t['u_ref']
         t['CUENTA_CONTABLE'] = t['u_acctname'] if 'u_acctname' in t.columns else ''
+        if con_periodo: t['PERIODO'] = periodo_de_fechas(t.get('Fecha'))
         lista_dfs.append(t)
 
-    cols_visibles = ['NIT', 'EMPRESA', 'LLAVE_DIAN', 'LLAVE_CONT', 'CUENTA_CONTABLE', 'SUBTOTAL DIAN', 'TOTAL CONTABILIDAD', 'DIFERENCIA', 'TIPO', 'GRUPO_TIPO']
-
-    if not lista_dfs: 
-        pd.DataFrame(columns=[c for c in cols_visibles if c != 'GRUPO_TIPO']).to_excel(writer, sheet_name=sheet_name, index=False)
-        writer.sheets[sheet_name].set_tab_color(CABIFY_PURPLE)
-        return
+    if not lista_dfs: return None
 
-    df_full = pd.concat(lista_dfs, ignore_index=True)
+    df_full = categorias_a_texto(pd.concat(lista_dfs, ignore_index=True))
     df_full = df_full[(df_full['SUBTOTAL DIAN'].abs() > 1) | (df_full['TOTAL CONTABILIDAD'].abs() > 1)].copy()
     
-    if df_full.empty:
-        pd.DataFrame(columns=[c for c in cols_visibles if c != 'GRUPO_TIPO']).to_excel(writer, sheet_name=sheet_name, index=False)
-        writer.sheets[sheet_name].set_tab_color(CABIFY_PURPLE)
-        return
+    if df_full.empty: return None
 
-    tipo_orden = {'COINCIDENCIA': 1, 'SOBRANTE_DIAN': 2, 'SOBRANTE_CONT': 3}
+    tipo_orden = {'COINCIDENCIA': 1, 'COINCIDENCIA_PROBABLE': 2, 'SOBRANTE_DIAN': 3, 'SOBRANTE_CONT': 4}
     df_full['ORDEN'] = df_full['TIPO'].map(tipo_orden)
-    df_full.sort_values(by=['EMPRESA_GRUPO', 'NIT', 'ORDEN'], inplace=True)
+    # Orden estable con las llaves como desempate: no depende del orden de llegada (p. ej. por particiones)
+    llaves_orden = ('LLAVE_DIAN', 'LLAVE_CONT')
+    df_full.sort_values(by=['EMPRESA_GRUPO', 'NIT', 'ORDEN', *llaves_orden], kind='stable', inplace=True,
+                        key=lambda s: s.astype(str) if s.name in llaves_orden else s)
+    df_full.reset_index(drop=True, inplace=True)
+    df_full['GRUPO_TIPO'] = 'DETALLE'
 
-    final_rows = []
     cols_sum = ['SUBTOTAL DIAN', 'TOTAL CONTABILIDAD', 'DIFERENCIA']
-    
-    for empresa, df_emp in df_full.groupby('EMPRESA_GRUPO', sort=False):
-        nit_grupo = df_emp['NIT'].iloc[0] if not df_emp.empty else ''
-        for tipo, df_tipo in df_emp.groupby('TIPO', sort=False):
-            df_tipo['GRUPO_TIPO'] = 'DETALLE'
-            final_rows.append(df_tipo)
-            sums = df_tipo[cols_sum].sum()
-            row_sub = pd.Series({'NIT': nit_grupo, 'EMPRESA': empresa, 'TIPO': f'SUBTOTAL {tipo}', 'GRUPO_TIPO': 'SUBTOTAL_TIPO', **sums})
-            final_rows.append(row_sub.to_frame().T)
-        sums_emp = df_emp[cols_sum].sum()
-        row_emp = pd.Series({'NIT': nit_grupo, 'EMPRESA': f'TOTAL {empresa}', 'GRUPO_TIPO': 'SUBTOTAL_EMPRESA', **sums_emp})
-        final_rows.append(row_emp.to_frame().T)
-
-    if not final_rows:
-        pd.DataFrame(columns=[c for c in cols_visibles if c != 'GRUPO_TIPO']).to_excel(writer, sheet_name=sheet_name, index=False)
-        return
+    df_out = _intercalar_subtotales(df_full, cols_sum)
 
-    df_out = pd.concat(final_rows, ignore_index=True).fillna('')
-    sums_glob = df_out[df_out['GRUPO_TIPO'] == 'SUBTOTAL_EMPRESA'][cols_sum].sum()
-    row_glob = pd.Series({'EMPRESA': 'GRAN TOTAL GLOBAL', 'GRUPO_TIPO': 'GRAN_TOTAL', **sums_glob})
-    df_out = pd.concat([df_out, row_glob.to_frame().T], ignore_index=True).fillna('')
+    sums_glob = df_out.loc[df_out['GRUPO_TIPO'] == 'SUBTOTAL_EMPRESA', cols_sum].sum()
+    row_glob = pd.DataFrame([{'EMPRESA': 'GRAN TOTAL GLOBAL', 'GRUPO_TIPO': 'GRAN_TOTAL', **sums_glob}])
+    df_out = pd.concat([df_out, row_glob], ignore_index=True)
+    cols_texto = [c for c in cols_visibles if c in df_out.columns and c not in cols_sum]
+    df_out[cols_texto] = df_out[cols_texto].fillna('')
 
     cols_final = [c for c in cols_visibles if c in df_out.columns]
-    df_write = df_out[cols_final].copy()
-    
-    df_write.drop(columns=['GRUPO_TIPO']).to_excel(writer, sheet_name=sheet_name, index=False)
-    
+    return df_out[cols_final].copy()
+
+def escribir_reporte_cabify(writer, sheet_name, df_write):
+    """Escribe en el libro la tabla de preparar_reporte_cabify (None: hoja solo con encabezado)."""
     wb = writer.book
-    ws = writer.sheets[sheet_name]
-    
     fmt_header = formato_cabezote_cabify(wb)
+
+    if df_write is None:
+        ws = wb.add_worksheet(sheet_name)
+        _escribir_encabezado(ws, [c for c in COLUMNAS_REPORTE_CABIFY if c not in ('CAMBIO', 'CONFIANZA', 'REGLA_PROBABLE', 'GRUPO_TIPO')], fmt_header)
+        ws.set_tab_color(CABIFY_PURPLE)
+        return
+
+    ws = wb.add_worksheet(sheet_name)
+    
     fmt_sub_tipo_txt = wb.add_format({'bold': True, 'bg_color': CABIFY_LIGHT})
     fmt_sub_tipo_num = wb.add_format({'bold': True, 'bg_color': CABIFY_LIGHT, 'num_format': '#,##0.00'})
     fmt_sub_emp_txt = wb.add_format({'bold': True, 'bg_color': CABIFY_ACCENT, 'font_color': WHITE})
@@ -454,32 +1358,30 @@ def procesar_reporte_cabify_generico(coin, sob_d, sob_c, writer, sheet_name, emi
     except:
         cols_moneda = []
 
-    total_cols_count = len(df_write.columns) - 1
-    for col_num, value in enumerate(df_write.drop(columns=['GRUPO_TIPO']).columns.values):
-        ws.write(0, col_num, value, fmt_header)
+    df_valores = df_write.drop(columns=['GRUPO_TIPO'])
+    _escribir_encabezado(ws, df_valores.columns.values, fmt_header)
     ws.set_column('B:B', 40)
     if cols_moneda:
         ws.set_column(cols_moneda[0], cols_moneda[-1], 18, wb.add_format({'num_format': '#,##0.00'}))
 
-    for i, row in df_write.iterrows():
-        tipo_fila = row['GRUPO_TIPO']
-        excel_row = i + 1 
-        if tipo_fila == 'DETALLE':
-            ws.set_row(excel_row, None, None, {'level': 2, 'hidden': True})
-        else:
-            f_txt, f_num = None, None
-            if tipo_fila == 'SUBTOTAL_TIPO':
-                f_txt, f_num = fmt_sub_tipo_txt, fmt_sub_tipo_num
-                ws.set_row(excel_row, None, None, {'level': 1, 'hidden': False})
-            elif tipo_fila == 'SUBTOTAL_EMPRESA':
-                f_txt, f_num = fmt_sub_emp_txt, fmt_sub_emp_num
-                ws.set_row(excel_row, None, None, {'level': 0, 'collapsed': False})
-            elif tipo_fila == 'GRAN_TOTAL':
-                f_txt, f_num = fmt_total_txt, fmt_total_num
-
-            if f_txt and f_num:
-                for col_idx in range(total_cols_count):
-                    valor = row.iloc[col_idx]
-                    estilo = f_num if col_idx in cols_moneda else f_txt
-                    ws.write(excel_row, col_idx, valor, estilo)
+    # Formato por tipo de fila precalculado: (opciones de set_row, formato texto, formato número)
+    estilos = {
+        'DETALLE': ({'level': 2, 'hidden': True}, None, None),
+        'SUBTOTAL_TIPO': ({'level': 1, 'hidden': False}, fmt_sub_tipo_txt, fmt_sub_tipo_num),
+        'SUBTOTAL_EMPRESA': ({'level': 0, 'collapsed': False}, fmt_sub_emp_txt, fmt_sub_emp_num),
+        'GRAN_TOTAL': (None, fmt_total_txt, fmt_total_num),
+    }
+    es_moneda = [col_idx in cols_moneda for col_idx in range(len(df_valores.columns))]
+    grupos = df_write['GRUPO_TIPO'].to_numpy()
+
+    # Filas escritas en orden (constant_memory): set_row antes de los valores de la fila
+    for inicio, filas in _lotes_para_excel(df_valores):
+        for excel_row, fila in enumerate(filas, start=inicio + 1):
+            opciones, f_txt, f_num = estilos.get(grupos[excel_row - 1], (None, None, None))
+            if opciones: ws.set_row(excel_row, None, None, opciones)
+            if f_txt is None:
+                ws.write_row(excel_row, 0, fila)
+            else:
+                for col_idx, valor in enumerate(fila):
+                    ws.write(excel_row, col_idx, valor, f_num if es_moneda[col_idx] else f_txt)
     ws.set_tab_color(CABIFY_PURPLE)
@@ -0,0 +1,120 @@
+"""
+Salida en Parquet para herramientas de BI, alternativa al libro Excel único
+(sin el límite de 1.048.576 filas por hoja ni el libro completo en memoria):
+
+    destino/
+        conciliacion/HOJA=gastos/TIPO=COINCIDENCIA/PERIODO=2024-03/*.parquet
+        bases/contabilidad/PERIODO=2024-03/*.parquet
+        bases/dian/PERIODO=.../*.parquet
+        bases/gosocket_emitidos/PERIODO=.../*.parquet
+        bases/cambios/*.parquet
+        Resumen_Conciliacion.xlsx
+
+En `conciliacion` solo van las filas de detalle; los subtotales por empresa
+quedan para el BI y los totales por hoja, tipo y periodo en el resumen. Se lee
+con cualquier lector de datasets Hive, p. ej.
+    pd.read_parquet('destino/conciliacion', filters=[('TIPO', '=', 'SOBRANTE_DIAN')])
+"""
+import os
+import shutil
+import uuid
+
+import pandas as pd
+
+import engine
+
+DIR_CONCILIACION = 'conciliacion'
+DIR_BASES = 'bases'
+NOMBRE_RESUMEN = 'Resumen_Conciliacion.xlsx'
+COLUMNAS_CONCILIACION = engine.COLUMNAS_REPORTE_CABIFY + ['PERIODO']
+PARTICIONES_CONCILIACION = ['HOJA', 'TIPO', 'PERIODO']
+COLUMNAS_SUMA = ['SUBTOTAL DIAN', 'TOTAL CONTABILIDAD', 'DIFERENCIA']
+# Hoja 'Base ...' del libro -> subdirectorio en bases/
+NOMBRES_BASES = {
+    'Base Contable Depurada': 'contabilidad',
+    'Base DIAN': 'dian',
+    'Base Gosocket Emitidos': 'gosocket_emitidos',
+    'Cambios desde cierre anterior': 'cambios',
+}
+
+def apto_parquet(df):
+    """Columnas object -> texto (o nulo): Parquet no admite números y texto mezclados en una columna."""
+    df = df.copy()
+    for c in df.columns[df.dtypes == object]:
+        s = df[c]
+        df[c] = s.astype(str).where(s.notna(), None)
+    df.columns = [str(c) for c in df.columns]
+    return df
+
+def escribir_dataset(df, directorio, particiones=None):
+    """Agrega archivos al dataset (cada llamada escribe archivos nuevos, no reemplaza). Devuelve las filas escritas."""
+    if df is None or df.empty: return 0
+    df = apto_parquet(df)
+    if particiones:
+        df.to_parquet(directorio, partition_cols=particiones, index=False)
+    else:
+        os.makedirs(directorio, exist_ok=True)
+        df.to_parquet(os.path.join(directorio, f'{uuid.uuid4().hex}.parquet'), index=False)
+    return len(df)
+
+def _columna_fecha(df):
+    if 'Fecha' in df.columns: return 'Fecha'
+    return engine.columna_fecha_dian(df)
+
+def detalle_conciliacion(tablas):
+    """{cruce: tabla de preparar_reporte_cabify con PERIODO} -> solo filas de detalle, con HOJA = nombre del cruce."""
+    partes = []
+    for nombre, tabla in tablas.items():
+        if tabla is None: continue
+        detalle = tabla[tabla['GRUPO_TIPO'] == 'DETALLE'].drop(columns=['GRUPO_TIPO'])
+        if 'CONFIANZA' in detalle.columns:  # el reporte la rellena con '' para Excel
+            detalle = detalle.assign(CONFIANZA=pd.to_numeric(detalle['CONFIANZA'], errors='coerce'))
+        partes.append(detalle.assign(HOJA=nombre))
+    if not partes: return pd.DataFrame(columns=PARTICIONES_CONCILIACION + COLUMNAS_SUMA)
+    return pd.concat(partes, ignore_index=True)
+
+def resumen(detalle):
+    """Filas y totales por hoja, tipo y periodo."""
+    if detalle.empty: return pd.DataFrame(columns=PARTICIONES_CONCILIACION + ['FILAS'] + COLUMNAS_SUMA)
+    grupos = detalle.groupby(PARTICIONES_CONCILIACION, sort=True)
+    return pd.concat([grupos.size().rename('FILAS'), grupos[COLUMNAS_SUMA].sum()], axis=1).reset_index()
+
+def exportar(tablas, bases, destino):
+    """
+    Escribe el dataset de conciliación, las bases (`{hoja Base: función que
+    devuelve un iterable de bloques}`, igual que resultado['bases_por_bloques'])
+    y el libro de resumen. Reemplaza una exportación anterior en `destino`.
+    Devuelve la ruta del resumen.
+    """
+    for sub in (DIR_CONCILIACION, DIR_BASES):
+        shutil.rmtree(os.path.join(destino, sub), ignore_errors=True)
+    os.makedirs(destino, exist_ok=True)
+
+    detalle = detalle_conciliacion(tablas)
+    escritos = [{'DATASET': DIR_CONCILIACION, 'FILAS': escribir_dataset(detalle, os.path.join(destino, DIR_CONCILIACION), PARTICIONES_CONCILIACION)}]
+
+    for hoja, bloques in bases.items():
+        nombre = NOMBRES_BASES.get(hoja, engine.normalize_col_name(hoja))
+        directorio = os.path.join(destino, DIR_BASES, nombre)
+        filas = 0
+        for df in bloques():
+            col_fecha = _columna_fecha(df)
+            if col_fecha:
+                filas += escribir_dataset(df.assign(PERIODO=engine.periodo_de_fechas(df[col_fecha])), directorio, ['PERIODO'])
+            else:
+                filas += escribir_dataset(df, directorio)
+        escritos.append({'DATASET': f'{DIR_BASES}/{nombre}', 'FILAS': filas})
+
+    ruta = os.path.join(destino, NOMBRE_RESUMEN)
+    with pd.ExcelWriter(ruta, engine='xlsxwriter', engine_kwargs={'options': engine.OPCIONES_LIBRO_REPORTE}) as writer:
+        engine.escribir_hoja_base(writer, 'Resumen', resumen(detalle))
+        engine.escribir_hoja_base(writer, 'Archivos', _describir_archivos(destino, escritos))
+    return ruta
+
+def _describir_archivos(destino, escritos):
+    for fila in escritos:
+        raiz = os.path.join(destino, fila['DATASET'])
+        archivos = [os.path.join(d, f) for d, _, nombres in os.walk(raiz) for f in nombres if f.endswith('.parquet')]
+        fila['ARCHIVOS'] = len(archivos)
+        fila['MB'] = round(sum(os.path.getsize(a) for a in archivos) / 2**20, 2)
+    return pd.DataFrame(escritos, columns=['DATASET', 'FILAS', 'ARCHIVOS', 'MB'])
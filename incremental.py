@@ -0,0 +1,193 @@
+"""
+Conciliación incremental contra el estado guardado del cierre anterior.
+
+El resultado de cada cruce depende solo de las filas que comparten llave, así
+que el estado guarda, por llave, una firma de las filas DIAN y contables (suma
+de hashes de fila + conteo) y las filas de resultado de cada cruce. En la
+corrida siguiente solo las llaves nuevas o con firma distinta se vuelven a
+cruzar; las demás toman sus filas del estado. Cada fila de resultado lleva la
+columna CAMBIO (NUEVO / MODIFICADO / vacío) y `cambios` lista por cruce las
+llaves nuevas, modificadas o eliminadas con su tipo antes y ahora.
+
+Si cambian las columnas de las bases, las reglas de familias o VERSION_ESTADO,
+el estado no se usa y se concilia todo (y se reemplaza el estado).
+"""
+import hashlib
+import json
+import os
+import shutil
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+import engine
+
+VERSION_ESTADO = '3'
+NOMBRES_CRUCES = ('gastos', 'ingresos', 'iva_descontable', 'iva_generado')
+PARTES_CRUCE = ('coin', 'sob_dian', 'sob_cont')
+# Columna de llave en cada parte del resultado de un cruce
+LLAVE_PARTE = {'coin': engine.LLAVE_DIAN_CONT_COL_NAME, 'sob_dian': engine.LLAVE_DIAN_CONT_COL_NAME, 'sob_cont': 'LLAVE_CONT'}
+TIPO_PARTE = {'coin': 'COINCIDENCIA', 'sob_dian': 'SOBRANTE_DIAN', 'sob_cont': 'SOBRANTE_CONT'}
+
+def _guardar_tabla(ruta_base, df):
+    df = df.reset_index(drop=True)
+    try:
+        df.to_parquet(ruta_base + '.parquet', index=False)
+    except Exception:
+        df.to_pickle(ruta_base + '.pkl')
+
+def _cargar_tabla(ruta_base):
+    if os.path.exists(ruta_base + '.parquet'): return pd.read_parquet(ruta_base + '.parquet')
+    if os.path.exists(ruta_base + '.pkl'): return pd.read_pickle(ruta_base + '.pkl')
+    return pd.DataFrame()
+
+def firmas_por_llave(llaves, df):
+    """(llaves únicas, firma uint64, filas) con la firma = suma (módulo 2**64) de los hashes de fila."""
+    if df is None or df.empty: return pd.Index([], dtype=object), np.array([], dtype=np.uint64), np.array([], dtype=np.int64)
+    hashes = pd.util.hash_pandas_object(df, index=False).to_numpy(dtype=np.uint64)
+    codigos, unicas = pd.factorize(pd.Series(llaves, dtype=object), use_na_sentinel=False)
+    firma = np.zeros(len(unicas), dtype=np.uint64)
+    np.add.at(firma, codigos, hashes)
+    return pd.Index(unicas, dtype=object), firma, np.bincount(codigos, minlength=len(unicas))
+
+def tabla_firmas(df_dian_raw, df_cont_full):
+    """Una fila por llave con la firma y el conteo de cada lado (0 si el lado no tiene filas)."""
+    ll_d, f_d, n_d = firmas_por_llave(df_dian_raw[engine.LLAVE_DIAN_CONT_COL_NAME], df_dian_raw)
+    ll_c, f_c, n_c = firmas_por_llave(engine.normalizar_llave(df_cont_full['u_ref']), df_cont_full)
+    dian = pd.DataFrame({'firma_dian': f_d, 'n_dian': n_d}, index=ll_d)
+    cont = pd.DataFrame({'firma_cont': f_c, 'n_cont': n_c}, index=ll_c)
+    firmas = dian.join(cont, how='outer')
+    for col in ('firma_dian', 'firma_cont'): firmas[col] = firmas[col].fillna(0).astype(np.uint64)
+    for col in ('n_dian', 'n_cont'): firmas[col] = firmas[col].fillna(0).astype(np.int64)
+    firmas.index.name = 'llave'
+    return firmas
+
+def _huella_reglas():
+    return hashlib.sha256(json.dumps(engine.REGLAS_FAMILIAS_CUENTA, sort_keys=True).encode()).hexdigest()[:16]
+
+class EstadoConciliacion:
+    """Directorio con el último cierre: meta.json, firmas por llave y las tres partes de cada cruce."""
+    def __init__(self, directorio):
+        self.directorio = directorio
+
+    def _meta_esperada(self, df_dian_raw, df_cont_full):
+        return {
+            'version': VERSION_ESTADO, 'reglas': _huella_reglas(),
+            'columnas_dian': [str(c) for c in df_dian_raw.columns], 'columnas_cont': [str(c) for c in df_cont_full.columns],
+        }
+
+    def cargar(self, df_dian_raw, df_cont_full):
+        """(firmas, cruces, meta) del cierre anterior, o None si no hay estado compatible con estas bases."""
+        ruta_meta = os.path.join(self.directorio, 'meta.json')
+        if not os.path.exists(ruta_meta): return None
+        try:
+            with open(ruta_meta, encoding='utf-8') as f: meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        esperada = self._meta_esperada(df_dian_raw, df_cont_full)
+        if any(meta.get(k) != v for k, v in esperada.items()): return None
+        firmas = _cargar_tabla(os.path.join(self.directorio, 'firmas')).set_index('llave')
+        cruces = {
+            nombre: tuple(_cargar_tabla(os.path.join(self.directorio, f'{nombre}_{parte}')) for parte in PARTES_CRUCE)
+            for nombre in NOMBRES_CRUCES
+        }
+        return firmas, cruces, meta
+
+    def guardar(self, df_dian_raw, df_cont_full, firmas, cruces):
+        """Reemplaza el estado completo; se escribe en un directorio aparte y se intercambia al final."""
+        nuevo = f'{self.directorio.rstrip(os.sep)}.{os.getpid()}.tmp'
+        shutil.rmtree(nuevo, ignore_errors=True)
+        os.makedirs(nuevo)
+        meta = dict(self._meta_esperada(df_dian_raw, df_cont_full), fecha=datetime.now().isoformat(timespec='seconds'), llaves=len(firmas))
+        _guardar_tabla(os.path.join(nuevo, 'firmas'), firmas.reset_index())
+        for nombre in NOMBRES_CRUCES:
+            for parte, df in zip(PARTES_CRUCE, cruces[nombre]):
+                _guardar_tabla(os.path.join(nuevo, f'{nombre}_{parte}'), df.drop(columns=['CAMBIO'], errors='ignore'))
+        with open(os.path.join(nuevo, 'meta.json'), 'w', encoding='utf-8') as f: json.dump(meta, f, ensure_ascii=False, indent=1)
+        viejo = f'{self.directorio.rstrip(os.sep)}.{os.getpid()}.old'
+        if os.path.exists(self.directorio): os.replace(self.directorio, viejo)
+        os.replace(nuevo, self.directorio)
+        shutil.rmtree(viejo, ignore_errors=True)
+
+def _estado_llaves(firmas, firmas_previas):
+    """Series llave -> 'NUEVO' / 'MODIFICADO' / 'IGUAL' para las llaves actuales, más el Index de llaves eliminadas."""
+    estado = pd.Series('NUEVO', index=firmas.index, dtype=object)
+    comunes = firmas.index.intersection(firmas_previas.index)
+    # Comparación columna a columna: al mezclar uint64 con NaN se perdería precisión en las firmas
+    igual = np.ones(len(comunes), dtype=bool)
+    for col in ('firma_dian', 'n_dian', 'firma_cont', 'n_cont'):
+        igual &= firmas.loc[comunes, col].to_numpy() == firmas_previas.loc[comunes, col].to_numpy()
+    estado.loc[comunes] = np.where(igual, 'IGUAL', 'MODIFICADO')
+    return estado, firmas_previas.index.difference(firmas.index)
+
+def _tipos_por_llave(cruce):
+    """llave -> tipo de fila (COINCIDENCIA / SOBRANTE_DIAN / SOBRANTE_CONT) en un cruce."""
+    partes = []
+    for parte, df in zip(PARTES_CRUCE, cruce):
+        col = LLAVE_PARTE[parte]
+        if df.empty or col not in df.columns: continue
+        partes.append(pd.Series(TIPO_PARTE[parte], index=pd.Index(df[col].astype(str).unique())))
+    if not partes: return pd.Series(dtype=object)
+    tipos = pd.concat(partes)
+    return tipos[~tipos.index.duplicated()]
+
+def conciliar_incremental(df_dian_raw, df_cont_full, estado, cruzar):
+    """
+    Devuelve (cruces, cambios, resumen). `cruzar(df_dian, df_cont) -> {cruce: (coin, sob_dian, sob_cont)}`
+    se llama solo con las filas de las llaves nuevas o modificadas (o con todo si
+    no hay estado previo compatible). Al final se guarda el nuevo estado.
+    """
+    if engine.LLAVE_DIAN_CONT_COL_NAME not in df_dian_raw.columns or 'u_ref' not in df_cont_full.columns:
+        # Sin llaves no hay nada que comparar por documento
+        return cruzar(df_dian_raw, df_cont_full), None, {'modo': 'completo', 'motivo': 'bases sin llave'}
+
+    firmas = tabla_firmas(df_dian_raw, df_cont_full)
+    previo = estado.cargar(df_dian_raw, df_cont_full)
+    if previo is None:
+        cruces = cruzar(df_dian_raw, df_cont_full)
+        estado.guardar(df_dian_raw, df_cont_full, firmas, cruces)
+        return cruces, None, {'modo': 'completo', 'motivo': 'sin cierre anterior compatible', 'llaves': len(firmas)}
+
+    firmas_previas, cruces_previos, meta = previo
+    estado_llaves, eliminadas = _estado_llaves(firmas, firmas_previas)
+    a_cruzar = estado_llaves.index[estado_llaves.to_numpy() != 'IGUAL']
+    iguales = estado_llaves.index[estado_llaves.to_numpy() == 'IGUAL']
+
+    sub_dian = df_dian_raw[df_dian_raw[engine.LLAVE_DIAN_CONT_COL_NAME].isin(a_cruzar)].reset_index(drop=True)
+    sub_cont = df_cont_full[engine.normalizar_llave(df_cont_full['u_ref']).isin(a_cruzar).to_numpy()].reset_index(drop=True)
+    nuevos = cruzar(sub_dian, sub_cont) if len(a_cruzar) else {}
+
+    cruces, cambios = {}, []
+    for nombre in NOMBRES_CRUCES:
+        partes = []
+        for i, parte in enumerate(PARTES_CRUCE):
+            col = LLAVE_PARTE[parte]
+            previa = cruces_previos[nombre][i]
+            if not previa.empty and col in previa.columns:
+                previa = previa[previa[col].astype(str).isin(iguales)].assign(CAMBIO='')
+            actual = nuevos.get(nombre, (pd.DataFrame(),) * 3)[i]
+            if not actual.empty and col in actual.columns:
+                actual = actual.assign(CAMBIO=estado_llaves.reindex(actual[col].astype(str)).to_numpy())
+            listas = [df for df in (previa, actual) if not df.empty]
+            partes.append(pd.concat(listas, ignore_index=True) if listas else pd.DataFrame())
+        cruces[nombre] = tuple(partes)
+
+        # Llaves del cruce nuevas, modificadas o que ya no están en las bases, con su tipo antes y ahora
+        antes, ahora = _tipos_por_llave(cruces_previos[nombre]), _tipos_por_llave(cruces[nombre])
+        llaves = antes.index.union(ahora.index)
+        comparadas = pd.DataFrame({'TIPO_ANTERIOR': antes.reindex(llaves), 'TIPO_ACTUAL': ahora.reindex(llaves)}).fillna('')
+        comparadas['CAMBIO'] = estado_llaves.reindex(llaves).fillna('').to_numpy()
+        comparadas.loc[comparadas.index.isin(eliminadas), 'CAMBIO'] = 'ELIMINADO'
+        comparadas = comparadas[comparadas['CAMBIO'].isin(['NUEVO', 'MODIFICADO', 'ELIMINADO'])]
+        if not comparadas.empty:
+            cambios.append(comparadas.rename_axis('LLAVE').reset_index().assign(CRUCE=nombre))
+
+    estado.guardar(df_dian_raw, df_cont_full, firmas, cruces)
+    columnas_cambios = ['CRUCE', 'LLAVE', 'CAMBIO', 'TIPO_ANTERIOR', 'TIPO_ACTUAL']
+    df_cambios = pd.concat(cambios, ignore_index=True)[columnas_cambios] if cambios else pd.DataFrame(columns=columnas_cambios)
+    resumen = {
+        'modo': 'incremental', 'cierre_anterior': meta.get('fecha'),
+        'llaves': len(firmas), 'recruzadas': len(a_cruzar), 'eliminadas': len(eliminadas),
+    }
+    return cruces, df_cambios, resumen
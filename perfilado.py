@@ -0,0 +1,200 @@
+"""
+Perfil de una corrida: tiempo, filas de entrada/salida y memoria de cada
+función del motor, más los tiempos por etapa de pipeline.
+
+`instrumentar()` reemplaza las funciones de FUNCIONES_PERFILADAS en engine por
+envolturas que solo miden cuando hay una `Corrida` activa; sin corrida el costo
+es una comparación. engine.configurar_cache conserva la envoltura de los
+lectores: el orden entre los dos no importa. Las funciones que corren en el
+pool de procesos de pipeline no se ven aquí; su tiempo queda en la etapa
+correspondiente.
+
+    instrumentar()
+    with Corrida(perfil_cpu='cprofile') as corrida:
+        ...
+    corrida.guardar()  # JSON (+ .prof / .html) en DIR_REGISTROS_DEFECTO
+"""
+import functools
+import json
+import os
+import threading
+import time
+import tracemalloc
+import warnings
+from datetime import datetime
+
+import pandas as pd
+
+import engine
+from por_bloques import memoria_actual_mb, memoria_pico_mb
+
+DIR_REGISTROS_DEFECTO = os.environ.get('CONCILIADOR_REGISTROS_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'conciliador', 'corridas'))
+# 'cprofile', 'pyinstrument' o vacío
+PERFIL_CPU_DEFECTO = os.environ.get('CONCILIADOR_PERFIL_CPU') or None
+
+FUNCIONES_PERFILADAS = (
+    'leer_dian', 'leer_contabilidad_completa', 'leer_gosocket',
+    'filtrar_dian_gastos', 'filtrar_dian_ingresos',
+    'ejecutar_conciliacion_universal', 'conciliar_ingresos_vs_gosocket',
+    'emparejar_sobrantes_probables', 'emparejar_por_monto_nit',
+    'procesar_reporte_cabify_generico', 'preparar_reporte_cabify', 'escribir_reporte_cabify',
+    'escribir_hoja_base', 'escribir_hoja_base_por_bloques',
+)
+
+_corrida_activa = None
+
+def _filas(valor):
+    """Filas de un DataFrame / FamiliaContable; lista para tuplas de resultados; None para lo demás."""
+    if isinstance(valor, pd.DataFrame): return len(valor)
+    if isinstance(valor, engine.FamiliaContable): return len(valor.posiciones)
+    if isinstance(valor, tuple):
+        filas = [_filas(v) for v in valor]
+        return filas if any(f is not None for f in filas) else None
+    return None
+
+def perfilar(funcion, nombre=None):
+    nombre = nombre or funcion.__name__
+    @functools.wraps(funcion)
+    def envoltura(*args, **kwargs):
+        corrida = _corrida_activa
+        if corrida is None: return funcion(*args, **kwargs)
+        return corrida.medir(nombre, funcion, args, kwargs)
+    # Verdadero, y con qué volver a envolver (engine.configurar_cache reasigna los lectores)
+    envoltura.__perfilada__ = functools.partial(perfilar, nombre=nombre)
+    return envoltura
+
+def instrumentar(modulo=engine, nombres=FUNCIONES_PERFILADAS):
+    """Envuelve las funciones del módulo; llamarlo de nuevo no las envuelve dos veces."""
+    for nombre in nombres:
+        funcion = getattr(modulo, nombre, None)
+        if funcion is None or getattr(funcion, '__perfilada__', False): continue
+        setattr(modulo, nombre, perfilar(funcion, nombre))
+
+def registrar_etapa(etapa, segundos):
+    """pipeline informa aquí la duración de cada etapa (lectura, cruces, ...)."""
+    corrida = _corrida_activa
+    if corrida is not None:
+        with corrida._lock: corrida.etapas[etapa] = corrida.etapas.get(etapa, 0.0) + segundos
+
+def tabla_registros(registros):
+    """Una fila por llamada, en orden de inicio, para mostrar en la app (también desde un registro JSON guardado)."""
+    df = pd.DataFrame(registros)
+    if df.empty: return df
+    for col in ('filas_entrada', 'filas_salida'):
+        df[col] = df[col].map(lambda v: '' if v is None else ' / '.join(map(str, v)) if isinstance(v, list) else str(v))
+    df['funcion'] = ['  ' * n + f for n, f in zip(df['nivel'], df['funcion'])]
+    return df.sort_values('inicio_s', kind='stable').drop(columns=['nivel']).reset_index(drop=True)
+
+def cargar_registro(ruta):
+    with open(ruta, encoding='utf-8') as f: return json.load(f)
+
+class Corrida:
+    """
+    Contexto que activa la medición. Con `memoria_detallada` se usa tracemalloc
+    (delta y pico de memoria Python por llamada, con sobrecosto notable);
+    siempre se registra el RSS del proceso. `perfil_cpu` agrega un volcado
+    cProfile (.prof) o pyinstrument (.html) de la corrida.
+    """
+    def __init__(self, perfil_cpu=PERFIL_CPU_DEFECTO, memoria_detallada=False, parametros=None):
+        self.perfil_cpu = perfil_cpu
+        self.memoria_detallada = memoria_detallada
+        self.parametros = dict(parametros or {})
+        self.registros = []
+        self.etapas = {}
+        self.inicio = None
+        self.duracion = None
+        self._t0 = None
+        self._perfilador = None
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._inicio_tracemalloc = False
+
+    def __enter__(self):
+        global _corrida_activa
+        self.inicio = datetime.now()
+        self._t0 = time.perf_counter()
+        if self.memoria_detallada and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._inicio_tracemalloc = True
+        self._iniciar_perfil_cpu()
+        _corrida_activa = self
+        return self
+
+    def __exit__(self, *exc):
+        global _corrida_activa
+        _corrida_activa = None
+        if self.perfil_cpu == 'cprofile' and self._perfilador is not None: self._perfilador.disable()
+        elif self._perfilador is not None: self._perfilador.stop()
+        if self._inicio_tracemalloc: tracemalloc.stop()
+        self.duracion = time.perf_counter() - self._t0
+        return False
+
+    def _iniciar_perfil_cpu(self):
+        if self.perfil_cpu == 'pyinstrument':
+            try:
+                from pyinstrument import Profiler
+                self._perfilador = Profiler()
+                self._perfilador.start()
+                return
+            except ImportError:
+                warnings.warn("pyinstrument no está instalado; se usa cProfile.", engine.AvisoConciliador, stacklevel=2)
+                self.perfil_cpu = 'cprofile'
+        if self.perfil_cpu == 'cprofile':
+            import cProfile
+            self._perfilador = cProfile.Profile()
+            self._perfilador.enable()
+
+    def medir(self, nombre, funcion, args, kwargs):
+        profundidad = getattr(self._local, 'profundidad', 0)
+        con_tracemalloc = self.memoria_detallada and tracemalloc.is_tracing()
+        if con_tracemalloc:
+            antes = tracemalloc.get_traced_memory()[0]
+            # El pico solo se reinicia en el nivel externo para no falsear el de la llamada que contiene a esta
+            if profundidad == 0 and hasattr(tracemalloc, 'reset_peak'): tracemalloc.reset_peak()
+        self._local.profundidad = profundidad + 1
+        inicio = time.perf_counter()
+        try:
+            resultado = funcion(*args, **kwargs)
+        finally:
+            self._local.profundidad = profundidad
+        fin = time.perf_counter()
+
+        entrada = [f for f in map(_filas, args) if f is not None]
+        registro = {
+            'funcion': nombre, 'nivel': profundidad, 'hilo': threading.current_thread().name,
+            'inicio_s': round(inicio - self._t0, 4), 'segundos': round(fin - inicio, 4),
+            'filas_entrada': entrada[0] if len(entrada) == 1 else (entrada or None),
+            'filas_salida': _filas(resultado), 'rss_mb': memoria_actual_mb(),
+        }
+        if con_tracemalloc:
+            actual, pico = tracemalloc.get_traced_memory()
+            registro['tracemalloc_delta_mb'] = round((actual - antes) / 2**20, 2)
+            if profundidad == 0: registro['tracemalloc_pico_mb'] = round((pico - antes) / 2**20, 2)
+        with self._lock: self.registros.append(registro)
+        return resultado
+
+    def tabla(self):
+        return tabla_registros(self.registros)
+
+    def como_dict(self):
+        return {
+            'inicio': self.inicio.isoformat(timespec='seconds') if self.inicio else None,
+            'duracion_s': round(self.duracion, 4) if self.duracion is not None else None,
+            'parametros': self.parametros,
+            'etapas': {k: round(v, 4) for k, v in self.etapas.items()},
+            'pico_rss_mb': memoria_pico_mb(),
+            'funciones': self.registros,
+        }
+
+    def guardar(self, directorio=DIR_REGISTROS_DEFECTO):
+        """Escribe el registro JSON (y el perfil de CPU si se pidió). Devuelve la ruta del JSON."""
+        os.makedirs(directorio, exist_ok=True)
+        base = os.path.join(directorio, f"corrida_{self.inicio:%Y%m%d_%H%M%S}_{os.getpid()}")
+        with open(base + '.json', 'w', encoding='utf-8') as f:
+            json.dump(self.como_dict(), f, ensure_ascii=False, indent=1, default=str)
+        if self._perfilador is not None:
+            if self.perfil_cpu == 'cprofile':
+                self._perfilador.dump_stats(base + '.prof')
+            else:
+                with open(base + '.html', 'w', encoding='utf-8') as f: f.write(self._perfilador.output_html())
+        return base + '.json'
@@ -0,0 +1,618 @@
+"""
+Pipeline de conciliación sin interfaz: los mismos pasos que ejecuta el botón
+de app.py, importables desde otros scripts y ejecutables por línea de comandos.
+
+Uso:
+    python pipeline.py --dian DIAN.xlsx --contabilidad Auxiliar.xlsx --salida reportes/
+    python pipeline.py --lote cierres/2024-12 --salida reportes/
+    python pipeline.py --dian DIAN_2019_2024.xlsx --contabilidad Auxiliar.xlsx --salida reportes/ --por-bloques --limite-mb 1500
+    python pipeline.py --dian DIAN.xlsx --contabilidad Auxiliar.xlsx --salida bi/ --formato parquet
+
+En modo lote cada subcarpeta (una por empresa/periodo) debe contener los
+archivos de entrada; se reconocen por nombre (ver PATRONES_ARCHIVOS).
+"""
+import argparse
+import contextlib
+import io
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import pandas as pd
+
+import cache_disco
+import engine
+import exportacion
+import incremental
+import perfilado
+import por_bloques
+
+NOMBRE_REPORTE = 'Reporte_Conciliacion_Final.xlsx'
+
+# Palabras clave en el nombre del archivo (sin tildes, en minúscula) para el modo lote
+PATRONES_ARCHIVOS = {
+    'dian': ('dian',),
+    'contabilidad': ('contab', 'auxiliar', 'netsuite'),
+    'emitidos': ('emitid',),
+    'recibidos': ('recibid',),
+}
+EXTENSIONES_EXCEL = ('.xlsx', '.xls')
+# Procesos para cruces y hojas; 1 = todo en el proceso actual
+TRABAJADORES_DEFECTO = int(os.environ.get('CONCILIADOR_TRABAJADORES', 1))
+
+def _sin_progreso(pct, mensaje): pass
+
+@contextlib.contextmanager
+def _cronometro(tiempos, etapa):
+    inicio = time.perf_counter()
+    try: yield
+    finally:
+        segundos = time.perf_counter() - inicio
+        tiempos[etapa] = tiempos.get(etapa, 0.0) + segundos
+        perfilado.registrar_etapa(etapa, segundos)
+
+_pools = {}
+
+def _pool_procesos(trabajadores):
+    """Pool reutilizado entre corridas (arrancar procesos 'spawn' cuesta un import de pandas cada uno)."""
+    pool = _pools.get(trabajadores)
+    if pool is None:
+        pool = _pools[trabajadores] = ProcessPoolExecutor(trabajadores, mp_context=multiprocessing.get_context('spawn'))
+    return pool
+
+def cerrar_pools():
+    """Apaga los pools reutilizados; los procesos de la cola de trabajos lo llaman al salir."""
+    for pool in _pools.values(): pool.shutdown(wait=True, cancel_futures=True)
+    _pools.clear()
+
+def _cruce_en_proceso(df_dian, df_cont, signo, hoja=None, probables=False, por_monto=False):
+    """Un cruce completo (y sus emparejadores) sobre las filas de una sola familia; se ejecuta en un proceso de trabajo."""
+    familia = engine.ContabilidadPreparada(df_cont).familia(signo=signo)
+    coin, sob_d, sob_c = engine.ejecutar_conciliacion_universal(df_dian, familia)
+    partes = []
+    if hoja is not None:
+        total_col, iva_col, is_iva = hoja
+        if probables:
+            prob, sob_d, sob_c = engine.emparejar_sobrantes_probables(sob_d, sob_c, total_col, iva_col, is_iva)
+            partes.append(prob)
+        if por_monto:
+            prob, sob_d, sob_c = engine.emparejar_por_monto_nit(sob_d, sob_c, total_col, iva_col, is_iva)
+            partes.append(prob)
+    partes = [p for p in partes if not p.empty]
+    return (coin, sob_d, sob_c), (pd.concat(partes, ignore_index=True) if partes else None)
+
+def _hoja_en_proceso(cruce, prob, empresa_col, total_col, iva_col, is_iva, normalizador, columnas=None):
+    df_write = engine.preparar_reporte_cabify(*cruce, empresa_col, total_col, iva_col, is_iva, prob, normalizador, columnas)
+    return df_write, normalizador
+
+def abrir_entrada(ruta):
+    """Carga un archivo de entrada como BytesIO (o None si no hay ruta), igual que un archivo subido."""
+    if not ruta: return None
+    with open(ruta, 'rb') as f: return io.BytesIO(f.read())
+
+def cruzar_bases(df_dian_raw, df_cont_full):
+    """
+    Separa DIAN y contabilidad por familia y ejecuta los cuatro cruces.
+    Devuelve (cruces, contabilidad preparada).
+    """
+    df_dian_gastos = engine.filtrar_dian_gastos(df_dian_raw)
+    df_dian_ingresos = engine.filtrar_dian_ingresos(df_dian_raw)
+
+    # Segregación: la llave contable se calcula una vez y cada familia es solo una máscara
+    cont = engine.ContabilidadPreparada(df_cont_full)
+    cruces = {
+        'gastos': engine.ejecutar_conciliacion_universal(df_dian_gastos, cont.gastos()),
+        'ingresos': engine.ejecutar_conciliacion_universal(df_dian_ingresos, cont.ingresos()),
+        'iva_descontable': engine.ejecutar_conciliacion_universal(df_dian_gastos, cont.iva_descontable()),
+        'iva_generado': engine.ejecutar_conciliacion_universal(df_dian_ingresos, cont.iva_generado()),
+    }
+    return cruces, cont
+
+def emparejar_sobrantes(cruces, df_dian_raw, probables=False, por_monto=False):
+    """Pasa los sobrantes de cada cruce por los emparejadores pedidos; actualiza `cruces` y devuelve {cruce: probables}."""
+    coincidencias_probables = {}
+    if not (probables or por_monto): return coincidencias_probables
+    for nombre, _, _, total_col, iva_col, is_iva in hojas_reporte(df_dian_raw):
+        coin, sob_d, sob_c = cruces[nombre]
+        partes = []
+        if probables:
+            prob, sob_d, sob_c = engine.emparejar_sobrantes_probables(sob_d, sob_c, total_col, iva_col, is_iva)
+            partes.append(prob)
+        if por_monto:
+            prob, sob_d, sob_c = engine.emparejar_por_monto_nit(sob_d, sob_c, total_col, iva_col, is_iva)
+            partes.append(prob)
+        cruces[nombre] = (coin, sob_d, sob_c)
+        partes = [p for p in partes if not p.empty]
+        coincidencias_probables[nombre] = pd.concat(partes, ignore_index=True) if partes else pd.DataFrame()
+    return coincidencias_probables
+
+def conciliar(file_dian, file_cont, file_emi=None, file_rec=None, progreso=None, probables=False, por_monto=False, trabajadores=None, estado=None):
+    """
+    Lee las bases y ejecuta los cuatro cruces (gastos, ingresos, IVA descontable,
+    IVA generado) más el cruce de ingresos contra Gosocket emitidos.
+    Con `probables`, los sobrantes pasan por engine.emparejar_sobrantes_probables;
+    con `por_monto`, lo que quede pasa por engine.emparejar_por_monto_nit.
+    Con `trabajadores` > 1 los archivos se leen en hilos y los cruces corren en
+    un pool de procesos. Con `estado` (directorio del último cierre) solo se
+    cruzan los documentos nuevos o modificados (ver incremental) y
+    resultado['cambios'] lista lo que cambió. `progreso(pct, mensaje)` recibe
+    el avance por etapa; resultado['tiempos'] guarda los segundos de cada etapa.
+    """
+    progreso = progreso or _sin_progreso
+    trabajadores = trabajadores or TRABAJADORES_DEFECTO
+    tiempos = {}
+
+    # 1. LECTURA
+    with _cronometro(tiempos, 'lectura'):
+        if trabajadores > 1:
+            progreso(15, "Leyendo DIAN, contabilidad y Gosocket en paralelo...")
+            with ThreadPoolExecutor(4) as hilos:
+                f_dian = hilos.submit(engine.leer_dian, file_dian)
+                f_cont = hilos.submit(engine.leer_contabilidad_completa, file_cont)
+                f_rec = hilos.submit(engine.leer_gosocket, file_rec)
+                f_emi = hilos.submit(engine.leer_gosocket, file_emi)
+                df_dian_base, df_cont_full, df_rec, df_emi = f_dian.result(), f_cont.result(), f_rec.result(), f_emi.result()
+            df_dian_raw, df_dian_base = engine.separar_dian(df_dian_base)
+        else:
+            progreso(15, "Leyendo y normalizando datos de la DIAN...")
+            df_dian_raw, df_dian_base = engine.separar_dian(engine.leer_dian(file_dian))
+
+            progreso(35, "Procesando contabilidad Netsuite...")
+            df_cont_full = engine.leer_contabilidad_completa(file_cont)
+            df_rec = engine.leer_gosocket(file_rec)
+            df_emi = engine.leer_gosocket(file_emi)
+    if df_cont_full is None:
+        raise ValueError("Error leyendo el archivo contable. Verifica el formato.")
+    memoria_bases = memoria_al_leer(DIAN=df_dian_raw, Recibidos=df_rec, Emitidos=df_emi)
+    if memoria_bases: progreso(50, f"Bases tipadas al leer: {resumen_memoria(memoria_bases)}")
+
+    # 2. PROCESAMIENTO
+    progreso(60, "Cruzando bases de datos...")
+    cambios, resumen_incremental = None, None
+    with _cronometro(tiempos, 'cruces'):
+        if estado is not None:
+            if not isinstance(estado, incremental.EstadoConciliacion): estado = incremental.EstadoConciliacion(estado)
+            def cruzar(df_dian, df_cont):
+                if trabajadores > 1: return _cruzar_en_paralelo(df_dian, df_cont, trabajadores)[0]
+                return cruzar_bases(df_dian, df_cont)[0]
+            cruces, cambios, resumen_incremental = incremental.conciliar_incremental(df_dian_raw, df_cont_full, estado, cruzar)
+            progreso(65, _describir_incremental(resumen_incremental))
+            cont = None
+            if probables or por_monto:
+                progreso(70, "Buscando coincidencias probables en los sobrantes...")
+            coincidencias_probables = emparejar_sobrantes(cruces, df_dian_raw, probables, por_monto)
+        elif trabajadores > 1:
+            if probables or por_monto:
+                progreso(70, "Buscando coincidencias probables en los sobrantes (en paralelo)...")
+            cruces, cont, coincidencias_probables = _cruzar_en_paralelo(df_dian_raw, df_cont_full, trabajadores, probables, por_monto)
+        else:
+            cruces, cont = cruzar_bases(df_dian_raw, df_cont_full)
+            if probables or por_monto:
+                progreso(70, "Buscando coincidencias probables en los sobrantes...")
+            coincidencias_probables = emparejar_sobrantes(cruces, df_dian_raw, probables, por_monto)
+
+    cruce_gosocket = None
+    if df_emi is not None:
+        with _cronometro(tiempos, 'gosocket'):
+            cont = cont or engine.ContabilidadPreparada(df_cont_full)
+            cruce_gosocket = engine.conciliar_ingresos_vs_gosocket(cont.ingresos(), df_emi)
+
+    return {
+        'df_dian_raw': df_dian_raw, 'df_dian_base': df_dian_base, 'df_cont_full': df_cont_full,
+        'df_emi': df_emi, 'df_rec': df_rec,
+        'cruces': cruces, 'cruce_gosocket': cruce_gosocket,
+        'probables': coincidencias_probables,
+        'tiempos': tiempos, 'trabajadores': trabajadores, 'memoria_bases': memoria_bases,
+        'cambios': cambios, 'incremental': resumen_incremental,
+    }
+
+def _describir_incremental(resumen):
+    if resumen['modo'] != 'incremental': return f"Conciliación completa ({resumen['motivo']}); estado guardado para el próximo cierre."
+    return (f"Incremental sobre el cierre del {resumen['cierre_anterior']}: {resumen['recruzadas']:,} de "
+            f"{resumen['llaves']:,} documentos cruzados de nuevo, {resumen['eliminadas']:,} ya no están.")
+
+def _cruzar_en_paralelo(df_dian_raw, df_cont_full, trabajadores, probables=False, por_monto=False):
+    """
+    cruzar_bases + emparejar_sobrantes repartidos en el pool: a cada proceso solo
+    viajan las filas DIAN y contables de su familia. Los resultados se recogen
+    en el orden fijo de los cruces.
+    """
+    df_dian_gastos = engine.filtrar_dian_gastos(df_dian_raw)
+    df_dian_ingresos = engine.filtrar_dian_ingresos(df_dian_raw)
+    cont = engine.ContabilidadPreparada(df_cont_full)
+    familias = {
+        'gastos': (df_dian_gastos, cont.gastos()), 'ingresos': (df_dian_ingresos, cont.ingresos()),
+        'iva_descontable': (df_dian_gastos, cont.iva_descontable()), 'iva_generado': (df_dian_ingresos, cont.iva_generado()),
+    }
+    hojas = {nombre: (total_col, iva_col, is_iva) for nombre, _, _, total_col, iva_col, is_iva in hojas_reporte(df_dian_raw)}
+    pool = _pool_procesos(trabajadores)
+    futuros = {
+        nombre: pool.submit(_cruce_en_proceso, df_dian, cont.df.iloc[familia.posiciones] if cont.con_referencia else cont.df,
+                            familia.signo, hojas.get(nombre), probables, por_monto)
+        for nombre, (df_dian, familia) in familias.items()
+    }
+    cruces, coincidencias_probables = {}, {}
+    for nombre, futuro in futuros.items():
+        cruces[nombre], prob = futuro.result()
+        if (probables or por_monto) and nombre in hojas:
+            coincidencias_probables[nombre] = prob if prob is not None else pd.DataFrame()
+    return cruces, cont, coincidencias_probables
+
+def _cruzar_particion(df_dian, df_cont):
+    """cruzar_bases sobre una partición; sin filas contables, la DIAN de la partición queda completa como sobrante."""
+    if not df_cont.empty: return cruzar_bases(df_dian, df_cont)[0]
+    if df_dian.empty: return {}
+    gastos, ingresos = engine.filtrar_dian_gastos(df_dian), engine.filtrar_dian_ingresos(df_dian)
+    return {
+        'gastos': (pd.DataFrame(), gastos, pd.DataFrame()), 'ingresos': (pd.DataFrame(), ingresos, pd.DataFrame()),
+        'iva_descontable': (pd.DataFrame(), gastos, pd.DataFrame()), 'iva_generado': (pd.DataFrame(), ingresos, pd.DataFrame()),
+    }
+
+def _cruzar_gosocket_particion(df_cont, df_emi):
+    """Ingresos de la partición contra Gosocket emitidos; sin filas contables, Gosocket de la partición queda como sobrante."""
+    if df_cont.empty: return pd.DataFrame(), pd.DataFrame(), df_emi
+    return engine.conciliar_ingresos_vs_gosocket(engine.ContabilidadPreparada(df_cont).ingresos(), df_emi)
+
+def conciliar_por_bloques(file_dian, file_cont, file_emi=None, file_rec=None, progreso=None, probables=False, por_monto=False,
+                          filas_por_bloque=por_bloques.FILAS_POR_BLOQUE, limite_mb=por_bloques.LIMITE_MB_DEFECTO):
+    """
+    Variante de `conciliar` con memoria acotada para exportaciones de varios años:
+    lee por bloques, reparte por hash de la llave en cubetas Parquet y cruza
+    grupo de cubetas por grupo (ver por_bloques). Lanza MemoryError si el proceso
+    pasa de `limite_mb`. Las bases completas quedan en disco hasta `limpiar_resultado`.
+    Gosocket emitidos se reparte con las mismas cubetas (por su LLAVE_SERIE_FOLIO)
+    y se cruza contra los ingresos de cada grupo.
+    """
+    progreso = progreso or _sin_progreso
+    trabajo = por_bloques.Particionador()
+    try:
+        progreso(15, "Leyendo DIAN por bloques...")
+        df_dian_vacio = pd.DataFrame()
+        for n, bloque in enumerate(por_bloques.leer_excel_por_bloques(file_dian, filas_por_bloque)):
+            df, base = por_bloques.normalizar_bloque_dian(bloque)
+            trabajo.guardar_base('dian', n, base)
+            if n == 0: df_dian_vacio = df.iloc[:0]
+            trabajo.repartir('dian', n, df, por_bloques.cubeta_de_llave(df.get(engine.LLAVE_DIAN_CONT_COL_NAME)))
+            trabajo.vigilar(limite_mb)
+
+        progreso(35, "Procesando contabilidad Netsuite por bloques...")
+        cuenta = None
+        bloques_cont = por_bloques.leer_excel_por_bloques(file_cont, filas_por_bloque, columnas_clave=('Cuenta', 'Fecha'))
+        for n, bloque in enumerate(bloques_cont):
+            df, cuenta = engine.normalizar_contabilidad(bloque, cuenta)
+            trabajo.guardar_base('contabilidad', n, df)
+            reducido = por_bloques.reducir_contabilidad(df)
+            llaves = engine.normalizar_llave(reducido['u_ref']) if 'u_ref' in reducido.columns else None
+            trabajo.repartir('contabilidad', n, reducido, por_bloques.cubeta_de_llave(llaves))
+            trabajo.vigilar(limite_mb)
+
+        df_rec = engine.leer_gosocket(file_rec)
+        df_emi = engine.leer_gosocket(file_emi)
+        if df_emi is not None:
+            # Sin llave todo Gosocket va a la cubeta 0 y sale completo como sobrante, igual que en `conciliar`
+            emi_llave = engine.con_llave_gosocket(df_emi)
+            if emi_llave is None: trabajo.repartir('emitidos', 0, df_emi, None)
+            else: trabajo.repartir('emitidos', 0, emi_llave, por_bloques.cubeta_de_llave(emi_llave[engine.LLAVE_SERIE_FOLIO_COL_NAME]))
+
+        progreso(60, "Cruzando bases de datos por particiones...")
+        partes = {}
+        for cubetas in trabajo.grupos(limite_mb):
+            df_cont = trabajo.leer('contabilidad', cubetas)
+            cruces_grupo = _cruzar_particion(trabajo.leer('dian', cubetas), df_cont)
+            if df_emi is not None: cruces_grupo['gosocket'] = _cruzar_gosocket_particion(df_cont, trabajo.leer('emitidos', cubetas))
+            for nombre, tripleta in cruces_grupo.items():
+                for lista, df in zip(partes.setdefault(nombre, ([], [], [])), tripleta):
+                    if not df.empty: lista.append(df)
+            trabajo.vigilar(limite_mb)
+        cruces = {}
+        for nombre in ('gastos', 'ingresos', 'iva_descontable', 'iva_generado'):
+            listas = partes.get(nombre, ([], [], []))
+            cruces[nombre] = tuple(por_bloques.unir_particiones(lista) for lista in listas)
+        cruce_gosocket = None
+        if df_emi is not None:
+            cruce_gosocket = tuple(por_bloques.unir_particiones(lista) for lista in partes.get('gosocket', ([], [], [])))
+
+        if probables or por_monto:
+            progreso(70, "Buscando coincidencias probables en los sobrantes...")
+        coincidencias_probables = emparejar_sobrantes(cruces, df_dian_vacio, probables, por_monto)
+        trabajo.vigilar(limite_mb)
+    except BaseException:
+        trabajo.limpiar()
+        raise
+
+    memoria = trabajo.memoria(limite_mb)
+    if memoria['pico_mb']:
+        progreso(80, f"Cruces listos; pico de memoria {memoria['pico_mb']:.0f} MB (límite {limite_mb:.0f} MB)")
+
+    bases = {'Base Contable Depurada': lambda: trabajo.bloques_base('contabilidad')}
+    if df_emi is not None: bases['Base Gosocket Emitidos'] = lambda: iter([df_emi])
+    bases['Base DIAN'] = lambda: trabajo.bloques_base('dian')
+    return {
+        'df_dian_raw': df_dian_vacio, 'df_cont_full': None,
+        'df_emi': df_emi, 'df_rec': df_rec,
+        'cruces': cruces, 'cruce_gosocket': cruce_gosocket,
+        'probables': coincidencias_probables,
+        'bases_por_bloques': bases, 'memoria': memoria, 'trabajo': trabajo,
+    }
+
+def limpiar_resultado(resultado):
+    """Borra los archivos temporales de un resultado por bloques (no hace nada con los demás)."""
+    if resultado.get('trabajo') is not None: resultado['trabajo'].limpiar()
+
+def columnas_reporte_dian(df_dian_raw):
+    """Columnas de emisor, receptor, total e IVA en la base DIAN normalizada."""
+    try:
+        emisor_d = next((c for c in df_dian_raw.columns if 'nombre_emisor' in c), 'Emisor')
+        receptor_d = next((c for c in df_dian_raw.columns if 'nombre_receptor' in c), 'Receptor')
+        total_d = next((c for c in df_dian_raw.columns if 'total_bruto' in c or 'total' in c), 'Total')
+        iva_d = next((c for c in df_dian_raw.columns if 'iva' in c or 'impuesto' in c), None)
+    except:
+        emisor_d, receptor_d, total_d, iva_d = 'Emisor', 'Receptor', 'Total', 'IVA'
+    return emisor_d, receptor_d, total_d, iva_d
+
+def hojas_reporte(df_dian_raw):
+    """(cruce, hoja, columna empresa DIAN, columna de monto, IVA a restar, es reporte de IVA) de cada hoja de conciliación."""
+    emisor_d, receptor_d, total_d, iva_d = columnas_reporte_dian(df_dian_raw)
+    hojas = [
+        ('gastos', '1. Conciliacion Gastos', emisor_d, total_d, iva_d, False),
+        ('ingresos', '2. Conciliacion Ingresos', receptor_d, total_d, iva_d, False),
+    ]
+    if iva_d:
+        hojas += [
+            ('iva_descontable', '3. IVA Descontable', emisor_d, iva_d, None, True),
+            ('iva_generado', '3.1 IVA Generado', receptor_d, iva_d, None, True),
+        ]
+    return hojas
+
+def preparar_hojas(resultado, trabajadores=1, columnas=None):
+    """
+    {hoja: tabla de engine.preparar_reporte_cabify}; con `trabajadores` > 1 cada
+    hoja se prepara en el pool de procesos. `columnas` pasa a preparar_reporte_cabify.
+    """
+    cruces, probables = resultado['cruces'], resultado.get('probables', {})
+    hojas = hojas_reporte(resultado['df_dian_raw'])
+    if trabajadores <= 1:
+        return {
+            hoja: engine.preparar_reporte_cabify(*cruces[nombre], empresa_col, total_col, iva_col, is_iva, probables.get(nombre), columnas=columnas)
+            for nombre, hoja, empresa_col, total_col, iva_col, is_iva in hojas
+        }
+    pool = _pool_procesos(trabajadores)
+    normalizador = engine.normalizador_empresas()
+    futuros = {
+        hoja: pool.submit(_hoja_en_proceso, cruces[nombre], probables.get(nombre), empresa_col, total_col, iva_col, is_iva, normalizador, columnas)
+        for nombre, hoja, empresa_col, total_col, iva_col, is_iva in hojas
+    }
+    tablas = {}
+    for hoja, futuro in futuros.items():
+        tablas[hoja], usado = futuro.result()
+        # Los nombres limpiados en el proceso de trabajo pasan al diccionario persistente
+        normalizador.incorporar(usado)
+    return tablas
+
+def escribir_reporte(resultado, destino, progreso=None, trabajadores=None, tablas=None):
+    """
+    Escribe el libro final en `destino` (ruta o buffer binario). Las hojas de
+    conciliación se preparan (en paralelo si `trabajadores` > 1) y luego se
+    escriben siempre en el mismo orden en un solo libro. Con `tablas` ya
+    preparadas (p. ej. con columnas extra para la vista previa) no se vuelven
+    a preparar y solo se escriben las columnas del reporte.
+    """
+    progreso = progreso or _sin_progreso
+    trabajadores = trabajadores or resultado.get('trabajadores') or TRABAJADORES_DEFECTO
+    tiempos = resultado.setdefault('tiempos', {})
+    progreso(85, "Escribiendo reporte final...")
+    df_dian_raw, df_cont_full, df_emi = resultado['df_dian_raw'], resultado['df_cont_full'], resultado['df_emi']
+
+    if tablas is None:
+        with _cronometro(tiempos, 'preparar_hojas'):
+            tablas = preparar_hojas(resultado, trabajadores)
+    else:
+        tablas = {hoja: t if t is None else t[[c for c in engine.COLUMNAS_REPORTE_CABIFY if c in t.columns]] for hoja, t in tablas.items()}
+
+    with _cronometro(tiempos, 'escribir_excel'), \
+            pd.ExcelWriter(destino, engine='xlsxwriter', engine_kwargs={'options': engine.OPCIONES_LIBRO_REPORTE}) as writer:
+        for hoja, df_write in tablas.items():
+            engine.escribir_reporte_cabify(writer, hoja, df_write)
+
+        if resultado.get('bases_por_bloques'):
+            for hoja, bloques in bases_reporte(resultado).items():
+                engine.escribir_hoja_base_por_bloques(writer, hoja, bloques())
+        else:
+            engine.escribir_hoja_base(writer, 'Base Contable Depurada', df_cont_full)
+
+            if df_emi is not None:
+                engine.escribir_hoja_base(writer, 'Base Gosocket Emitidos', df_emi)
+
+            engine.escribir_hoja_base(writer, 'Base DIAN', resultado.get('df_dian_base', df_dian_raw))
+
+            if resultado.get('cambios') is not None:
+                engine.escribir_hoja_base(writer, 'Cambios desde cierre anterior', resultado['cambios'])
+    progreso(100, "Reporte generado.")
+
+def bases_reporte(resultado):
+    """{hoja 'Base ...': función que devuelve los bloques de la base}, en el orden del libro."""
+    bases = resultado.get('bases_por_bloques')
+    if not bases:
+        bases = {'Base Contable Depurada': lambda: iter([resultado['df_cont_full']])}
+        if resultado['df_emi'] is not None: bases['Base Gosocket Emitidos'] = lambda: iter([resultado['df_emi']])
+        bases['Base DIAN'] = lambda: iter([resultado.get('df_dian_base', resultado['df_dian_raw'])])
+    if resultado.get('cambios') is not None:
+        bases = dict(bases, **{'Cambios desde cierre anterior': lambda: iter([resultado['cambios']])})
+    return bases
+
+def exportar_parquet(resultado, destino, progreso=None, trabajadores=None):
+    """
+    Alternativa a escribir_reporte: detalle de conciliación y bases como
+    datasets Parquet particionados más un libro de resumen (ver exportacion).
+    Devuelve la ruta del resumen.
+    """
+    progreso = progreso or _sin_progreso
+    trabajadores = trabajadores or resultado.get('trabajadores') or TRABAJADORES_DEFECTO
+    tiempos = resultado.setdefault('tiempos', {})
+    progreso(85, "Exportando a Parquet...")
+    with _cronometro(tiempos, 'preparar_hojas'):
+        tablas = preparar_hojas(resultado, trabajadores, exportacion.COLUMNAS_CONCILIACION)
+    por_cruce = {nombre: tablas[hoja] for nombre, hoja, *_ in hojas_reporte(resultado['df_dian_raw'])}
+    with _cronometro(tiempos, 'escribir_parquet'):
+        ruta = exportacion.exportar(por_cruce, bases_reporte(resultado), destino)
+    progreso(100, "Exportación generada.")
+    return ruta
+
+def ejecutar(ruta_dian, ruta_cont, dir_salida, ruta_emi=None, ruta_rec=None, progreso=None, probables=False, por_monto=False,
+             bloques=False, filas_por_bloque=por_bloques.FILAS_POR_BLOQUE, limite_mb=por_bloques.LIMITE_MB_DEFECTO, trabajadores=None,
+             estado=None, formato='excel'):
+    """
+    Concilia archivos en disco y escribe el reporte en `dir_salida`. Devuelve la ruta del reporte.
+    Con `bloques` usa conciliar_por_bloques (los libros se leen desde la ruta, sin cargarlos en memoria).
+    Con `estado` concilia de forma incremental contra el último cierre guardado allí.
+    Con `formato='parquet'` escribe datasets Parquet y devuelve la ruta del libro de resumen.
+    Al final `progreso` recibe los segundos de cada etapa.
+    """
+    if bloques:
+        resultado = conciliar_por_bloques(
+            ruta_dian, ruta_cont, abrir_entrada(ruta_emi), abrir_entrada(ruta_rec), progreso, probables, por_monto,
+            filas_por_bloque, limite_mb,
+        )
+    else:
+        resultado = conciliar(
+            abrir_entrada(ruta_dian), abrir_entrada(ruta_cont),
+            abrir_entrada(ruta_emi), abrir_entrada(ruta_rec), progreso, probables, por_monto, trabajadores, estado,
+        )
+    os.makedirs(dir_salida, exist_ok=True)
+    try:
+        if formato == 'parquet':
+            ruta_reporte = exportar_parquet(resultado, dir_salida, progreso)
+        else:
+            ruta_reporte = os.path.join(dir_salida, NOMBRE_REPORTE)
+            escribir_reporte(resultado, ruta_reporte, progreso)
+    finally:
+        limpiar_resultado(resultado)
+    engine.normalizador_empresas().guardar()
+    (progreso or _sin_progreso)(100, resumen_tiempos(resultado.get('tiempos', {})))
+    return ruta_reporte
+
+def memoria_al_leer(**bases):
+    """{base: (MB antes, MB después)} de la tipificación hecha por los lectores (engine.tipar_columnas)."""
+    return {nombre: tuple(df.attrs['memoria_mb']) for nombre, df in bases.items() if df is not None and 'memoria_mb' in df.attrs}
+
+def resumen_memoria(memoria):
+    """'DIAN 812 -> 164 MB · ...'"""
+    return ' · '.join(f'{nombre} {antes:,.0f} -> {despues:,.0f} MB' for nombre, (antes, despues) in memoria.items())
+
+def resumen_tiempos(tiempos):
+    """'lectura 4.2 s · cruces 1.3 s · ...' en el orden en que corrieron las etapas."""
+    return ' · '.join(f'{etapa} {seg:.1f} s' for etapa, seg in tiempos.items()) or 'sin tiempos registrados'
+
+def _sin_tildes(texto):
+    return texto.lower().translate(str.maketrans('áéíóúñ', 'aeioun'))
+
+def ubicar_archivos(carpeta):
+    """Asocia cada archivo Excel de la carpeta a su rol según PATRONES_ARCHIVOS."""
+    encontrados = {}
+    for nombre in sorted(os.listdir(carpeta)):
+        if not nombre.lower().endswith(EXTENSIONES_EXCEL) or nombre.startswith('~$'): continue
+        if nombre == NOMBRE_REPORTE: continue
+        base = _sin_tildes(nombre)
+        for rol, patrones in PATRONES_ARCHIVOS.items():
+            if rol not in encontrados and any(p in base for p in patrones):
+                encontrados[rol] = os.path.join(carpeta, nombre)
+                break
+    return encontrados
+
+def ejecutar_lote(carpetas, dir_salida, progreso=None, probables=False, por_monto=False, estado=None, **opciones):
+    """
+    Concilia varias carpetas empresa/periodo en el mismo proceso. Devuelve {carpeta: ruta_reporte | Exception}.
+    Con `estado`, cada carpeta guarda su cierre en `estado/<nombre de la carpeta>`.
+    """
+    resultados = {}
+    for carpeta in carpetas:
+        nombre = os.path.basename(os.path.normpath(carpeta))
+        if estado: opciones['estado'] = os.path.join(estado, nombre)
+        archivos = ubicar_archivos(carpeta)
+        faltantes = [r for r in ('dian', 'contabilidad') if r not in archivos]
+        if faltantes:
+            resultados[carpeta] = FileNotFoundError(f"Faltan archivos obligatorios ({', '.join(faltantes)}) en {carpeta}")
+            continue
+        try:
+            resultados[carpeta] = ejecutar(
+                archivos['dian'], archivos['contabilidad'], os.path.join(dir_salida, nombre),
+                archivos.get('emitidos'), archivos.get('recibidos'), progreso, probables, por_monto, **opciones,
+            )
+        except Exception as e:
+            resultados[carpeta] = e
+    return resultados
+
+def _guardar_registro(corrida, directorio):
+    try:
+        print(f'Registro de la corrida: {corrida.guardar(directorio)}')
+    except OSError as e:
+        print(f'No se pudo guardar el registro de la corrida: {e}', file=sys.stderr)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--dian', help='Excel descargado de la DIAN')
+    parser.add_argument('--contabilidad', help='Auxiliar contable unificado de Netsuite')
+    parser.add_argument('--emitidos', help='Gosocket emitidos (opcional)')
+    parser.add_argument('--recibidos', help='Gosocket recibidos (opcional)')
+    parser.add_argument('--lote', nargs='+', metavar='CARPETA', help='Carpetas con subcarpetas empresa/periodo, o las subcarpetas mismas')
+    parser.add_argument('--salida', required=True, help='Directorio donde se escriben los reportes')
+    parser.add_argument('--silencioso', action='store_true', help='No imprime el avance por etapa')
+    parser.add_argument('--probables', action='store_true', help='Busca coincidencias probables (folios casi iguales) entre los sobrantes')
+    parser.add_argument('--por-monto', action='store_true', help='Empareja sobrantes sin referencia por NIT, monto y fecha (incluye sumas de varias líneas)')
+    parser.add_argument('--por-bloques', action='store_true', help='Lee y cruza por bloques con memoria acotada (exportaciones de varios años)')
+    parser.add_argument('--filas-por-bloque', type=int, default=por_bloques.FILAS_POR_BLOQUE, help='Filas leídas por bloque en --por-bloques')
+    parser.add_argument('--limite-mb', type=float, default=por_bloques.LIMITE_MB_DEFECTO, help='Memoria máxima del proceso en --por-bloques')
+    parser.add_argument('--trabajadores', type=int, default=TRABAJADORES_DEFECTO, help='Procesos para los cuatro cruces y la preparación de hojas (1 = secuencial)')
+    parser.add_argument('--formato', choices=('excel', 'parquet'), default='excel', help='parquet: detalle y bases como datasets Parquet particionados por tipo y periodo, más un Excel de resumen')
+    parser.add_argument('--estado', help='Directorio del estado del último cierre: solo se cruzan los documentos nuevos o modificados')
+    parser.add_argument('--registros', default=perfilado.DIR_REGISTROS_DEFECTO, help='Directorio del registro JSON de cada corrida (tiempos, filas y memoria por función)')
+    parser.add_argument('--perfil', choices=('cprofile', 'pyinstrument'), default=perfilado.PERFIL_CPU_DEFECTO, help='Guarda además un perfil de CPU de la corrida')
+    parser.add_argument('--memoria-detallada', action='store_true', help='Mide con tracemalloc la memoria de cada función (más lento)')
+    parser.add_argument('--backend', choices=engine.BACKENDS_TEXTO, default=engine.BACKEND_TEXTO, help='Tipo de texto para construir llaves y limpiar NIT (arrow: kernels de pyarrow)')
+    parser.add_argument('--sin-cache', action='store_true', help='No usa la caché en disco de archivos ya leídos')
+    parser.add_argument('--empresas', default=engine.RUTA_EMPRESAS_DEFECTO, help='Diccionario JSON nombre -> EMPRESA_GRUPO (con alias manuales)')
+    args = parser.parse_args(argv)
+
+    if not args.sin_cache:
+        engine.configurar_cache(cache_disco.cache_por_contenido(engine.VERSION_LECTORES))
+    engine.configurar_normalizador_empresas(args.empresas)
+    engine.configurar_backend(args.backend)
+    perfilado.instrumentar()
+    corrida = perfilado.Corrida(args.perfil, args.memoria_detallada, parametros={k: v for k, v in vars(args).items() if v is not None})
+
+    def progreso(pct, mensaje):
+        if not args.silencioso: print(f'  [{pct:>3}%] {mensaje}', flush=True)
+
+    opciones = {'bloques': args.por_bloques, 'filas_por_bloque': args.filas_por_bloque, 'limite_mb': args.limite_mb, 'trabajadores': args.trabajadores, 'estado': args.estado, 'formato': args.formato}
+
+    if args.lote:
+        carpetas = []
+        for raiz in args.lote:
+            subcarpetas = sorted(os.path.join(raiz, d) for d in os.listdir(raiz) if os.path.isdir(os.path.join(raiz, d)))
+            carpetas.extend(subcarpetas or [raiz])
+        inicio = time.perf_counter()
+        with corrida:
+            resultados = ejecutar_lote(carpetas, args.salida, progreso, args.probables, args.por_monto, **opciones)
+        _guardar_registro(corrida, args.registros)
+        errores = 0
+        for carpeta, res in resultados.items():
+            if isinstance(res, Exception):
+                errores += 1
+                print(f'ERROR  {carpeta}: {res}', file=sys.stderr)
+            else:
+                print(f'OK     {carpeta} -> {res}')
+        print(f'{len(resultados) - errores}/{len(resultados)} conciliaciones en {time.perf_counter() - inicio:.1f} s')
+        return 1 if errores else 0
+
+    if not args.dian or not args.contabilidad:
+        parser.error('--dian y --contabilidad son obligatorios (o use --lote)')
+    with corrida:
+        ruta = ejecutar(args.dian, args.contabilidad, args.salida, args.emitidos, args.recibidos, progreso, args.probables, args.por_monto, **opciones)
+    _guardar_registro(corrida, args.registros)
+    print(f'Reporte: {ruta}')
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,152 @@
+"""
+Lectura por bloques y particionado en disco para exportaciones de varios años.
+
+Los libros se recorren en streaming (calamine, o openpyxl read-only de
+respaldo) de a `filas_por_bloque` filas. Cada bloque se reduce a las
+columnas que usan los cruces (montos en float64, textos repetidos como
+categorías) y se reparte en NUM_CUBETAS
+archivos Parquet según el hash de la llave de conciliación: una llave cae en
+la misma cubeta en DIAN y en contabilidad, así que cruzar cubeta por cubeta da
+el mismo resultado que cruzar todo junto. Las bases completas se guardan
+aparte, en el orden original, para escribir las hojas 'Base ...' por bloques.
+"""
+import glob
+import os
+import shutil
+import sys
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+import engine
+
+FILAS_POR_BLOQUE = 100_000
+NUM_CUBETAS = 64
+LIMITE_MB_DEFECTO = float(os.environ.get('CONCILIADOR_LIMITE_MB', 2048))
+# Memoria aproximada de una cubeta ya cargada respecto a su tamaño en Parquet
+FACTOR_MEMORIA_PARQUET = 8
+
+# Bases que se reparten en cubetas
+LADOS = ('dian', 'contabilidad', 'emitidos')
+COLUMNAS_CONTABILIDAD = ('u_ref', 'u_infoco01', 'u_cardname', 'u_acctname', 'CODIGO_CUENTA', 'u_saldo_f', 'Fecha')
+COLUMNAS_CATEGORIA_CONTABILIDAD = ('u_cardname', 'u_acctname', 'CODIGO_CUENTA')
+
+def memoria_actual_mb():
+    """RSS actual del proceso (Linux); None donde no se puede medir sin dependencias."""
+    try:
+        with open('/proc/self/statm') as f: paginas = int(f.read().split()[1])
+        return paginas * os.sysconf('SC_PAGE_SIZE') / 2**20
+    except (OSError, ValueError, AttributeError):
+        return None
+
+def memoria_pico_mb():
+    try: import resource
+    except ImportError: return None
+    pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return pico / 2**20 if sys.platform == 'darwin' else pico / 1024
+
+def leer_excel_por_bloques(file_obj, filas_por_bloque=FILAS_POR_BLOQUE, columnas_clave=None, filas_busqueda=20):
+    """Bloques de la primera hoja (ver engine.leer_hoja_por_bloques)."""
+    return engine.leer_hoja_por_bloques(file_obj, filas_por_bloque, columnas_clave, filas_busqueda)
+
+def _como_texto_excel(serie):
+    """Lo mismo que read_excel(dtype=str): números enteros sin '.0' y vacíos como NaN."""
+    def texto(v):
+        if v is None or isinstance(v, str): return v
+        if isinstance(v, float):
+            if np.isnan(v): return None
+            if v.is_integer(): return str(int(v))
+        return str(v)
+    return serie.map(texto)
+
+def _texto_o_nulo(serie):
+    s = serie.astype(object)
+    con_valor = s.notna()
+    s[con_valor] = s[con_valor].astype(str)
+    return s
+
+def normalizar_bloque_dian(bloque):
+    """Bloque crudo de la DIAN -> (bloque del motor, bloque de la base), igual que leer_dian + engine.separar_dian."""
+    return engine.separar_dian(engine.normalizar_dian(bloque.apply(_como_texto_excel)))
+
+def reducir_contabilidad(df):
+    cols = [c for c in COLUMNAS_CONTABILIDAD if c in df.columns]
+    red = df[cols].copy()
+    for c in cols:
+        if c == 'u_saldo_f': continue
+        red[c] = _texto_o_nulo(red[c])
+        if c in COLUMNAS_CATEGORIA_CONTABILIDAD: red[c] = red[c].astype('category')
+    return red
+
+def cubeta_de_llave(llaves):
+    if llaves is None: return None
+    return (pd.util.hash_array(np.asarray(llaves, dtype=object)) % NUM_CUBETAS).astype(np.int64)
+
+def unir_particiones(partes):
+    """Concatena los resultados de cada partición; las categorías vuelven a texto para el reporte."""
+    if not partes: return pd.DataFrame()
+    return engine.categorias_a_texto(pd.concat(partes, ignore_index=True))
+
+class Particionador:
+    """Directorio temporal con las cubetas por llave y las bases completas en orden."""
+    def __init__(self, dir_trabajo=None):
+        self.dir = tempfile.mkdtemp(prefix='conciliador_', dir=dir_trabajo)
+        self.pico_mb = 0.0
+
+    def _ruta(self, *partes):
+        ruta = os.path.join(self.dir, *partes)
+        os.makedirs(os.path.dirname(ruta), exist_ok=True)
+        return ruta
+
+    def guardar_base(self, nombre, n, df):
+        df.to_pickle(self._ruta('base', nombre, f'{n:06d}.pkl'))
+
+    def bloques_base(self, nombre):
+        for ruta in sorted(glob.glob(os.path.join(self.dir, 'base', nombre, '*.pkl'))):
+            yield pd.read_pickle(ruta)
+
+    def repartir(self, lado, n, df, cubetas):
+        """Reparte el bloque reducido por cubeta (sin llave, todo a la cubeta 0)."""
+        if df.empty: return
+        if cubetas is None: cubetas = np.zeros(len(df), dtype=np.int64)
+        for cubeta, parte in df.groupby(np.asarray(cubetas), sort=True):
+            parte.to_parquet(self._ruta(lado, f'{cubeta:03d}', f'{n:06d}.parquet'), index=False)
+
+    def _archivos(self, lado, cubeta):
+        return sorted(glob.glob(os.path.join(self.dir, lado, f'{cubeta:03d}', '*.parquet')))
+
+    def leer(self, lado, cubetas):
+        partes = [pd.read_parquet(r) for c in cubetas for r in self._archivos(lado, c)]
+        if not partes: return pd.DataFrame()
+        return pd.concat(partes, ignore_index=True)
+
+    def grupos(self, limite_mb):
+        """Cubetas consecutivas agrupadas para que cada grupo cargado quepa en la mitad del límite."""
+        presupuesto = limite_mb * 2**20 / 2
+        grupo, estimado = [], 0
+        for cubeta in range(NUM_CUBETAS):
+            tam = sum(os.path.getsize(r) for lado in LADOS for r in self._archivos(lado, cubeta))
+            if tam == 0: continue
+            tam *= FACTOR_MEMORIA_PARQUET
+            if grupo and estimado + tam > presupuesto:
+                yield grupo
+                grupo, estimado = [], 0
+            grupo.append(cubeta)
+            estimado += tam
+        if grupo: yield grupo
+
+    def vigilar(self, limite_mb):
+        """Registra el pico de memoria y corta si el proceso supera el límite."""
+        actual = memoria_actual_mb()
+        if actual is None: return
+        self.pico_mb = max(self.pico_mb, actual)
+        if actual > limite_mb:
+            raise MemoryError(f"Memoria en uso {actual:.0f} MB supera el límite de {limite_mb:.0f} MB; reduzca las filas por bloque.")
+
+    def memoria(self, limite_mb):
+        pico = memoria_pico_mb()
+        return {'pico_mb': max(self.pico_mb, pico or 0.0) or None, 'limite_mb': limite_mb}
+
+    def limpiar(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
@@ -0,0 +1 @@
+"""Pruebas de equivalencia del conciliador (python -m pytest tests)."""
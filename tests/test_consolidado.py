@@ -0,0 +1,61 @@
+"""
+conciliar_consolidado con `estado`: en una segunda corrida con dos periodos
+donde solo cambia uno, solo esa partición se recruza y la otra conserva su
+resumen. La diferencia por mes no incluye Gosocket (no tiene valores).
+"""
+import warnings
+
+import pandas as pd
+import pytest
+
+import consolidado
+import engine
+from benchmarks.generadores import generar_conjunto
+
+PERIODOS = ('2024-01', '2024-02')
+
+@pytest.fixture(scope='module')
+def lecturas(tmp_path_factory):
+    carpeta = tmp_path_factory.mktemp('consolidado')
+    generar_conjunto(str(carpeta), filas_cont=600)
+    partes = consolidado.leer_carpeta(str(carpeta))
+    return tuple(df[df['PERIODO'].isin(PERIODOS)].reset_index(drop=True) for df in partes)
+
+def _consolidar(monkeypatch, partes, estado):
+    monkeypatch.setattr(consolidado, 'leer_carpeta', lambda carpeta: tuple(df.copy() for df in partes))
+    return consolidado.conciliar_consolidado(['carpeta'], trabajadores=1, estado=estado)
+
+def test_solo_se_recruza_el_periodo_que_cambia(monkeypatch, lecturas, tmp_path):
+    estado = str(tmp_path / 'estado')
+    resumen, particiones = _consolidar(monkeypatch, lecturas, estado)
+    assert particiones['PERIODO'].tolist() == list(PERIODOS) and particiones['RECALCULADA'].all()
+
+    _, particiones = _consolidar(monkeypatch, lecturas, estado)
+    assert not particiones['RECALCULADA'].any()
+
+    df_dian, df_cont, df_emi = lecturas
+    df_cont = df_cont.copy()
+    fila = df_cont.index[df_cont['PERIODO'] == PERIODOS[1]][0]
+    df_cont.loc[fila, 'u_saldo_f'] += 1_000
+    segundo, particiones = _consolidar(monkeypatch, (df_dian, df_cont, df_emi), estado)
+    assert dict(zip(particiones['PERIODO'], particiones['RECALCULADA'])) == {PERIODOS[0]: False, PERIODOS[1]: True}
+
+    igual = resumen['PERIODO'] == PERIODOS[0]
+    pd.testing.assert_frame_equal(segundo[igual], resumen[igual])
+
+def test_diferencia_por_mes_sin_gosocket(monkeypatch, lecturas, tmp_path):
+    resumen, particiones = _consolidar(monkeypatch, lecturas, None)
+    assert 'gosocket' in set(resumen['CRUCE'])
+    ruta = consolidado.escribir_resumen(resumen, particiones, str(tmp_path / consolidado.NOMBRE_RESUMEN))
+    por_mes = pd.read_excel(ruta, sheet_name='Diferencia por mes')
+    assert 'gosocket' not in set(por_mes['CRUCE'])
+    assert set(por_mes['CRUCE']) == set(resumen.loc[resumen['DIFERENCIA'].notna(), 'CRUCE'])
+
+def test_nit_de_carpeta_avisa_si_hay_varias_entidades():
+    nits = pd.Series(['900', '900', '800', consolidado.SIN_NIT])
+    with pytest.warns(engine.AvisoConciliador, match='2 NIT'):
+        assert consolidado._nit_mas_frecuente(nits, 'cierre') == '900'
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        assert consolidado._nit_mas_frecuente(pd.Series(['900', consolidado.SIN_NIT])) == '900'
+        assert consolidado._nit_mas_frecuente(pd.Series([consolidado.SIN_NIT])) == consolidado.SIN_NIT
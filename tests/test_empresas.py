@@ -0,0 +1,24 @@
+"""standardize_company_name: limpieza por nombre distinto, alias y nombres nulos."""
+import numpy as np
+import pandas as pd
+import pytest
+
+import engine
+
+@pytest.mark.parametrize('dtype', [object, 'str'])
+def test_nulos_quedan_sin_nombre(dtype):
+    nombres = pd.Series(['Acme SAS', np.nan, 'Beta LTDA', None, 'Acme S.A.S.'], index=[10, 11, 12, 13, 14], dtype=dtype)
+    grupos = engine.standardize_company_name(nombres, engine.NormalizadorEmpresas())
+    assert grupos.tolist() == ['ACME', 'SIN NOMBRE', 'BETA', 'SIN NOMBRE', 'ACME']
+    assert grupos.index.tolist() == [10, 11, 12, 13, 14]
+
+def test_alias_y_nombres_repetidos():
+    normalizador = engine.NormalizadorEmpresas()
+    normalizador.agregar_alias('BETA', 'GRUPO BETA')
+    grupos = engine.standardize_company_name(pd.Series(['Beta LTDA', 'beta', 'Gamma SA'] * 3), normalizador)
+    assert grupos.tolist() == ['GRUPO BETA', 'GRUPO BETA', 'GAMMA'] * 3
+    assert len(normalizador.nombres) == 3
+
+def test_solo_nulos():
+    grupos = engine.standardize_company_name(pd.Series([np.nan, None]), engine.NormalizadorEmpresas())
+    assert grupos.tolist() == ['SIN NOMBRE', 'SIN NOMBRE']
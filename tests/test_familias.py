@@ -0,0 +1,45 @@
+"""Familias de cuentas: filtrar_solo_* y mascara_* con las etiquetas ya calculadas."""
+import numpy as np
+import pandas as pd
+import pytest
+
+import engine
+
+@pytest.fixture
+def auxiliar():
+    return pd.DataFrame({
+        'CODIGO_CUENTA': ['51350501', '41350501', '24080101', '24080201', '51157001', '11050501'],
+        'u_acctname': ['Servicios', 'Ventas', 'IVA descontable', 'IVA generado', 'Gasto excluido', 'Caja'],
+        'u_ref': ['FE1', 'FV1', 'FE1', 'FV1', 'FE2', 'RC1'],
+        'u_saldo_f': [100.0, -200.0, 19.0, -38.0, 5.0, 1.0],
+    })
+
+FAMILIAS = [
+    (engine.filtrar_solo_gastos, engine.mascara_gastos, [0], 1),
+    (engine.filtrar_solo_ingresos, engine.mascara_ingresos, [1], -1),
+    (engine.filtrar_solo_iva_descontable, engine.mascara_iva_descontable, [2], 1),
+    (engine.filtrar_solo_iva_generado, engine.mascara_iva_generado, [3], -1),
+]
+
+@pytest.mark.parametrize('filtrar, mascara, filas, signo', FAMILIAS)
+def test_con_etiquetas_no_reclasifica(auxiliar, monkeypatch, filtrar, mascara, filas, signo):
+    preparada = engine.ContabilidadPreparada(auxiliar)
+    etiquetas = preparada.etiquetas
+    def no_reclasificar(*args, **kwargs): raise AssertionError('clasificar_cuentas no debía llamarse')
+    monkeypatch.setattr(engine, 'clasificar_cuentas', no_reclasificar)
+    assert np.flatnonzero(mascara(auxiliar, etiquetas)).tolist() == filas
+    df = filtrar(auxiliar, etiquetas)
+    assert df.index.tolist() == filas
+    assert df['u_saldo_f'].tolist() == (auxiliar['u_saldo_f'].iloc[filas] * signo).tolist()
+
+@pytest.mark.parametrize('filtrar, mascara, filas, signo', FAMILIAS)
+def test_sin_etiquetas_igual_y_sin_modificar_el_auxiliar(auxiliar, filtrar, mascara, filas, signo):
+    original = auxiliar.copy()
+    etiquetas = engine.clasificar_cuentas(auxiliar)
+    pd.testing.assert_frame_equal(filtrar(auxiliar), filtrar(auxiliar, etiquetas))
+    assert mascara(auxiliar).tolist() == mascara(auxiliar, etiquetas).tolist()
+    pd.testing.assert_frame_equal(auxiliar, original)
+
+def test_auxiliar_vacio():
+    assert engine.filtrar_solo_gastos(pd.DataFrame()).empty
+    assert engine.filtrar_solo_ingresos(None).empty
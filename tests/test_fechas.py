@@ -0,0 +1,39 @@
+"""
+convertir_fechas y la tipificación de la DIAN: ISO con y sin hora se lee
+primero y dd/mm/aaaa solo como respaldo; la base para la hoja 'Base DIAN'
+conserva el texto original.
+"""
+import pandas as pd
+
+import engine
+
+FECHAS = ['2024-01-05', '2024-06-07 00:00:00', '05/01/2024', '13/02/2024', '07/06/2024 10:30', None, 'sin fecha']
+ESPERADAS = ['2024-01-05', '2024-06-07', '2024-01-05', '2024-02-13', '2024-06-07', None, None]
+
+def _esperadas():
+    return pd.to_datetime(pd.Series(ESPERADAS)).dt.normalize()
+
+def test_iso_y_dia_primero():
+    for dtype in ('str', object):
+        fechas = engine.convertir_fechas(pd.Series(FECHAS, dtype=dtype))
+        pd.testing.assert_series_equal(fechas.dt.normalize(), _esperadas(), check_dtype=False)
+
+def test_columna_solo_iso_no_invierte_mes():
+    fechas = engine.convertir_fechas(pd.Series(['2024-01-05', '2024-02-03', '2024-12-11']))
+    assert fechas.dt.month.tolist() == [1, 2, 12]
+
+def test_periodo_de_fechas():
+    assert engine.periodo_de_fechas(pd.Series(FECHAS)).tolist() == [
+        '2024-01', '2024-06', '2024-01', '2024-02', '2024-06', engine.SIN_PERIODO, engine.SIN_PERIODO]
+
+def test_dian_motor_tipado_y_base_con_texto_original():
+    crudo = pd.DataFrame({
+        'Prefijo': ['FE', 'FE', 'SE'], 'Folio': ['1', '2', '3'],
+        'Fecha Emisión': ['2024-01-05', '05/01/2024', '2024-06-07 00:00:00'],
+        'Total': ['1000.5', '2000', '300'], 'NIT Emisor': ['900.123.456', '800123', '123'],
+    }, dtype=str)
+    motor, base = engine.separar_dian(engine.normalizar_dian(crudo.copy()))
+    col_fecha = next(c for c in motor.columns if 'fecha' in c)
+    assert motor[col_fecha].dt.strftime('%Y-%m-%d').tolist() == ['2024-01-05', '2024-01-05', '2024-06-07']
+    for columna, original in zip(base.columns, crudo.columns):
+        assert base[columna].astype(object).tolist() == crudo[original].astype(object).tolist()
@@ -0,0 +1,59 @@
+"""conciliar_incremental: una segunda corrida igual no recruza nada; una llave modificada se recruza sola y se marca."""
+import pytest
+
+import engine
+import incremental
+import pipeline
+from benchmarks.generadores import generar_cruce_en_memoria
+
+LLAVE = engine.LLAVE_DIAN_CONT_COL_NAME
+
+@pytest.fixture
+def bases():
+    return generar_cruce_en_memoria(400, semilla=3)
+
+def _cruzar_contando(llamadas):
+    def cruzar(df_dian, df_cont):
+        llamadas.append(set(df_dian[LLAVE]) | set(engine.normalizar_llave(df_cont['u_ref'])))
+        return pipeline.cruzar_bases(df_dian, df_cont)[0]
+    return cruzar
+
+def _llaves(cruces, nombre, parte):
+    df = cruces[nombre][incremental.PARTES_CRUCE.index(parte)]
+    return sorted(df[incremental.LLAVE_PARTE[parte]].astype(str)) if not df.empty else []
+
+def test_segunda_corrida_igual_no_recruza(bases, tmp_path):
+    df_dian, df_cont = bases
+    estado = incremental.EstadoConciliacion(str(tmp_path / 'estado'))
+    llamadas = []
+    primera, cambios, resumen = incremental.conciliar_incremental(df_dian.copy(), df_cont.copy(), estado, _cruzar_contando(llamadas))
+    assert resumen['modo'] == 'completo' and cambios is None and len(llamadas) == 1
+
+    segunda, cambios, resumen = incremental.conciliar_incremental(df_dian.copy(), df_cont.copy(), estado, _cruzar_contando(llamadas))
+    assert resumen['modo'] == 'incremental'
+    assert resumen['recruzadas'] == 0 and resumen['eliminadas'] == 0
+    assert len(llamadas) == 1 and cambios.empty
+    for nombre in incremental.NOMBRES_CRUCES:
+        for parte in incremental.PARTES_CRUCE:
+            assert _llaves(segunda, nombre, parte) == _llaves(primera, nombre, parte)
+
+def test_llave_modificada_se_recruza_y_lleva_cambio(bases, tmp_path):
+    df_dian, df_cont = bases
+    estado = incremental.EstadoConciliacion(str(tmp_path / 'estado'))
+    incremental.conciliar_incremental(df_dian.copy(), df_cont.copy(), estado, _cruzar_contando([]))
+
+    coincide = df_dian[LLAVE].isin(engine.normalizar_llave(df_cont['u_ref']))
+    llave = df_dian.loc[coincide, LLAVE].iloc[0]
+    modificada = df_dian.copy()
+    modificada.loc[modificada[LLAVE] == llave, 'total'] = '123.45'
+    llamadas = []
+    cruces, cambios, resumen = incremental.conciliar_incremental(modificada, df_cont.copy(), estado, _cruzar_contando(llamadas))
+    assert resumen['recruzadas'] == 1
+    assert llamadas == [{llave}]
+
+    coin = cruces['gastos'][0]
+    assert 'CAMBIO' in coin.columns
+    assert set(coin.loc[coin[LLAVE] == llave, 'CAMBIO']) == {'MODIFICADO'}
+    assert set(coin.loc[coin[LLAVE] != llave, 'CAMBIO']) == {''}
+    assert set(cambios['LLAVE']) == {llave}
+    assert set(cambios['CAMBIO']) == {'MODIFICADO'}
@@ -0,0 +1,57 @@
+"""
+leer_hoja_con_encabezado: el encabezado se ubica en las primeras filas y la
+tabla sale igual que leyendo la hoja completa sin encabezado y cortándola en
+esa fila, con calamine, con el respaldo openpyxl y armada en bloques pequeños.
+"""
+import io
+
+import pandas as pd
+import pytest
+
+import engine
+from benchmarks import generadores
+
+@pytest.fixture(scope='module')
+def auxiliar(tmp_path_factory):
+    return generadores.generar_auxiliar_netsuite(str(tmp_path_factory.mktemp('aux') / 'auxiliar.xlsx'), filas=600, semilla=2)
+
+def _abrir(ruta):
+    with open(ruta, 'rb') as f: return f.read()
+
+def _esperado(ruta):
+    # Hoja completa sin encabezado: 3 filas de título, una vacía y el encabezado en la fila 4
+    crudo = pd.read_excel(ruta, header=None, engine='calamine')
+    df = crudo.iloc[5:].reset_index(drop=True)
+    df.columns = engine.nombres_encabezado(crudo.iloc[4].tolist())
+    return df.infer_objects()
+
+def test_encabezado_y_tabla_como_read_excel(auxiliar):
+    df = engine.leer_hoja_con_encabezado(io.BytesIO(_abrir(auxiliar)))
+    pd.testing.assert_frame_equal(df, _esperado(auxiliar))
+
+def test_respaldo_openpyxl(auxiliar, monkeypatch):
+    import python_calamine
+    esperado = _esperado(auxiliar)
+    def sin_calamine(*args, **kwargs): raise ValueError('calamine no disponible')
+    monkeypatch.setattr(python_calamine, 'load_workbook', sin_calamine)
+    df = engine.leer_hoja_con_encabezado(io.BytesIO(_abrir(auxiliar)))
+    pd.testing.assert_frame_equal(df, esperado, check_dtype=False)
+
+def test_bloques_pequenos(auxiliar):
+    bloques = list(engine.leer_hoja_por_bloques(io.BytesIO(_abrir(auxiliar)), 50, columnas_clave=('Cuenta', 'Fecha')))
+    assert len(bloques) > 10 and all(len(b) <= 50 for b in bloques)
+    pd.testing.assert_frame_equal(pd.concat(bloques, ignore_index=True), _esperado(auxiliar), check_dtype=False)
+
+def test_solo_se_miran_las_filas_iniciales(auxiliar, monkeypatch):
+    # Sin columnas clave en las primeras filas se usa la fila 0, sin recorrer más filas para buscarla
+    vistas = []
+    filas_hoja = engine._filas_hoja
+    def contar(file_obj):
+        for fila in filas_hoja(file_obj):
+            vistas.append(fila)
+            yield fila
+    monkeypatch.setattr(engine, '_filas_hoja', contar)
+    bloques = engine.leer_hoja_por_bloques(io.BytesIO(_abrir(auxiliar)), 100, columnas_clave=('No', 'Existe'), filas_busqueda=5)
+    primero = next(bloques)
+    assert list(primero.columns)[0] == 'CABIFY COLOMBIA SAS'
+    assert len(vistas) == 5 + 100 - 4
@@ -0,0 +1,64 @@
+"""
+limpiar_moneda_colombia_vectorizado frente a la función celda a celda
+limpiar_moneda_colombia: mismo resultado en los formatos de los auxiliares
+y en textos al azar.
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+import engine
+
+FORMATOS = [
+    # separador de miles con punto y coma decimal
+    '1.234.567,89', '1.234,5', '12.345', '0,50', '1234,56', '1234,5', '1,234',
+    # estilo EE. UU.
+    '1,234,567.89', '1,234.5', '1234.56', '.5', '5.',
+    # signo pesos y espacios
+    '$1.234,56', '$ 1.234,56', ' $ 1.234 ', '$-1.000,00', '- 1.000',
+    # negativos con paréntesis o signo al final
+    '(1.234,56)', '($1.234,56)', '1.234,56-', '1234-', '-1.234,56', '+12',
+    # vacíos y nulos
+    '', ' ', '\t', None, np.nan, pd.NaT,
+    # números ya convertidos por el lector
+    0, 15, -3, 1234.56, -0.5, 1e20, np.int64(7), np.float64(2.25),
+    # basura y formas raras que float() sí acepta
+    'abc', '1,23,45', '1..2', ',,', 'nan', 'inf', '-Infinity', '1e3', '1_000', '１２３', True, False,
+]
+
+def comparar(valores, dtype=object):
+    serie = pd.Series(valores, dtype=dtype)
+    esperado = serie.map(engine.limpiar_moneda_colombia).astype('float64')
+    obtenido = engine.limpiar_moneda_colombia_vectorizado(serie)
+    pd.testing.assert_series_equal(obtenido, esperado, check_names=False)
+
+@pytest.mark.parametrize('valor', FORMATOS, ids=repr)
+def test_formato_aislado(valor):
+    comparar([valor])
+
+def test_formatos_en_una_columna():
+    comparar(FORMATOS)
+
+@pytest.mark.parametrize('valores', [
+    [1.5, 2.0, np.nan],
+    [1, 2, 3],
+    ['1.000,00', '2.500,50', None],
+    [],
+], ids=['float', 'int', 'texto', 'vacia'])
+def test_columnas_homogeneas(valores):
+    comparar(valores, dtype=None if valores else 'float64')
+
+def test_indice_conservado():
+    serie = pd.Series(['1.000,50', 3, None], index=[10, 5, 7], dtype=object)
+    assert engine.limpiar_moneda_colombia_vectorizado(serie).index.tolist() == [10, 5, 7]
+
+ALFABETO = list('0123456789') * 3 + list('.,$ -+()eE\t') + ['nan', 'inf']
+
+@pytest.mark.parametrize('semilla', range(20))
+def test_textos_al_azar(semilla):
+    rng = np.random.default_rng(semilla)
+    textos = [''.join(rng.choice(ALFABETO, size=rng.integers(0, 14))) for _ in range(500)]
+    # mezcla con celdas numéricas y nulas, como sale de un Excel con formatos mixtos
+    mezcla = textos + list(rng.normal(0, 1e6, 50).round(2)) + [None, np.nan] * 10
+    rng.shuffle(mezcla)
+    comparar(mezcla)
@@ -0,0 +1,53 @@
+"""
+Backend de texto 'arrow' frente a 'pandas' sobre los datos sintéticos de
+benchmarks.paridad_backend (con referencias con tildes, eñes, nulos y
+números): mismas llaves, NIT, cruces y hojas del reporte.
+"""
+import pytest
+
+pytest.importorskip('pyarrow')
+
+import engine
+from benchmarks import paridad_backend
+
+@pytest.fixture(scope='module')
+def salidas():
+    original = engine.BACKEND_TEXTO
+    df_dian, df_cont = paridad_backend.fixtures(5_000)
+    try:
+        yield {b: paridad_backend.correr(b, df_dian, df_cont)[1] for b in engine.BACKENDS_TEXTO}
+    finally:
+        engine.configurar_backend(original)
+
+def test_mismas_salidas(salidas):
+    assert set(salidas['pandas']) == set(salidas['arrow'])
+
+@pytest.mark.parametrize('nombre', ['llave_dian', 'llave_cont', 'nit'])
+def test_llaves_identicas(salidas, nombre):
+    assert paridad_backend.diferencias({nombre: salidas['pandas'][nombre]}, salidas['arrow']) == []
+
+def test_cruces_identicos(salidas):
+    cruces = {k: v for k, v in salidas['pandas'].items() if '.' in k and not k.startswith('llave')}
+    assert cruces and paridad_backend.diferencias(cruces, salidas['arrow']) == []
+
+def test_hojas_identicas(salidas):
+    hojas = {k: v for k, v in salidas['pandas'].items() if k[0].isdigit()}
+    assert hojas and paridad_backend.diferencias(hojas, salidas['arrow']) == []
+
+def test_llaves_conservan_unicode(salidas):
+    # \w de Python: las tildes y eñes siguen en la llave con los dos backends
+    for backend in engine.BACKENDS_TEXTO:
+        llaves = set(salidas[backend]['llave_cont'])
+        assert {'FÉ001', 'ÑANDÚ12', 'NAN'} <= llaves
+
+def test_sin_pyarrow_avisa_y_usa_pandas(monkeypatch):
+    original = engine.BACKEND_TEXTO
+    buscar = engine.importlib.util.find_spec
+    monkeypatch.setattr(engine.importlib.util, 'find_spec', lambda nombre, *a: None if nombre == 'pyarrow' else buscar(nombre, *a))
+    try:
+        with pytest.warns(engine.AvisoConciliador, match='pyarrow'):
+            engine.configurar_backend('arrow')
+        assert engine.BACKEND_TEXTO == 'pandas'
+    finally:
+        monkeypatch.undo()
+        engine.configurar_backend(original)
@@ -0,0 +1,56 @@
+"""
+perfilado.instrumentar y engine.configurar_cache en cualquier orden: los
+lectores quedan con la caché y se siguen midiendo en una Corrida, sin
+envolverse dos veces.
+"""
+import sys
+
+import pandas as pd
+import pytest
+
+import engine
+import perfilado
+
+@pytest.fixture
+def engine_restaurado():
+    originales = {nombre: getattr(engine, nombre) for nombre in perfilado.FUNCIONES_PERFILADAS}
+    try:
+        yield
+    finally:
+        for nombre, funcion in originales.items(): setattr(engine, nombre, funcion)
+
+def _cache_contando(llamadas):
+    def decorador(funcion):
+        def envoltura(archivo):
+            llamadas.append(funcion.__name__)
+            return pd.DataFrame({'a': range(3)})
+        return envoltura
+    return decorador
+
+@pytest.mark.parametrize('cache_primero', [True, False])
+def test_orden_de_cache_e_instrumentar(engine_restaurado, cache_primero):
+    llamadas = []
+    if cache_primero:
+        engine.configurar_cache(_cache_contando(llamadas))
+        perfilado.instrumentar()
+    else:
+        perfilado.instrumentar()
+        engine.configurar_cache(_cache_contando(llamadas))
+    assert getattr(engine.leer_gosocket, '__perfilada__', False)
+    assert not getattr(engine.leer_gosocket.__wrapped__, '__perfilada__', False)
+    with perfilado.Corrida() as corrida:
+        assert len(engine.leer_gosocket('archivo')) == 3
+    assert llamadas == ['leer_gosocket']
+    assert [(r['funcion'], r['filas_salida']) for r in corrida.registros] == [('leer_gosocket', 3)]
+
+def test_sin_cache_conserva_la_envoltura(engine_restaurado):
+    perfilado.instrumentar()
+    engine.configurar_cache()
+    assert engine.leer_dian.__wrapped__ is engine._LECTORES_ORIGINALES['leer_dian']
+
+def test_sin_pyinstrument_avisa_y_usa_cprofile(monkeypatch):
+    monkeypatch.setitem(sys.modules, 'pyinstrument', None)
+    with pytest.warns(engine.AvisoConciliador, match='pyinstrument'):
+        with perfilado.Corrida(perfil_cpu='pyinstrument') as corrida:
+            pass
+    assert corrida.perfil_cpu == 'cprofile'
@@ -0,0 +1,37 @@
+"""
+conciliar_por_bloques frente a conciliar sobre los mismos libros: mismas hojas
+del reporte, en el mismo orden, y el mismo cruce contra Gosocket emitidos.
+"""
+import pandas as pd
+import pytest
+
+import engine
+import pipeline
+from benchmarks import generadores
+
+@pytest.fixture(scope='module')
+def resultados(tmp_path_factory):
+    rutas = generadores.generar_conjunto(str(tmp_path_factory.mktemp('datos')), filas_cont=3_000, semilla=7)
+    entradas = lambda: [pipeline.abrir_entrada(rutas[rol]) for rol in ('dian', 'contabilidad', 'emitidos')]
+    normal = pipeline.conciliar(*entradas(), trabajadores=1)
+    por_bloques = pipeline.conciliar_por_bloques(*entradas(), filas_por_bloque=400)
+    try:
+        yield normal, por_bloques
+    finally:
+        pipeline.limpiar_resultado(por_bloques)
+
+def test_mismas_hojas_y_mismo_orden(resultados):
+    normal, por_bloques = resultados
+    hojas_normal, hojas_bloques = pipeline.preparar_hojas(normal), pipeline.preparar_hojas(por_bloques)
+    assert list(hojas_normal) == list(hojas_bloques)
+    for hoja, tabla in hojas_normal.items():
+        assert tabla is not None and len(tabla) > 1
+        pd.testing.assert_frame_equal(hojas_bloques[hoja], tabla, check_dtype=False, obj=hoja)
+
+@pytest.mark.parametrize('parte, llave', [(0, 'LLAVE_CONC'), (1, 'LLAVE_CONC'), (2, engine.LLAVE_SERIE_FOLIO_COL_NAME)])
+def test_mismo_cruce_gosocket(resultados, parte, llave):
+    normal, por_bloques = resultados
+    assert por_bloques['cruce_gosocket'] is not None
+    esperado, obtenido = normal['cruce_gosocket'][parte], por_bloques['cruce_gosocket'][parte]
+    assert not esperado.empty
+    assert sorted(obtenido[llave].astype(str)) == sorted(esperado[llave].astype(str))
@@ -0,0 +1,69 @@
+"""
+emparejar_por_monto_nit y _subconjunto_con_suma: una línea con el mismo monto,
+suma de varias líneas y presupuesto agotado (sin emparejar, nunca a medias).
+"""
+import pandas as pd
+
+import engine
+
+def test_subconjunto_de_dos_montos():
+    montos = [500.0, 300.0, 200.0, 700.0]
+    elegidos = engine._subconjunto_con_suma(montos, 1000.0, 1.0, 4, 5_000)
+    assert sorted(elegidos) == [1, 3]
+
+def test_subconjunto_negativo_y_tolerancia():
+    elegidos = engine._subconjunto_con_suma([-400.0, -250.5, -349.8], -600.0, 1.0, 4, 5_000)
+    assert sorted(elegidos) == [1, 2]
+
+def test_subconjunto_sin_solucion_o_sin_presupuesto():
+    montos = [600.0, 500.0, 400.0, 300.0, 150.0, 50.0]
+    assert sorted(engine._subconjunto_con_suma(montos, 200.0, 0.5, 4, 5_000)) == [4, 5]
+    assert engine._subconjunto_con_suma(montos, 200.0, 0.5, 4, 3) is None
+    assert engine._subconjunto_con_suma(montos, 1.0, 0.5, 4, 5_000) is None
+    # Un solo monto igual al objetivo no es una suma de varias líneas
+    assert engine._subconjunto_con_suma([200.0, 999.0], 200.0, 0.5, 4, 5_000) is None
+
+def _sobrantes(dian, cont):
+    sob_d = pd.DataFrame(dian, columns=['nit_emisor', 'fecha_emisión', 'total'])
+    sob_d[engine.LLAVE_DIAN_CONT_COL_NAME] = [f'DIAN{i}' for i in range(len(sob_d))]
+    sob_c = pd.DataFrame(cont, columns=['LLAVE_CONT', 'u_infoco01', 'Fecha', 'u_saldo_f'])
+    return sob_d, sob_c
+
+def test_una_linea_con_el_mismo_monto():
+    sob_d, sob_c = _sobrantes(
+        [('900.123.456', '05/01/2024', 1000.0)],
+        [('X1', '900123456', '2024-01-10', 1000.4), ('X2', '900123456', '2024-01-10', 999.0), ('X3', '800111222', '2024-01-05', 1000.0)])
+    coinc, resto_d, resto_c = engine.emparejar_por_monto_nit(sob_d, sob_c, 'total')
+    assert coinc['LLAVE_CONT'].tolist() == ['X1']
+    assert coinc['REGLA_PROBABLE'].tolist() == ['MONTO_NIT']
+    assert resto_d.empty
+    assert resto_c['LLAVE_CONT'].tolist() == ['X2', 'X3']
+
+def test_suma_de_dos_lineas():
+    sob_d, sob_c = _sobrantes(
+        [('900123456', '2024-01-05', 1000.0)],
+        [('X1', '900123456', '2024-01-06', 600.0), ('X2', '900123456', '2024-01-07', 400.0), ('X3', '900123456', '2024-01-07', 50.0)])
+    coinc, resto_d, resto_c = engine.emparejar_por_monto_nit(sob_d, sob_c, 'total')
+    assert coinc['REGLA_PROBABLE'].tolist() == ['SUMA_LINEAS']
+    assert coinc['LINEAS_CONT'].tolist() == [2]
+    assert coinc['LLAVE_CONT'].tolist() == ['X1 + X2']
+    assert coinc['u_saldo_f'].tolist() == [1000.0]
+    assert resto_c['LLAVE_CONT'].tolist() == ['X3']
+
+def test_fuera_de_la_ventana_de_fechas():
+    sob_d, sob_c = _sobrantes([('900123456', '2024-01-05', 1000.0)], [('X1', '900123456', '2024-06-30', 1000.0)])
+    coinc, resto_d, resto_c = engine.emparejar_por_monto_nit(sob_d, sob_c, 'total')
+    assert coinc.empty and len(resto_d) == 1 and len(resto_c) == 1
+
+def test_presupuesto_agotado_no_empareja_a_medias():
+    montos = [990.0, 980.0, 970.0, 960.0, 950.0, 940.0, 20.0, 10.0]
+    sob_d, sob_c = _sobrantes(
+        [('900123456', '2024-01-05', 1000.0)],
+        [(f'X{i}', '900123456', '2024-01-05', m) for i, m in enumerate(montos)])
+    coinc, resto_d, resto_c = engine.emparejar_por_monto_nit(sob_d, sob_c, 'total', tolerancia=0.5, presupuesto=3)
+    assert coinc.empty
+    pd.testing.assert_frame_equal(resto_d, sob_d)
+    pd.testing.assert_frame_equal(resto_c, sob_c)
+    coinc, _, resto_c = engine.emparejar_por_monto_nit(sob_d, sob_c, 'total', tolerancia=0.5)
+    assert coinc['LLAVE_CONT'].tolist() == ['X0 + X7']
+    assert len(resto_c) == len(montos) - 2
@@ -0,0 +1,67 @@
+"""
+emparejar_sobrantes_probables: pares dentro de la misma cubeta de NIT y monto,
+rechazo por distancia o monto y asignación 1 a 1 en empates. _distancias_osa
+frente a la versión de un par a la vez.
+"""
+import random
+
+import pandas as pd
+import pytest
+
+import engine
+
+def _osa(a, b):
+    """Referencia: distancia OSA de un solo par con la tabla completa."""
+    tabla = [[i + j if i == 0 or j == 0 else 0 for j in range(len(b) + 1)] for i in range(len(a) + 1)]
+    for i in range(1, len(a) + 1):
+        for j in range(1, len(b) + 1):
+            tabla[i][j] = min(tabla[i - 1][j] + 1, tabla[i][j - 1] + 1, tabla[i - 1][j - 1] + (a[i - 1] != b[j - 1]))
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                tabla[i][j] = min(tabla[i][j], tabla[i - 2][j - 2] + 1)
+    return tabla[len(a)][len(b)]
+
+def test_distancias_osa_igual_a_la_referencia():
+    azar = random.Random(0)
+    a = [''.join(azar.choice('FE01ñ') for _ in range(azar.randint(0, 10))) for _ in range(3_000)]
+    b = [''.join(azar.choice('FE01ñ') for _ in range(azar.randint(0, 10))) for _ in range(3_000)]
+    assert engine._distancias_osa(a, b).tolist() == [_osa(x, y) for x, y in zip(a, b)]
+    assert engine._distancias_osa(['FE1234', 'AB', ''], ['FE1243', 'BA', 'X']).tolist() == [1, 1, 1]
+
+def _sobrantes(dian, cont):
+    sob_d = pd.DataFrame(dian, columns=[engine.LLAVE_DIAN_CONT_COL_NAME, 'nit_emisor', 'total'])
+    sob_c = pd.DataFrame(cont, columns=['LLAVE_CONT', 'u_infoco01', 'u_saldo_f'])
+    return sob_d, sob_c
+
+def _emparejar(sob_d, sob_c):
+    return engine.emparejar_sobrantes_probables(sob_d, sob_c, 'total')
+
+def test_empareja_dentro_de_la_cubeta():
+    sob_d, sob_c = _sobrantes(
+        [('FE0123', '900123456', 1000.0), ('FE1243', '900123456', 5000.0)],
+        [('FE123', '900123456', 1000.0), ('FE1234', '900123456', 5004.0)])
+    prob, resto_d, resto_c = _emparejar(sob_d, sob_c)
+    assert list(zip(prob[engine.LLAVE_DIAN_CONT_COL_NAME], prob['LLAVE_CONT'], prob['REGLA_PROBABLE'])) == [
+        ('FE0123', 'FE123', 'SUFIJO_NUMERICO'), ('FE1243', 'FE1234', 'DISTANCIA_EDICION')]
+    assert resto_d.empty and resto_c.empty
+
+@pytest.mark.parametrize('llave_c, nit_c, monto_c', [
+    ('FE9876', '900123456', 5000.0),  # distancia de edición sobre el umbral
+    ('FE1234', '800999999', 5000.0),  # otro NIT
+    ('FE1234', '900123456', 5200.0),  # monto fuera de la tolerancia
+])
+def test_rechaza_fuera_de_los_limites(llave_c, nit_c, monto_c):
+    sob_d, sob_c = _sobrantes([('FE1243', '900123456', 5000.0)], [(llave_c, nit_c, monto_c)])
+    prob, resto_d, resto_c = _emparejar(sob_d, sob_c)
+    assert prob.empty
+    assert len(resto_d) == 1 and len(resto_c) == 1
+
+def test_empate_se_asigna_una_sola_vez():
+    # Dos documentos DIAN igual de parecidos al mismo documento contable: gana el primero
+    sob_d, sob_c = _sobrantes(
+        [('FE1243', '900123456', 5000.0), ('FE2134', '900123456', 5000.0)],
+        [('FE1234', '900123456', 5000.0)])
+    prob, resto_d, resto_c = _emparejar(sob_d, sob_c)
+    assert prob[engine.LLAVE_DIAN_CONT_COL_NAME].tolist() == ['FE1243']
+    assert resto_d[engine.LLAVE_DIAN_CONT_COL_NAME].tolist() == ['FE2134']
+    assert resto_c.empty
+    assert prob['CONFIANZA'].tolist() == [round(0.8 * (1 - 1 / 6) + 0.2, 3)]
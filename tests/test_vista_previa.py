@@ -0,0 +1,44 @@
+"""
+VistaPrevia con DuckDB y con pandas sobre el mismo Parquet: mismas páginas,
+en el orden del reporte (columna FILA), con y sin filtros.
+"""
+import pandas as pd
+import pytest
+
+pytest.importorskip('duckdb')
+
+import pipeline
+import vista_previa
+from benchmarks import generadores
+
+@pytest.fixture(scope='module')
+def vistas(tmp_path_factory):
+    rutas = generadores.generar_conjunto(str(tmp_path_factory.mktemp('datos')), filas_cont=1_500, semilla=11)
+    resultado = pipeline.conciliar(*(pipeline.abrir_entrada(rutas[rol]) for rol in ('dian', 'contabilidad', 'emitidos')), trabajadores=1)
+    tablas = pipeline.preparar_hojas(resultado, 1, vista_previa.COLUMNAS_VISTA)
+    directorio = tmp_path_factory.mktemp('vista')
+    ruta = vista_previa.guardar({nombre: tablas[hoja] for nombre, hoja, *_ in pipeline.hojas_reporte(resultado['df_dian_raw'])}, str(directorio))
+    duck, pandas_ = vista_previa.VistaPrevia(ruta), vista_previa.VistaPrevia(ruta)
+    pandas_._con = None
+    return duck, pandas_
+
+FILTROS = [{}, {'tipos': ['SOBRANTE_DIAN', 'SOBRANTE_CONT']}, {'nit': '9'}, {'empresa': 'proveedor', 'diferencia_min': 1_000}]
+
+@pytest.mark.parametrize('filtro', FILTROS)
+def test_mismas_paginas(vistas, filtro):
+    duck, pandas_ = vistas
+    assert duck.hojas() == pandas_.hojas()
+    for hoja in duck.hojas():
+        for pagina in (0, 1, 3):
+            (filas_d, total_d), (filas_p, total_p) = (v.consultar(hoja, pagina=pagina, por_pagina=40, **filtro) for v in vistas)
+            assert total_d == total_p
+            assert 'FILA' not in filas_d.columns and 'HOJA' not in filas_d.columns
+            pd.testing.assert_frame_equal(filas_d, filas_p, check_dtype=False, obj=f'{hoja} p{pagina}')
+
+def test_orden_del_reporte(vistas):
+    _, pandas_ = vistas
+    hoja = pandas_.hojas()[0]
+    filas, total = pandas_.consultar(hoja, por_pagina=10**6)
+    assert len(filas) == total > 0
+    claves = list(zip(filas['EMPRESA_GRUPO'].astype(str), filas['NIT'].astype(str)))
+    assert claves == sorted(claves)
@@ -0,0 +1,225 @@
+"""
+Cola de conciliaciones en segundo plano para la app.
+
+Cada trabajo queda en una tabla SQLite (estado, avance, mensaje, resultado) y
+corre en un pool de procesos propio del servidor, así que un rerun de
+Streamlit (tocar un widget) no lo interrumpe y varias sesiones comparten
+MAX_TRABAJOS_DEFECTO procesos. La interfaz solo consulta `estado(id)`.
+
+Los archivos de cada trabajo (entradas, reporte, vista previa, zip) viven en
+su propio directorio y se borran TTL_HORAS_DEFECTO horas después de terminar.
+
+La huella de un trabajo es el SHA-256 de los archivos de entrada, las opciones
+y VERSION_RESULTADOS: enviar de nuevo los mismos archivos devuelve el trabajo
+ya terminado (o el que sigue en curso) sin volver a conciliar.
+
+    cola = ColaTrabajos()
+    id_trabajo = cola.enviar({'dian': bytes_dian, 'contabilidad': bytes_cont}, {'probables': True})
+    cola.estado(id_trabajo)  # {'estado': 'corriendo', 'pct': 60, 'mensaje': 'Cruzando bases de datos...', ...}
+"""
+import contextlib
+import hashlib
+import json
+import multiprocessing
+import multiprocessing.util
+import os
+import shutil
+import sqlite3
+import time
+import uuid
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+
+import cache_disco
+import engine
+import perfilado
+import pipeline
+import vista_previa
+
+DIR_TRABAJOS_DEFECTO = os.environ.get('CONCILIADOR_TRABAJOS_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'conciliador', 'trabajos'))
+MAX_TRABAJOS_DEFECTO = int(os.environ.get('CONCILIADOR_TRABAJOS_MAX', 2))
+TTL_HORAS_DEFECTO = float(os.environ.get('CONCILIADOR_TRABAJOS_TTL_HORAS', 24))
+LIMPIEZA_CADA_SEG = 600
+# Subir cuando cambie el contenido del reporte: invalida los resultados guardados
+VERSION_RESULTADOS = '2'
+ROLES = ('dian', 'contabilidad', 'emitidos', 'recibidos')
+EN_CURSO = ('pendiente', 'corriendo')
+
+ESQUEMA = """
+CREATE TABLE IF NOT EXISTS trabajos (
+    id TEXT PRIMARY KEY,
+    huella TEXT NOT NULL,
+    estado TEXT NOT NULL,
+    pct INTEGER NOT NULL DEFAULT 0,
+    mensaje TEXT NOT NULL DEFAULT '',
+    opciones TEXT,
+    creado REAL,
+    inicio REAL,
+    fin REAL,
+    reporte TEXT,
+    registro TEXT,
+    detalle TEXT,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS trabajos_huella ON trabajos (huella);
+"""
+
+def _conectar(ruta_db):
+    con = sqlite3.connect(ruta_db, timeout=30)
+    con.row_factory = sqlite3.Row
+    con.execute('PRAGMA journal_mode=WAL')
+    return con
+
+def _actualizar(ruta_db, id_trabajo, **campos):
+    with contextlib.closing(_conectar(ruta_db)) as con, con:
+        con.execute(f"UPDATE trabajos SET {', '.join(f'{c} = ?' for c in campos)} WHERE id = ?", (*campos.values(), id_trabajo))
+
+def huella_entradas(archivos, opciones):
+    h = hashlib.sha256(f'{VERSION_RESULTADOS}|{engine.VERSION_LECTORES}|'.encode())
+    for rol in ROLES:
+        datos = archivos.get(rol)
+        h.update(f'{rol}:'.encode() + (hashlib.sha256(datos).digest() if datos is not None else b'-'))
+    h.update(json.dumps(opciones, sort_keys=True).encode())
+    return h.hexdigest()
+
+def _iniciar_proceso():
+    """Inicializador de cada proceso del pool: la misma configuración que la app."""
+    engine.configurar_cache(cache_disco.cache_por_contenido(engine.VERSION_LECTORES))
+    engine.configurar_normalizador_empresas()
+    perfilado.instrumentar()
+    # Al salir, multiprocessing espera a los procesos hijos antes de que concurrent.futures
+    # avise al pool anidado de pipeline que termine: sin esto el proceso no sale nunca.
+    # Prioridad por encima de la de las colas (10), que deben seguir abiertas para avisar
+    multiprocessing.util.Finalize(None, pipeline.cerrar_pools, exitpriority=100)
+
+def _correr(ruta_db, id_trabajo, directorio, opciones):
+    """Concilia las entradas guardadas en `directorio` y deja el reporte allí mismo; corre en el pool."""
+    _actualizar(ruta_db, id_trabajo, estado='corriendo', inicio=time.time())
+    def progreso(pct, mensaje):
+        _actualizar(ruta_db, id_trabajo, pct=pct, mensaje=mensaje)
+    entradas = {rol: os.path.join(directorio, f'entrada_{rol}') for rol in ROLES}
+    # Los contadores de la caché son del proceso: se guarda lo que sumó este trabajo
+    cache_antes = cache_disco.obtener_cache().estadisticas()
+    try:
+        with perfilado.Corrida(parametros=opciones) as corrida:
+            # ROLES está en el orden de los argumentos de pipeline.conciliar
+            archivos = [pipeline.abrir_entrada(r) if os.path.exists(r) else None for r in entradas.values()]
+            resultado = pipeline.conciliar(
+                *archivos, progreso, opciones.get('probables', False), opciones.get('por_monto', False), opciones.get('trabajadores'),
+            )
+            # Una sola preparación de hojas para el libro y para la vista previa
+            with pipeline._cronometro(resultado['tiempos'], 'preparar_hojas'):
+                tablas = pipeline.preparar_hojas(resultado, resultado['trabajadores'], vista_previa.COLUMNAS_VISTA)
+            # Se escribe aparte y se renombra: un reporte a medias nunca se toma por terminado
+            reporte = os.path.join(directorio, pipeline.NOMBRE_REPORTE)
+            pipeline.escribir_reporte(resultado, f'{reporte}.tmp.xlsx', progreso, tablas=tablas)
+            os.replace(f'{reporte}.tmp.xlsx', reporte)
+            with pipeline._cronometro(resultado['tiempos'], 'vista_previa'):
+                vista = vista_previa.guardar({nombre: tablas[hoja] for nombre, hoja, *_ in pipeline.hojas_reporte(resultado['df_dian_raw'])}, directorio)
+        engine.normalizador_empresas().guardar()
+        try: registro = corrida.guardar()
+        except OSError: registro = None
+        detalle = {'tiempos': resultado['tiempos'], 'trabajadores': resultado['trabajadores'], 'memoria_bases': resultado.get('memoria_bases'), 'vista': vista,
+                   'cache': {k: v - cache_antes[k] for k, v in cache_disco.obtener_cache().estadisticas().items()}}
+        _actualizar(ruta_db, id_trabajo, estado='terminado', pct=100, mensaje='Reporte generado.', fin=time.time(),
+                    reporte=reporte, registro=registro, detalle=json.dumps(detalle, default=str))
+    except Exception as e:
+        _actualizar(ruta_db, id_trabajo, estado='error', fin=time.time(), error=str(e) or type(e).__name__)
+    finally:
+        for ruta in entradas.values():
+            if os.path.exists(ruta): os.remove(ruta)
+
+def comprimir(ruta):
+    """Zip del archivo junto a él (se crea una sola vez, por bloques desde disco). Devuelve la ruta del zip."""
+    destino = f'{os.path.splitext(ruta)[0]}.zip'
+    if not os.path.exists(destino):
+        with zipfile.ZipFile(f'{destino}.tmp', 'w', zipfile.ZIP_DEFLATED) as zf:
+            zf.write(ruta, os.path.basename(ruta))
+        os.replace(f'{destino}.tmp', destino)
+    return destino
+
+class ColaTrabajos:
+    def __init__(self, directorio=DIR_TRABAJOS_DEFECTO, max_trabajos=MAX_TRABAJOS_DEFECTO, ttl_horas=TTL_HORAS_DEFECTO):
+        self.directorio = directorio
+        self.max_trabajos = max_trabajos
+        self.ttl_horas = ttl_horas
+        self._ultima_limpieza = 0
+        self.ruta_db = os.path.join(directorio, 'trabajos.db')
+        self._pool = None
+        os.makedirs(directorio, exist_ok=True)
+        with contextlib.closing(_conectar(self.ruta_db)) as con, con:
+            con.executescript(ESQUEMA)
+            # Lo que quedó en curso al caer el servidor anterior ya no tiene proceso que lo termine
+            con.execute("UPDATE trabajos SET estado = 'error', error = 'Interrumpido al reiniciar el servidor' WHERE estado IN (?, ?)", EN_CURSO)
+        self.limpiar()
+
+    def _pool_procesos(self):
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(self.max_trabajos, mp_context=multiprocessing.get_context('spawn'), initializer=_iniciar_proceso)
+        return self._pool
+
+    def enviar(self, archivos, opciones=None):
+        """
+        `archivos` = {rol: bytes} con los roles de ROLES ('dian' y 'contabilidad'
+        obligatorios). Devuelve el id del trabajo: uno nuevo, el que sigue en
+        curso con las mismas entradas o el último terminado cuyo reporte aún existe.
+        """
+        if time.time() - self._ultima_limpieza > LIMPIEZA_CADA_SEG: self.limpiar()
+        opciones = dict(opciones or {})
+        huella = huella_entradas(archivos, opciones)
+        with contextlib.closing(_conectar(self.ruta_db)) as con:
+            previos = con.execute(
+                "SELECT id, estado, reporte FROM trabajos WHERE huella = ? AND estado IN ('pendiente', 'corriendo', 'terminado') ORDER BY creado DESC",
+                (huella,)).fetchall()
+        for previo in previos:
+            if previo['estado'] in EN_CURSO or (previo['reporte'] and os.path.exists(previo['reporte'])):
+                return previo['id']
+
+        id_trabajo = uuid.uuid4().hex[:12]
+        directorio = os.path.join(self.directorio, id_trabajo)
+        os.makedirs(directorio, exist_ok=True)
+        for rol, datos in archivos.items():
+            if datos is None: continue
+            with open(os.path.join(directorio, f'entrada_{rol}'), 'wb') as f: f.write(datos)
+        with contextlib.closing(_conectar(self.ruta_db)) as con, con:
+            con.execute("INSERT INTO trabajos (id, huella, estado, mensaje, opciones, creado) VALUES (?, ?, 'pendiente', 'En cola...', ?, ?)",
+                        (id_trabajo, huella, json.dumps(opciones), time.time()))
+        self._pool_procesos().submit(_correr, self.ruta_db, id_trabajo, directorio, opciones)
+        return id_trabajo
+
+    def estado(self, id_trabajo):
+        """Fila del trabajo como dict (opciones y detalle ya decodificados); None si no existe."""
+        with contextlib.closing(_conectar(self.ruta_db)) as con:
+            fila = con.execute("SELECT * FROM trabajos WHERE id = ?", (id_trabajo,)).fetchone()
+        if fila is None: return None
+        trabajo = dict(fila)
+        for campo in ('opciones', 'detalle'):
+            trabajo[campo] = json.loads(trabajo[campo]) if trabajo[campo] else None
+        return trabajo
+
+    def limpiar(self):
+        """
+        Borra los directorios de los trabajos terminados (o con error) hace más
+        de `ttl_horas` y los que ya no tienen fila en la base. La fila queda
+        como historial; la app avisa que el reporte ya no está.
+        """
+        self._ultima_limpieza = time.time()
+        limite = self._ultima_limpieza - self.ttl_horas * 3600
+        with contextlib.closing(_conectar(self.ruta_db)) as con:
+            filas = con.execute("SELECT id, estado, COALESCE(fin, creado) AS fin FROM trabajos").fetchall()
+        conocidos = {f['id'] for f in filas}
+        vigentes = {f['id'] for f in filas if f['estado'] in EN_CURSO or (f['fin'] or 0) >= limite}
+        borrados = 0
+        for nombre in os.listdir(self.directorio):
+            ruta = os.path.join(self.directorio, nombre)
+            if not os.path.isdir(ruta) or nombre in vigentes: continue
+            # Directorio sin fila aún (enviar lo crea antes de insertar): se respeta hasta que venza
+            if nombre not in conocidos and os.path.getmtime(ruta) >= limite: continue
+            shutil.rmtree(ruta, ignore_errors=True)
+            borrados += 1
+        return borrados
+
+    def recientes(self, limite=20):
+        with contextlib.closing(_conectar(self.ruta_db)) as con:
+            filas = con.execute("SELECT id, estado, pct, mensaje, creado, fin FROM trabajos ORDER BY creado DESC LIMIT ?", (limite,)).fetchall()
+        return [dict(f) for f in filas]
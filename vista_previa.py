@@ -0,0 +1,107 @@
+"""
+Vista previa paginada del resultado dentro de la app, sin abrir el Excel.
+
+Al terminar una conciliación el detalle de las cuatro hojas se guarda en un
+Parquet ordenado por HOJA, EMPRESA_GRUPO y NIT (grupos de filas pequeños, así
+los filtros por empresa o NIT leen solo las partes que tocan), con FILA = su
+posición en ese orden: las dos rutas paginan por FILA. Las consultas
+filtran, cuentan y paginan del lado del servidor con DuckDB si está instalado
+y, si no, con pandas sobre la hoja pedida; al navegador solo llega la página.
+Los subtotales por empresa se calculan al pedirlos, sobre el mismo filtro.
+"""
+import os
+
+import pandas as pd
+
+import exportacion
+
+NOMBRE_VISTA = 'vista_previa.parquet'
+COLUMNAS_VISTA = exportacion.COLUMNAS_CONCILIACION + ['EMPRESA_GRUPO']
+FILAS_POR_GRUPO = 50_000
+FILAS_POR_PAGINA = 100
+TIPOS = ['COINCIDENCIA', 'COINCIDENCIA_PROBABLE', 'SOBRANTE_DIAN', 'SOBRANTE_CONT']
+COLUMNAS_SUMA = exportacion.COLUMNAS_SUMA
+
+def guardar(tablas, directorio):
+    """`tablas` = {cruce: tabla de preparar_reporte_cabify con COLUMNAS_VISTA}. Devuelve la ruta del Parquet."""
+    columnas = ['HOJA'] + [c for c in COLUMNAS_VISTA if c != 'GRUPO_TIPO']
+    detalle = exportacion.detalle_conciliacion(tablas).reindex(columns=columnas)
+    detalle = detalle.sort_values(['HOJA', 'EMPRESA_GRUPO', 'NIT'], kind='stable').reset_index(drop=True)
+    detalle['FILA'] = detalle.index
+    ruta = os.path.join(directorio, NOMBRE_VISTA)
+    exportacion.apto_parquet(detalle).to_parquet(ruta, index=False, row_group_size=FILAS_POR_GRUPO)
+    return ruta
+
+def _duckdb():
+    try:
+        import duckdb
+        return duckdb
+    except ImportError:
+        return None
+
+class VistaPrevia:
+    """Consultas sobre el Parquet de `guardar`; una instancia por resultado (se puede cachear en la app)."""
+    def __init__(self, ruta):
+        self.ruta = ruta
+        duckdb = _duckdb()
+        self._con = duckdb.connect() if duckdb else None
+        self._hojas = {}  # sin DuckDB: hoja -> DataFrame ya leído
+
+    def _sql(self, consulta, parametros):
+        # Un cursor por consulta: la app atiende cada sesión en su propio hilo
+        return self._con.cursor().execute(consulta, parametros)
+
+    def hojas(self):
+        if self._con is not None:
+            return [f[0] for f in self._sql("SELECT DISTINCT HOJA FROM read_parquet(?) ORDER BY 1", [self.ruta]).fetchall()]
+        return sorted(pd.read_parquet(self.ruta, columns=['HOJA'])['HOJA'].unique())
+
+    def _filtro_sql(self, hoja, empresa, nit, tipos, diferencia_min):
+        condiciones, parametros = ['HOJA = ?'], [hoja]
+        if empresa:
+            condiciones.append('EMPRESA_GRUPO ILIKE ?'); parametros.append(f'%{empresa}%')
+        if nit:
+            condiciones.append('NIT LIKE ?'); parametros.append(f'{nit}%')
+        if tipos:
+            condiciones.append(f"TIPO IN ({', '.join('?' * len(tipos))})"); parametros.extend(tipos)
+        if diferencia_min:
+            condiciones.append('ABS(DIFERENCIA) >= ?'); parametros.append(float(diferencia_min))
+        return ' AND '.join(condiciones), parametros
+
+    def _filtrar_pandas(self, hoja, empresa, nit, tipos, diferencia_min):
+        if hoja not in self._hojas:
+            self._hojas[hoja] = pd.read_parquet(self.ruta, filters=[('HOJA', '=', hoja)]).sort_values('FILA').reset_index(drop=True)
+        df = self._hojas[hoja]
+        mascara = pd.Series(True, index=df.index)
+        if empresa: mascara &= df['EMPRESA_GRUPO'].str.contains(empresa, case=False, regex=False, na=False)
+        if nit: mascara &= df['NIT'].str.startswith(nit, na=False)
+        if tipos: mascara &= df['TIPO'].isin(tipos)
+        if diferencia_min: mascara &= df['DIFERENCIA'].abs() >= float(diferencia_min)
+        return df[mascara]
+
+    def consultar(self, hoja, empresa=None, nit=None, tipos=None, diferencia_min=None, pagina=0, por_pagina=FILAS_POR_PAGINA):
+        """(filas de la página, total de filas que cumplen el filtro), en el orden del reporte."""
+        desde = max(pagina, 0) * por_pagina
+        if self._con is not None:
+            donde, parametros = self._filtro_sql(hoja, empresa, nit, tipos, diferencia_min)
+            total = self._sql(f"SELECT COUNT(*) FROM read_parquet(?) WHERE {donde}", [self.ruta, *parametros]).fetchone()[0]
+            pagina_df = self._sql(
+                f"SELECT * EXCLUDE (HOJA, FILA) FROM read_parquet(?) WHERE {donde} ORDER BY FILA LIMIT ? OFFSET ?",
+                [self.ruta, *parametros, por_pagina, desde]).df()
+            return pagina_df, total
+        df = self._filtrar_pandas(hoja, empresa, nit, tipos, diferencia_min)
+        return df.iloc[desde:desde + por_pagina].drop(columns=['HOJA', 'FILA']).reset_index(drop=True), len(df)
+
+    def subtotales(self, hoja, empresa=None, nit=None, tipos=None, diferencia_min=None, limite=50):
+        """Filas y sumas por EMPRESA_GRUPO del filtro, las `limite` con mayor diferencia absoluta."""
+        if self._con is not None:
+            donde, parametros = self._filtro_sql(hoja, empresa, nit, tipos, diferencia_min)
+            sumas = ', '.join(f'SUM("{c}") AS "{c}"' for c in COLUMNAS_SUMA)
+            return self._sql(
+                f"SELECT EMPRESA_GRUPO, COUNT(*) AS FILAS, {sumas} FROM read_parquet(?) WHERE {donde} "
+                f"GROUP BY EMPRESA_GRUPO ORDER BY ABS(SUM(DIFERENCIA)) DESC LIMIT ?",
+                [self.ruta, *parametros, limite]).df()
+        df = self._filtrar_pandas(hoja, empresa, nit, tipos, diferencia_min)
+        grupos = df.groupby('EMPRESA_GRUPO', sort=False)
+        tabla = pd.concat([grupos.size().rename('FILAS'), grupos[COLUMNAS_SUMA].sum()], axis=1).reset_index()
+        return tabla.reindex(tabla['DIFERENCIA'].abs().sort_values(ascending=False).index).head(limite).reset_index(drop=True)